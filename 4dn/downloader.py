@@ -1,13 +1,27 @@
-import pandas as pd
-import requests
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sys
 from urllib.parse import urlparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from hic_common.catalog import Catalog
+from hic_common.columnar import read_table
+from hic_common.download import (
+    MAX_SEGMENTS, SEGMENT_THRESHOLD, choose_segment_count, download_resumable, download_segmented, is_complete, parse_size
+)
+from hic_common.client import basic_auth, create_session
+from hic_common.scheduler import DownloadScheduler
+from hic_common.store import DownloadStore, group_duplicates
+
 # Constants
-EXCEL_FILE = "./4dn.xlsx"  # Update with the actual Excel file name
+EXCEL_FILE = "./4dn.xlsx"  # Scraper output: .xlsx, .parquet or .feather
 DOWNLOAD_DIR = "downloads"  # Update with the desired download directory
 MAX_THREADS = 5  # Adjust the number of threads as needed
+SEGMENTED = True  # Split large files into byte ranges fetched over parallel connections
+USE_STORE = True  # Keep files with an MD5 once in the shared content-addressed store and hard-link them here
+MAX_BYTES_PER_SECOND = None  # Cap on all downloads together, e.g. 100 * 1024 ** 2; None for no cap
+HOST_CONNECTIONS = 16  # Connections open to the portal at once, counting every segment
+DOWNLOAD_ORDER = "largest"  # "largest", "smallest" or "manifest"
+CATALOG_QUERY = None  # e.g. {"file_formats": ["mcool"], "biosource": "GM12878"} to pick 4DN files from the local catalog instead of EXCEL_FILE
 
 # Ensure download directory exists
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
@@ -30,51 +44,141 @@ def get_access_keys():
 # Retrieve access keys
 ACCESS_KEY_ID, ACCESS_KEY_SECRET = get_access_keys()
 
-def download_file(url, file_name):
-    """Download a file from the given URL and save it to the specified file name."""
+def get_session():
+    """One pooled session for all downloads, paced per host and backing off on 429/503."""
+    # Segmented downloads open up to MAX_SEGMENTS connections per file. The
+    # keys go on each request instead of the session, so download_segmented
+    # can keep them off the pre-signed storage URLs the portal redirects to.
+    return create_session(pool_size=MAX_THREADS * MAX_SEGMENTS)
+
+def download_file(url, file_name, expected_size=None, expected_md5=None, session=None):
+    """Download a file from the given URL and save it to the specified file name.
+
+    Partial data goes to a .part file that is resumed on the next attempt;
+    files already on disk with the expected size are skipped. Large files
+    are fetched as several byte ranges in parallel when SEGMENTED is on.
+    With an MD5 from the manifest the data is hashed while it streams and
+    a mismatching file is moved aside as .corrupt instead of being kept.
+    """
     try:
+        if expected_size is not None and is_complete(file_name, expected_size):
+            print(f"Skipping {file_name}, already complete")
+            return file_name
         print(f"Downloading {file_name}...")
-        with requests.get(url, auth=(ACCESS_KEY_ID, ACCESS_KEY_SECRET), stream=True) as response:
-            response.raise_for_status()
-            with open(file_name, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        auth = basic_auth(ACCESS_KEY_ID, ACCESS_KEY_SECRET)
+        if SEGMENTED and (expected_size is None or expected_size >= SEGMENT_THRESHOLD):
+            download_segmented(url, file_name, expected_size=expected_size, session=session, auth=auth, expected_md5=expected_md5)
+        else:
+            download_resumable(url, file_name, expected_size=expected_size, session=session, auth=auth, expected_md5=expected_md5)
         print(f"Downloaded {file_name}")
         return file_name
     except Exception as e:
         print(f"Failed to download {file_name}: {str(e)}")
         return None
 
+def download_to_store(store, group, session=None):
+    """Fetch one file into the shared store and link it to every manifest row that wants it."""
+    first = group[0]
+    views = [("4dn", os.path.splitext(os.path.basename(task["path"]))[0], task["path"]) for task in group]
+
+    def download(url, blob_path):
+        if download_file(url, blob_path, first["size"], first["md5"], session=session) is None:
+            raise IOError(f"Download of {url} failed")
+
+    try:
+        store.fetch(first["url"], first["md5"], first["size"], views, download)
+        return first["path"]
+    except Exception as e:
+        print(f"Failed to store {first['path']}: {str(e)}")
+        return None
+
 def get_file_name_from_url(url):
     """Extract the file name from the URL."""
     parsed_url = urlparse(url)
     return os.path.basename(parsed_url.path)
 
+def read_manifest(path):
+    """Load only the columns the downloader uses, tolerating manifests from older scraper versions."""
+    for columns in (["File", "File Size", "MD5"], ["File", "File Size"], ["File"]):
+        try:
+            return read_table(path, columns=columns)
+        except (KeyError, ValueError):
+            continue
+    raise ValueError(f"{path} has no File column")
+
+def read_catalog(query):
+    """Select 4DN files from the local catalog; returns (urls, sizes, md5s)."""
+    catalog = Catalog()
+    try:
+        rows = [row for row in catalog.query(sources=["4dn"], **query) if row["file_url"]]
+    finally:
+        catalog.close()
+    return [row["file_url"] for row in rows], [row["file_size"] for row in rows], [row["md5"] for row in rows]
+
 def main():
-    # Read the Excel file
-    if not os.path.exists(EXCEL_FILE):
-        print(f"Source Excel file {EXCEL_FILE} does not exist. Please run the scraper first or manually create the file.")
-        return
-    
-    df = pd.read_excel(EXCEL_FILE)
-    
-    # Extract file URLs
-    file_urls = df["File"].tolist()
+    if CATALOG_QUERY is not None:
+        file_urls, file_sizes, file_md5s = read_catalog(CATALOG_QUERY)
+        print(f"{len(file_urls)} files selected from the catalog")
+    else:
+        # Read the Excel file
+        if not os.path.exists(EXCEL_FILE):
+            print(f"Source Excel file {EXCEL_FILE} does not exist. Please run the scraper first or manually create the file.")
+            return
+
+        df = read_manifest(EXCEL_FILE)
+
+        # Extract file URLs, sizes and checksums
+        file_urls = df["File"].tolist()
+        file_sizes = df["File Size"].tolist() if "File Size" in df.columns else [None] * len(file_urls)
+        file_md5s = df["MD5"].tolist() if "MD5" in df.columns else [None] * len(file_urls)
     
     # Prepare download tasks
     download_tasks = []
-    for url in file_urls:
+    for url, size, md5 in zip(file_urls, file_sizes, file_md5s):
         file_name = os.path.join(DOWNLOAD_DIR, get_file_name_from_url(url))
-        download_tasks.append((url, file_name))
-    
-    # Download files using multi-threading
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        futures = [executor.submit(download_file, url, file_name) for url, file_name in download_tasks]
-        
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                print(f"Success: {result}")
+        md5 = md5 if isinstance(md5, str) and md5 else None
+        download_tasks.append({"url": url, "path": file_name, "size": parse_size(size), "md5": md5})
+
+    # Sets share processed files, so the same file can appear in many rows
+    groups = group_duplicates(download_tasks)
+    if len(groups) < len(download_tasks):
+        print(f"{len(download_tasks) - len(groups)} duplicate rows, downloading {len(groups)} files")
+    store = DownloadStore() if USE_STORE else None
+
+    # Largest files first, within the connection, bandwidth and disk budgets
+    session = get_session()
+    jobs = []
+    for group in groups:
+        task = group[0]
+        if store and task["md5"]:
+            run = lambda group=group: download_to_store(store, group, session=session)
+            path = store.blob_path(task["md5"])
+        else:
+            run = lambda task=task: download_file(task["url"], task["path"], task["size"], task["md5"], session=session)
+            path = task["path"]
+        # Without a size download_segmented learns it from the response and may open up to MAX_SEGMENTS
+        if not SEGMENTED:
+            segments = 1
+        elif task["size"] is None:
+            segments = MAX_SEGMENTS
+        else:
+            segments = choose_segment_count(task["size"])
+        jobs.append({"url": task["url"], "path": path, "size": task["size"], "connections": segments, "run": run})
+
+    def report(job, result, error):
+        if error:
+            print(f"Failed to download {job['path']}: {str(error)}")
+        elif result:
+            print(f"Success: {result}")
+
+    scheduler = DownloadScheduler(
+        workers=MAX_THREADS,
+        host_connections=HOST_CONNECTIONS,
+        max_bytes_per_second=MAX_BYTES_PER_SECOND,
+        directory=store.root if store else DOWNLOAD_DIR,
+        order=DOWNLOAD_ORDER,
+    )
+    scheduler.run(jobs, on_done=report)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
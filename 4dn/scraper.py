@@ -1,79 +1,141 @@
+import os
+import sys
 import requests
-import time
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from hic_common.columnar import write_table
+from hic_common.catalog import update_catalog
+from hic_common.client import create_session
+from hic_common.json_stream import iter_graph
+from hic_common.ratelimit import configure_host
+from hic_common.sink import RecordSink
+from hic_common.state import load_state, merge_with_previous, save_state, update_state
+
 TARGET_FILES = ["hic", "bedpe", "bw", "bedgraph", "cool", "tsv", "csv", "bed"]
+BROWSE_URL = "https://data.4dnucleome.org/browse/"
+SEARCH_URL = "https://data.4dnucleome.org/search/"
+DETAIL_URL_TEMPLATE = "https://data.4dnucleome.org/experiment-set-replicates/{title}/?format=json"
+LINK_PREFIX = "https://data.4dnucleome.org/files-processed/"
+OUTPUT_FORMAT = "xlsx"  # "parquet" or "feather" for typed columnar output
+OUTPUT_FILE = f"experiment_sets_test.{OUTPUT_FORMAT}"
+STREAM_FILE = "4dn_rows.jsonl"  # Rows are appended here as each set is processed
+EXPORT_EXCEL = True  # Compact the stream into OUTPUT_FILE once the crawl finishes
+UPDATE_CATALOG = True  # Upsert the rows into the shared local catalog (hic_common.catalog)
 
-def setup_session():
-    """Configure requests session with headers and retry policy"""
-    session = requests.Session()
+# Column types for the columnar formats
+OUTPUT_SCHEMA = {
+    "Study": "category",
+    "Condition": "category",
+    "Source Lab": "category",
+    "File Size": "Int64",
+    "MD5": "string",
+    "File Type": "category",
+    "File Type Detailed": "category",
+    "File Description": "category",
+    "Bio Source": "category",
+}
+PAGE_SIZE = 25
+USE_CACHE = True  # Serve repeat requests from the shared on-disk HTTP cache
+
+CONCURRENT = True  # Fetch experiment details through a worker pool
+MAX_WORKERS = 8  # Detail requests kept in flight at once
+PENDING_PER_WORKER = 4  # Detail requests queued or held per worker before browse paging waits
+REQUESTS_PER_SECOND = 4  # Starting rate for the portal; adapts to 429s from there
+MAX_REQUESTS_PER_SECOND = 10
+
+INCREMENTAL = False  # Only fetch sets modified since the last run and merge into its output
+STATE_FILE = "4dn_state.json"
+
+USE_PROJECTION = True  # Pull embedded processed_files from the search endpoint
+PROJECTED_PAGE_SIZE = 100
+STREAM_JSON = False  # Parse projected pages item by item as they arrive; pays off with a large PROJECTED_PAGE_SIZE (bypasses the HTTP cache)
 
+# Only the fields process_experiment_data reads
+PROJECTED_FIELDS = [
+    "display_title",
+    "last_modified.date_modified",
+    "dataset_label",
+    "description",
+    "study",
+    "condition",
+    "lab.display_title",
+    "processed_files.href",
+    "processed_files.file_size",
+    "processed_files.md5sum",
+    "processed_files.file_type",
+    "processed_files.file_type_detailed",
+    "processed_files.file_format.display_title",
+    "processed_files.open_data_url",
+    "processed_files.track_and_facet_info.biosource_name",
+]
+
+BASE_PARAMS = [
+    ('experiments_in_set.experiment_type.display_title', 'in situ Hi-C'),
+    ('experiments_in_set.experiment_type.display_title', 'Dilution Hi-C'),
+    ('experiments_in_set.experiment_type.display_title', 'Micro-C'),
+    ('experiments_in_set.experiment_type.display_title', 'DNase Hi-C'),
+    ('experiments_in_set.experiment_type.display_title', 'TCC'),
+    ('experiments_in_set.experiment_type.display_title', 'Electron Tomography'),
+    ('experiments_in_set.experiment_type.display_title', 'BLISS'),
+    ('experiments_in_set.experiment_type.display_title', 'MC-3C'),
+    ('experiments_in_set.experiment_type.display_title', 'MARGI'),
+    ('experiments_in_set.experiment_type.display_title', 'GAM'),
+    ('experiments_in_set.experiment_type.display_title', 'ChIA-Drop'),
+    ('experiments_in_set.experiment_type.display_title', 'DNA SPRITE'),
+    ('experiments_in_set.experiment_type.display_title', 'TrAC-loop'),
+    ('experiments_in_set.experiment_type.display_title', 'RNA-DNA SPRITE'),
+    ('experiments_in_set.experiment_type.display_title', 'Capture Hi-C'),
+    ('experiments_in_set.experiment_type.display_title', '4C-seq'),
+    ('experiments_in_set.experiment_type.display_title', 'sci-Hi-C'),
+    ('experiments_in_set.experiment_type.display_title', 'sn-Hi-C'),
+    ('experiments_in_set.experiment_type.display_title', 'single cell Hi-C'),
+    ('experiments_in_set.experiment_type.display_title', 'PLAC-seq'),
+    ('experiments_in_set.experiment_type.display_title', 'in situ ChIA-PET'),
+    ('experiments_in_set.experiment_type.display_title', 'HiChIP'),
+    ('experiments_in_set.experiment_type.display_title', 'ChIA-PET'),
+    ('experimentset_type', 'replicate'),
+    ('type', 'ExperimentSetReplicate'),
+]
+
+def setup_session(pool_size=10):
+    """Configure requests session with headers and retry policy"""
     headers = {
         "Accept": "application/json",
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
         "Referer": "https://data.4dnucleome.org/browse/?experiments_in_set.experiment_type.display_title=in+situ+Hi-C&experiments_in_set.experiment_type.display_title=Dilution+Hi-C&experiments_in_set.experiment_type.display_title=Micro-C&experiments_in_set.experiment_type.display_title=DNase+Hi-C&experiments_in_set.experiment_type.display_title=TCC&experimentset_type=replicate&type=ExperimentSetReplicate"
     }
 
-    retry_strategy = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    session.headers.update(headers)
-
-    return session
-
-def fetch_experiment_sets(session):
-    """Main scraping function with pagination and deduplication"""
-    base_params = [
-        ('experiments_in_set.experiment_type.display_title', 'in situ Hi-C'),
-        ('experiments_in_set.experiment_type.display_title', 'Dilution Hi-C'),
-        ('experiments_in_set.experiment_type.display_title', 'Micro-C'),
-        ('experiments_in_set.experiment_type.display_title', 'DNase Hi-C'),
-        ('experiments_in_set.experiment_type.display_title', 'TCC'),
-        ('experiments_in_set.experiment_type.display_title', 'Electron Tomography'),
-        ('experiments_in_set.experiment_type.display_title', 'BLISS'),
-        ('experiments_in_set.experiment_type.display_title', 'MC-3C'),
-        ('experiments_in_set.experiment_type.display_title', 'MARGI'),
-        ('experiments_in_set.experiment_type.display_title', 'GAM'),
-        ('experiments_in_set.experiment_type.display_title', 'ChIA-Drop'),
-        ('experiments_in_set.experiment_type.display_title', 'DNA SPRITE'),
-        ('experiments_in_set.experiment_type.display_title', 'TrAC-loop'),
-        ('experiments_in_set.experiment_type.display_title', 'RNA-DNA SPRITE'),
-        ('experiments_in_set.experiment_type.display_title', 'Capture Hi-C'),
-        ('experiments_in_set.experiment_type.display_title', '4C-seq'),
-        ('experiments_in_set.experiment_type.display_title', 'sci-Hi-C'),
-        ('experiments_in_set.experiment_type.display_title', 'sn-Hi-C'),
-        ('experiments_in_set.experiment_type.display_title', 'single cell Hi-C'),
-        ('experiments_in_set.experiment_type.display_title', 'PLAC-seq'),
-        ('experiments_in_set.experiment_type.display_title', 'in situ ChIA-PET'),
-        ('experiments_in_set.experiment_type.display_title', 'HiChIP'),
-        ('experiments_in_set.experiment_type.display_title', 'ChIA-PET'),
-        ('experimentset_type', 'replicate'),
-        ('type', 'ExperimentSetReplicate'),
-    ]
-
-    processed_titles = set()
+    configure_host("data.4dnucleome.org", REQUESTS_PER_SECOND, max_rate=MAX_REQUESTS_PER_SECOND)
+    return create_session(pool_size=pool_size, headers=headers, cache=USE_CACHE, incremental=INCREMENTAL)
+
+def build_base_params(modified_since=None):
+    """Browse/search filters, optionally limited to sets modified on or after a date"""
+    params = BASE_PARAMS.copy()
+    if modified_since:
+        params.append(('last_modified.date_modified.from', modified_since))
+    return params
+
+def fetch_experiment_sets(session, modified_since=None, skip_titles=(), on_record=None, on_error=None):
+    """Main scraping function with pagination and deduplication
+
+    Sets in skip_titles are not fetched. When on_record is given each set is
+    handed to it as soon as it arrives instead of being collected. A failed
+    request ends the walk and is reported to `on_error(key, error)`.
+    """
+    processed_titles = set(skip_titles)
     experiment_data = []
-    page_size = 25
+    page_size = PAGE_SIZE
     current_page = 0
 
     while True:
-        params = base_params.copy()
+        params = build_base_params(modified_since)
         params.append(('from', str(current_page * page_size)))
         print("Fetching page", current_page)
         try:
-            response = session.get(
-                "https://data.4dnucleome.org/browse/",
-                params=params
-            )
+            response = session.get(BROWSE_URL, params=params)
             response.raise_for_status()
 
             data = response.json()
@@ -89,23 +151,174 @@ def fetch_experiment_sets(session):
                     continue
 
                 # Fetch experiment details
-                exp_response = session.get(
-                    f"https://data.4dnucleome.org/experiment-set-replicates/{title}/?format=json"
-                )
+                exp_response = session.get(DETAIL_URL_TEMPLATE.format(title=title))
                 exp_response.raise_for_status()
                 print("Fetching experiment: ", title)
                 # print("")
-                experiment_data.append(exp_response.json())
+                if on_record:
+                    on_record(exp_response.json())
+                else:
+                    experiment_data.append(exp_response.json())
                 processed_titles.add(title)
 
-                # Rate limiting between item requests
-                time.sleep(0.5)
+            current_page += 1
+        except requests.exceptions.RequestException as e:
+            print(f"Request failed: {e}")
+            if on_error:
+                on_error(f"page:{current_page}", e)
+            break
+
+    return experiment_data
+
+
+def fetch_experiment_detail(session, title):
+    """Fetch one experiment set document"""
+    exp_response = session.get(DETAIL_URL_TEMPLATE.format(title=title))
+    exp_response.raise_for_status()
+    print("Fetching experiment: ", title)
+    return exp_response.json()
+
+
+def fetch_experiment_sets_concurrent(session, max_workers=None, modified_since=None, skip_titles=(), on_record=None, on_error=None):
+    """Concurrent variant of fetch_experiment_sets.
+
+    Pages are walked on the calling thread while detail requests run in a
+    bounded worker pool, so page fetching overlaps with detail fetching. All
+    requests are paced by the session's per-host limiter. At most
+    `max_workers * PENDING_PER_WORKER` details are submitted but not yet
+    handed over, so paging waits for slow details instead of piling up
+    futures. Results keep browse order and the same display_title
+    deduplication as the sequential path; failed pages and details go to
+    `on_error(key, error)`. `max_workers` defaults to MAX_WORKERS at call
+    time.
+    """
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    backlog = max_workers * PENDING_PER_WORKER
+    processed_titles = set(skip_titles)
+    pending = deque()
+    experiment_data = []
+    current_page = 0
+
+    def drain(keep=None):
+        # Hand over finished results in browse order; with `keep`, wait until at most that many are left
+        while pending and (pending[0][1].done() or (keep is not None and len(pending) > keep)):
+            title, future = pending.popleft()
+            try:
+                item = future.result()
+            except requests.exceptions.RequestException as e:
+                print(f"Request failed for {title}: {e}")
+                if on_error:
+                    on_error(title, e)
+                continue
+            if on_record:
+                on_record(item)
+            else:
+                experiment_data.append(item)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            params = build_base_params(modified_since)
+            params.append(('from', str(current_page * PAGE_SIZE)))
+            print("Fetching page", current_page)
+            try:
+                response = session.get(BROWSE_URL, params=params)
+                response.raise_for_status()
+                items = response.json().get("@graph", [])
+            except requests.exceptions.RequestException as e:
+                print(f"Request failed: {e}")
+                if on_error:
+                    on_error(f"page:{current_page}", e)
+                break
+
+            if not items:
+                print("All items exhausted!")
+                break
+
+            for item in items:
+                title = item.get("display_title")
+                if not title or title in processed_titles:
+                    continue
+                processed_titles.add(title)
+                drain(keep=backlog - 1)
+                pending.append((title, executor.submit(fetch_experiment_detail, session, title)))
+
+            drain()
+            current_page += 1
+
+        drain(keep=0)
+
+    return experiment_data
+
+
+def is_projection_complete(item):
+    """Check that a projected search record carries everything we need"""
+    if not item.get("display_title"):
+        return False
+    for file in item.get("processed_files", []):
+        if not file.get("href") or not file.get("file_format", {}).get("display_title"):
+            return False
+    return True
+
+
+def fetch_experiment_sets_projected(session, page_size=PROJECTED_PAGE_SIZE, modified_since=None, skip_titles=(), on_record=None, stream=STREAM_JSON, on_error=None):
+    """Fetch experiment sets with embedded processed_files in a few search calls.
+
+    Uses field= projection so each page only carries what
+    process_experiment_data reads. Records whose projection comes back
+    incomplete fall back to the per-item detail request. With stream=True
+    each page is parsed as it arrives instead of after the whole body. As
+    in fetch_experiment_sets, a failed request ends the walk and goes to
+    `on_error(key, error)`.
+    """
+    processed_titles = set(skip_titles)
+    experiment_data = []
+    current_page = 0
+
+    while True:
+        params = build_base_params(modified_since)
+        params += [('field', field) for field in PROJECTED_FIELDS]
+        params += [
+            ('format', 'json'),
+            ('limit', str(page_size)),
+            ('from', str(current_page * page_size)),
+        ]
+        print("Fetching page", current_page)
+        try:
+            with session.get(SEARCH_URL, params=params, stream=stream) as response:
+                # The search endpoint answers 404 once the result set is exhausted
+                if response.status_code == 404:
+                    print("All items exhausted!")
+                    break
+                response.raise_for_status()
+                items = iter_graph(response) if stream else response.json().get("@graph", [])
+
+                count = 0
+                for item in items:
+                    count += 1
+                    title = item.get("display_title")
+                    if not title or title in processed_titles:
+                        continue
+
+                    if not is_projection_complete(item):
+                        print("Incomplete projection, fetching experiment: ", title)
+                        item = fetch_experiment_detail(session, title)
+
+                    if on_record:
+                        on_record(item)
+                    else:
+                        experiment_data.append(item)
+                    processed_titles.add(title)
+
+            if not count:
+                print("All items exhausted!")
+                break
 
             current_page += 1
-            # Rate limiting between page requests
-            # time.sleep(0.5)
         except requests.exceptions.RequestException as e:
             print(f"Request failed: {e}")
+            if on_error:
+                on_error(f"page:{current_page}", e)
             break
 
     return experiment_data
@@ -124,7 +337,7 @@ def process_experiment_data(experiment_data):
             "Condition": item.get("condition", ""),
             "Source Lab": item.get("lab", {}).get("display_title", ""),
 
-            "4DN Link": "https://data.4dnucleome.org/files-processed/" + item.get("display_title", ""),
+            "4DN Link": LINK_PREFIX + item.get("display_title", ""),
         }
 
         # Extract files
@@ -144,6 +357,7 @@ def process_experiment_data(experiment_data):
                     **base_data,
                     "File": "https://data.4dnucleome.org" + file.get("href", ""),
                     "File Size": file.get("file_size", ""),
+                    "MD5": file.get("md5sum", ""),
                     "File Type": file.get("file_type", {}),
                     "File Type Detailed": file.get("file_type_detailed", {}), 
                     "File Description": file.get("file_format", {}).get("display_title", ""),
@@ -154,12 +368,88 @@ def process_experiment_data(experiment_data):
     return processed_rows
 
 
+def catalog_record(row):
+    """Map an output row onto the cross-source catalog columns"""
+    file_url = row.get("File", "")
+    return {
+        "source": "4dn",
+        "accession": os.path.basename(file_url).split(".")[0],
+        "record_accession": row.get("4DN Link", "").rsplit("/", 1)[-1],
+        "title": row.get("Title"),
+        "file_url": file_url,
+        "file_format": row.get("File Description"),
+        "file_size": row.get("File Size"),
+        "md5": row.get("MD5"),
+        "biosource": row.get("Bio Source"),
+        "lab": row.get("Source Lab"),
+        "extra": {key: row.get(key) for key in ("Study", "Condition", "File Type", "File Type Detailed", "Open Data URL")},
+    }
+
+
+def main():
+    state = load_state(STATE_FILE) if INCREMENTAL else None
+    modified_since = state["watermark"] if state else None
+    if modified_since:
+        print("Fetching experiment sets modified since", modified_since)
+
+    sink = RecordSink(STREAM_FILE)
+    if sink.done_keys:
+        print(f"Resuming, {len(sink.done_keys)} experiment sets already in {STREAM_FILE}")
+
+    def on_record(item):
+        sink.write(
+            item["display_title"],
+            process_experiment_data([item]),
+            meta={"date_modified": item.get("last_modified", {}).get("date_modified", "")}
+        )
+
+    failures = {}
+    options = {
+        "modified_since": modified_since,
+        "skip_titles": set(sink.done_keys),
+        "on_record": on_record,
+        "on_error": failures.__setitem__,
+    }
+    if USE_PROJECTION:
+        session = setup_session()
+        fetch_experiment_sets_projected(session, **options)
+    elif CONCURRENT:
+        session = setup_session(pool_size=MAX_WORKERS + 1)
+        fetch_experiment_sets_concurrent(session, **options)
+    else:
+        session = setup_session()
+        fetch_experiment_sets(session, **options)
+
+    print(f"Collected {len(sink.done_keys)} experiment sets")
+
+    if EXPORT_EXCEL:
+        rows = list(sink.iter_rows())
+        if INCREMENTAL:
+            changed_links = [LINK_PREFIX + title for title in sink.done_keys]
+            df = merge_with_previous(state["output"], rows, "4DN Link", changed_links)
+        else:
+            df = pd.DataFrame(rows)
+        write_table(df, OUTPUT_FILE, schema=OUTPUT_SCHEMA)
+        print(f"{OUTPUT_FILE} created successfully")
+
+    if INCREMENTAL and failures:
+        print(f"⚠️ {len(failures)} requests failed, leaving the watermark where it was so the next run retries them")
+    elif INCREMENTAL:
+        changes = {title: meta.get("date_modified", "") for title, meta in sink.meta().items()}
+        # The search filter works on whole days
+        dates = [date for date in changes.values() if date]
+        output = OUTPUT_FILE if EXPORT_EXCEL else state["output"]
+        update_state(state, changes, output, watermark=max(dates)[:10] if dates else None)
+        save_state(STATE_FILE, state)
+
+    if UPDATE_CATALOG:
+        update_catalog(catalog_record(row) for row in sink.iter_rows())
+    sink.close(complete=not failures)
+    if failures:
+        print(f"❌ {len(failures)} fetches failed, rerun to resume from {STREAM_FILE}")
+        sys.exit(1)
+    return OUTPUT_FILE if EXPORT_EXCEL else None
+
+
 if __name__ == "__main__":
-    session = setup_session()
-    data = fetch_experiment_sets(session)
-
-    print(f"Collected {len(data)} experiment sets")
-    processed_data = process_experiment_data(data)
-    df = pd.DataFrame(processed_data)
-    df.to_excel("experiment_sets_test.xlsx", index=False)
-    print("Excel file created successfully")
+    main()
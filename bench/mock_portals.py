@@ -0,0 +1,464 @@
+"""Local stand-ins for the portals, for benchmarking without the network.
+
+One HTTP server answers for every source under its own path prefix
+(/4dn, /encode, /eutils, /synapse, /cavatica) plus /blob/<name>?size=N,
+a range-capable synthetic file of any size. Point a scraper module at it
+with point_sources_at(); the response shapes follow what the scrapers
+read, not the full portal documents.
+
+Datasets are synthetic by default. A recorded one can be dropped into
+FIXTURE_DIR as <source>.json (same structure as build_dataset returns for
+that source) to be served instead.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PATTERN_SIZE = 1024 * 1024  # Blob bodies repeat this many random bytes
+PATTERN = random.Random(0).randbytes(PATTERN_SIZE)
+WRITE_CHUNK = 256 * 1024
+DEFAULT_PAGE_SIZE = 25  # 4DN browse page size when no limit is sent
+
+TARGET_FORMATS = ["hic", "bedpe", "bw", "bedgraph", "cool", "tsv", "csv", "bed"]
+ENCODE_FORMATS = ["hic", "bedpe", "bigWig", "bed", "fastq"]  # fastq is filtered out by the scraper
+
+
+def build_dataset(scale=1, seed=0):
+    """Synthetic records for every source; `scale` multiplies the record counts."""
+    rng = random.Random(seed)
+    data = {}
+
+    data["4dn"] = [
+        {
+            "display_title": f"4DNES{index:07d}",
+            "dataset_label": f"Dataset {index}",
+            "description": "In situ Hi-C on a synthetic cell line " * 4,
+            "study": "Synthetic study",
+            "condition": rng.choice(["Control", "Treated", "Heat shock"]),
+            "lab": {"display_title": f"Lab {index % 20}"},
+            "last_modified": {"date_modified": f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T00:00:00"},
+            "processed_files": [
+                {
+                    "href": f"/files-processed/4DNFI{index:05d}{n}/@@download/4DNFI{index:05d}{n}.{fmt}",
+                    "file_size": rng.randrange(10 ** 6, 10 ** 10),
+                    "md5sum": hashlib.md5(f"{index}-{n}".encode()).hexdigest(),
+                    "file_type": "contact list-combined",
+                    "file_type_detailed": f"contact list-combined ({fmt})",
+                    "file_format": {"display_title": fmt},
+                    "open_data_url": f"https://4dn-open-data-public.s3.amazonaws.com/4DNFI{index:05d}{n}.{fmt}",
+                    "track_and_facet_info": {"biosource_name": "GM12878"},
+                }
+                for n, fmt in enumerate(rng.sample(TARGET_FORMATS + ["fastq", "pairs"], 4))
+            ],
+        }
+        for index in range(200 * scale)
+    ]
+
+    experiments = [
+        {
+            "@id": f"/experiments/ENCSR{index:06d}/",
+            "assay_term_name": rng.choice(["in situ Hi-C", "intact Hi-C", "ChIA-PET"]),
+            "description": "Synthetic ENCODE experiment",
+            "date_released": f"2023-{index % 12 + 1:02d}-{index % 28 + 1:02d}",
+            "lab": {"title": f"Lab {index % 30}", "institute_name": "Synthetic Institute"},
+            "biosample_summary": "Homo sapiens K562",
+        }
+        for index in range(300 * scale)
+    ]
+    files = [
+        {
+            "@id": f"/files/ENCFF{index:06d}{n}/",
+            "dataset": experiment["@id"],
+            "href": f"/files/ENCFF{index:06d}{n}/@@download/ENCFF{index:06d}{n}.{fmt}",
+            "file_format": fmt,
+            "output_type": "contact matrix",
+            "file_size": rng.randrange(10 ** 6, 10 ** 10),
+            "md5sum": hashlib.md5(f"encode-{index}-{n}".encode()).hexdigest(),
+        }
+        for index, experiment in enumerate(experiments)
+        for n, fmt in enumerate(rng.sample(ENCODE_FORMATS, 3))
+    ]
+    data["encode"] = {"experiments": experiments, "files": files}
+
+    data["geo"] = [
+        {
+            "uid": str(200000000 + index),
+            "accession": f"GSE{100000 + index}",
+            "title": f"Synthetic GEO series {index}",
+            "summary": "Chromatin conformation capture in a synthetic model. " * 6,
+            "taxon": rng.choice(["Homo sapiens", "Mus musculus"]),
+            "gdstype": "Other",
+            "n_samples": rng.randrange(1, 40),
+            "bioproject": f"PRJNA{500000 + index}",
+            "pubmedids": [str(30000000 + index)],
+            "ftplink": f"ftp://ftp.ncbi.nlm.nih.gov/geo/series/GSE{100000 + index}/",
+            "samples": [{"accession": f"GSM{index}{n}", "title": f"Sample {n}"} for n in range(3)],
+        }
+        for index in range(2000 * scale)
+    ]
+
+    data["synapse"] = [
+        {
+            "id": f"syn{1000000 + index}",
+            "name": f"sample_{index}.{TARGET_FORMATS[index % len(TARGET_FORMATS)]}",
+            "annotations": {
+                "assay": {"type": "STRING", "value": ["Hi-C"]},
+                "tissue": {"type": "STRING", "value": [rng.choice(["brain", "liver", "blood"])]},
+            },
+            "dataFileHandleId": str(9000000 + index),
+        }
+        for index in range(400 * scale)
+    ]
+
+    data["cavatica"] = [
+        {
+            "id": f"{index:024x}",
+            "name": f"BS_{index:06d}." + ("vcf.gz" if index % 3 else "cram"),
+            "size": rng.randrange(10 ** 5, 10 ** 7),
+        }
+        for index in range(1000 * scale)
+    ]
+
+    for source in data:
+        path = os.path.join(FIXTURE_DIR, f"{source}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                data[source] = json.load(f)
+    return data
+
+
+def blob_md5(size):
+    """MD5 of the synthetic body served for /blob/<name>?size=<size>."""
+    digest = hashlib.md5()
+    position = 0
+    while position < size:
+        chunk = pattern_slice(position, min(size, position + WRITE_CHUNK))
+        digest.update(chunk)
+        position += len(chunk)
+    return digest.hexdigest()
+
+
+def pattern_slice(start, end):
+    """Bytes [start, end) of the endless repeating PATTERN, at most one pattern long."""
+    offset = start % PATTERN_SIZE
+    length = min(end - start, PATTERN_SIZE - offset)
+    return PATTERN[offset:offset + length]
+
+
+class MockPortals:
+    """Threaded local server for all portals.
+
+    `latency` (seconds) is added to every response, `throttle_rate` is the
+    fraction of metadata requests answered with 429 and `Retry-After:
+    retry_after`, and `throttle_blobs` extends the 429s to file bodies.
+    `counts` tallies requests per source prefix.
+    """
+
+    def __init__(self, data=None, latency=0.0, throttle_rate=0.0, retry_after=0, throttle_blobs=False, seed=0):
+        self.data = data if data is not None else build_dataset()
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.throttle_blobs = throttle_blobs
+        self.counts = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._experiment_index = {item["@id"]: item for item in self.data["encode"]["experiments"]}
+        self._4dn_index = {item["display_title"]: item for item in self.data["4dn"]}
+        self._synapse_index = {item["id"]: item for item in self.data["synapse"]}
+        self._cavatica_index = {item["id"]: item for item in self.data["cavatica"]}
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host="127.0.0.1", port=0):
+        portals = self
+
+        class Handler(PortalHandler):
+            pass
+
+        Handler.portals = portals
+        self._server = QuietHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._server.request_queue_size = 128
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def should_throttle(self, source):
+        if not self.throttle_rate or (source == "blob" and not self.throttle_blobs):
+            return False
+        with self._lock:
+            return self._rng.random() < self.throttle_rate
+
+    def count(self, source):
+        with self._lock:
+            self.counts[source] = self.counts.get(source, 0) + 1
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-body (cancelled downloads, closed pools) are expected
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class PortalHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse shows up in the numbers
+    portals = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle plus
+        # delayed ACKs add ~40 ms to every keep-alive response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_HEAD(self):
+        self.dispatch()
+
+    def dispatch(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        body = self.read_body()
+        source = parsed.path.split("/")[1] if parsed.path.count("/") else ""
+        portals = self.portals
+        portals.count(source)
+
+        if portals.latency:
+            time.sleep(portals.latency)
+        if portals.should_throttle(source):
+            self.send_json({"message": "Too many requests"}, status=429, headers={"Retry-After": str(portals.retry_after)})
+            return
+
+        handler = getattr(self, f"serve_{source}", None)
+        if handler is None:
+            self.send_json({"error": f"unknown path {parsed.path}"}, status=404)
+            return
+        handler(parsed.path, query, body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def send_json(self, payload, status=200, headers=None):
+        content = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    # 4DN: /4dn/browse/, /4dn/search/, /4dn/experiment-set-replicates/<title>/
+    def serve_4dn(self, path, query, body):
+        sets = self.portals.data["4dn"]
+        match = re.fullmatch(r"/4dn/experiment-set-replicates/([^/]+)/", path)
+        if match:
+            item = self.portals._4dn_index.get(match.group(1))
+            self.send_json(item or {"error": "not found"}, status=200 if item else 404)
+            return
+
+        start = int(query.get("from", ["0"])[0])
+        limit = int(query.get("limit", [str(DEFAULT_PAGE_SIZE)])[0])
+        page = sets[start:start + limit]
+        if path == "/4dn/search/" and not page:
+            self.send_json({"@graph": [], "notification": "No results found"}, status=404)
+            return
+        if path == "/4dn/browse/":
+            # Browse results only carry the summary fields
+            page = [{"display_title": item["display_title"]} for item in page]
+        self.send_json({"@graph": page, "total": len(sets)})
+
+    # ENCODE: /encode/search/?type=Experiment|File, /encode/experiments/<accession>/
+    def serve_encode(self, path, query, body):
+        data = self.portals.data["encode"]
+        if path == "/encode/search/":
+            if query.get("type") == ["File"]:
+                formats = set(query.get("file_format", []))
+                files = [f for f in data["files"] if not formats or f["file_format"] in formats]
+                self.send_json({"@graph": files})
+            else:
+                self.send_json({"@graph": data["experiments"]})
+            return
+
+        experiment = self.portals._experiment_index.get(path[len("/encode"):])
+        if experiment is None:
+            self.send_json({"error": "not found"}, status=404)
+            return
+        files = [f for f in data["files"] if f["dataset"] == experiment["@id"]]
+        self.send_json({**experiment, "files": files})
+
+    # NCBI E-utilities: /eutils/esearch.fcgi, /eutils/esummary.fcgi
+    def serve_eutils(self, path, query, body):
+        datasets = self.portals.data["geo"]
+        if path.endswith("esearch.fcgi"):
+            if query.get("usehistory") == ["y"]:
+                self.send_json({"esearchresult": {"count": str(len(datasets)), "webenv": "MOCK_WEBENV", "querykey": "1"}})
+                return
+            start = int(query.get("retstart", ["0"])[0])
+            count = int(query.get("retmax", ["20"])[0])
+            ids = [item["uid"] for item in datasets[start:start + count]]
+            self.send_json({"esearchresult": {"count": str(len(datasets)), "idlist": ids}})
+            return
+
+        if "id" in query:
+            wanted = set(query["id"][0].split(","))
+            docs = [item for item in datasets if item["uid"] in wanted]
+        else:
+            start = int(query.get("retstart", ["0"])[0])
+            count = int(query.get("retmax", ["20"])[0])
+            docs = datasets[start:start + count]
+        result = {"uids": [item["uid"] for item in docs]}
+        result.update({item["uid"]: item for item in docs})
+        self.send_json({"result": result})
+
+    # Synapse: POST /synapse/repo/v1/search, POST /synapse/repo/v1/entity/<id>/bundle2
+    def serve_synapse(self, path, query, body):
+        entities = self.portals.data["synapse"]
+        if path.endswith("/search"):
+            body = body or {}
+            terms = {term["key"]: term["value"] for term in body.get("booleanQuery", [])}
+            wanted = terms.get("name")
+            hits = [
+                {"id": item["id"], "name": item["name"]}
+                for item in entities
+                if not wanted or wanted in item["name"]
+            ]
+            start = body.get("start", 0)
+            size = body.get("size", 10)
+            self.send_json({"found": len(hits), "start": start, "hits": hits[start:start + size]})
+            return
+
+        match = re.fullmatch(r"/synapse/repo/v1/entity/([^/]+)/bundle2", path)
+        item = self.portals._synapse_index.get(match.group(1)) if match else None
+        if item is None:
+            self.send_json({"reason": "not found"}, status=404)
+            return
+        self.send_json({
+            "entity": {"id": item["id"], "name": item["name"], "dataFileHandleId": item["dataFileHandleId"]},
+            "annotations": {"id": item["id"], "annotations": item["annotations"]},
+        })
+
+    # CAVATICA: /cavatica/v2/files/<parent>/list, /cavatica/v2/files/<id>/download_info
+    def serve_cavatica(self, path, query, body):
+        files = self.portals.data["cavatica"]
+        if path.endswith("/list"):
+            start = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", ["50"])[0])
+            self.send_json(
+                {"items": files[start:start + limit]},
+                headers={"X-Total-Matching-Query": str(len(files))}
+            )
+            return
+
+        match = re.fullmatch(r"/cavatica/v2/files/([^/]+)/download_info", path)
+        item = self.portals._cavatica_index.get(match.group(1)) if match else None
+        if item is None:
+            self.send_json({"message": "not found"}, status=404)
+            return
+        self.send_json({"url": f"{self.portals.base_url}/blob/{item['name']}?size={item['size']}"})
+
+    # Files: /blob/<name>?size=<bytes>, honouring single Range requests
+    def serve_blob(self, path, query, body):
+        size = int(query.get("size", ["0"])[0])
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if range_header:
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header.strip())
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+
+        position = start
+        try:
+            while position <= end:
+                chunk = pattern_slice(position, min(end + 1, position + WRITE_CHUNK))
+                self.wfile.write(chunk)
+                position += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def point_sources_at(base_url, modules):
+    """Rewrite the portal URL constants of loaded source modules to the mock server.
+
+    `modules` maps source name -> module as returned by crawl_all.load_source.
+    """
+    settings = {
+        "4dn": {
+            "BROWSE_URL": f"{base_url}/4dn/browse/",
+            "SEARCH_URL": f"{base_url}/4dn/search/",
+            "DETAIL_URL_TEMPLATE": base_url + "/4dn/experiment-set-replicates/{title}/?format=json",
+            "USE_CACHE": False,
+        },
+        "encode": {
+            "PORTAL_URL": f"{base_url}/encode",
+            "SEARCH_URL": f"{base_url}/encode/search/",
+            "USE_CACHE": False,
+        },
+        "geo": {
+            "ESEARCH_URL": f"{base_url}/eutils/esearch.fcgi",
+            "ESUMMARY_URL": f"{base_url}/eutils/esummary.fcgi",
+            "USE_CACHE": False,
+        },
+        "synapse": {
+            "SEARCH_URL": f"{base_url}/synapse/repo/v1/search",
+            "BUNDLE_URL_TEMPLATE": base_url + "/synapse/repo/v1/entity/{id}/bundle2",
+            "USE_CACHE": False,
+        },
+        "cavatica": {
+            "API_URL": f"{base_url}/cavatica/v2",
+            "USE_CACHE": False,
+        },
+    }
+    for name, module in modules.items():
+        for key, value in settings.get(name, {}).items():
+            setattr(module, key, value)
+    return modules
@@ -0,0 +1,289 @@
+"""Offline throughput benchmarks against the mock portals.
+
+Usage: python bench/run_benchmarks.py [benchmark ...]   (default: all)
+
+Starts bench/mock_portals.py on localhost and runs each benchmark in a
+fresh process pointed at it, so peak RSS is measured per benchmark.
+Reports records/s, bytes/s, request count and peak RSS, and writes the
+same numbers as JSON to RESULTS_FILE. Tune LATENCY, THROTTLE_RATE and
+SCALE below to model a slow or throttling portal.
+"""
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+from mock_portals import MockPortals, blob_md5, build_dataset, point_sources_at
+
+LATENCY = 0.005  # Seconds added to every mock response
+THROTTLE_RATE = 0.0  # Fraction of metadata requests answered with 429
+RETRY_AFTER = 0  # Retry-After sent with those 429s
+SCALE = 1  # Multiplies the synthetic record counts
+MOCK_REQUESTS_PER_SECOND = 1000  # Host limit for the mock server, so the portal, not the limiter, is measured
+BLOB_SIZE = 256 * 1024 ** 2  # Size of each large file body
+DOWNLOAD_FILES = 4  # Large files fetched by the downloader benchmarks
+RESULTS_FILE = os.path.join(BENCH_DIR, "results.json")
+
+# Credentials the scripts insist on; the mock server ignores them
+os.environ.setdefault("SYNAPSE_TOKEN", "mock")
+os.environ.setdefault("SBG_AUTH_TOKEN", "mock")
+os.environ.setdefault("4DN_ACCESS_KEY_ID", "mock")
+os.environ.setdefault("4DN_ACCESS_KEY_SECRET", "mock")
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+
+def load(name, base_url):
+    from crawl_all import SOURCES, load_source
+    module = load_source(name, SOURCES[name])
+    point_sources_at(base_url, {name: module})
+    return module
+
+
+def blob_url(base_url, name, size=BLOB_SIZE):
+    return f"{base_url}/blob/{name}?size={size}"
+
+
+def bench_4dn_fetch_experiment_sets(base_url, workdir):
+    module = load("4dn", base_url)
+    records = []
+    module.fetch_experiment_sets(module.setup_session(), on_record=records.append)
+    return len(records), 0
+
+
+def bench_4dn_fetch_concurrent(base_url, workdir):
+    module = load("4dn", base_url)
+    records = []
+    session = module.setup_session(pool_size=module.MAX_WORKERS + 1)
+    module.fetch_experiment_sets_concurrent(session, on_record=records.append)
+    return len(records), 0
+
+
+def bench_4dn_fetch_projected(base_url, workdir):
+    module = load("4dn", base_url)
+    records = []
+    module.fetch_experiment_sets_projected(module.setup_session(), on_record=records.append)
+    return len(records), 0
+
+
+def bench_4dn_fetch_projected_streamed(base_url, workdir):
+    module = load("4dn", base_url)
+    records = []
+    module.fetch_experiment_sets_projected(module.setup_session(), page_size=1000, on_record=records.append, stream=True)
+    return len(records), 0
+
+
+def bench_encode_collect_bulk(base_url, workdir):
+    module = load("encode", base_url)
+    session = module.setup_session()
+    experiments = module.fetch_experiment_list(session, fields=module.EXPERIMENT_FIELDS)
+    return len(module.collect_bulk(session, experiments)), 0
+
+
+def bench_encode_collect_bulk_streamed(base_url, workdir):
+    module = load("encode", base_url)
+    session = module.setup_session()
+    experiments = module.fetch_experiment_list(session, fields=module.EXPERIMENT_FIELDS, stream=True)
+    return len(module.collect_bulk(session, experiments, stream=True)), 0
+
+
+def bench_encode_collect_sequential(base_url, workdir):
+    module = load("encode", base_url)
+    session = module.setup_session()
+    experiments = module.fetch_experiment_list(session)
+    return len(module.collect_sequential(session, experiments)), 0
+
+
+def bench_geo_process_geo_datasets(base_url, workdir):
+    module = load("geo", base_url)
+    df = module.process_geo_datasets(module.get_session(), [], max_datasets=float("inf"))
+    return len(df), 0
+
+
+def bench_geo_process_batched(base_url, workdir):
+    module = load("geo", base_url)
+    session = module.get_session(pool_size=module.MAX_WORKERS + 1)
+    df = module.process_geo_datasets_batched(session, max_datasets=float("inf"))
+    return len(df), 0
+
+
+def bench_synapse_collect_metadata(base_url, workdir):
+    module = load("synapse", base_url)
+    return len(module.collect_metadata()), 0
+
+
+def bench_cavatica_get_file_list(base_url, workdir):
+    module = load("cavatica", base_url)
+    return len(module.get_file_list("mock")), 0
+
+
+def bench_download_resumable(base_url, workdir):
+    from hic_common.client import create_session
+    from hic_common.download import download_resumable
+    session = create_session()
+    for index in range(DOWNLOAD_FILES):
+        download_resumable(blob_url(base_url, f"file{index}.hic"), os.path.join(workdir, f"file{index}.hic"),
+                           expected_size=BLOB_SIZE, session=session)
+    return DOWNLOAD_FILES, DOWNLOAD_FILES * BLOB_SIZE
+
+
+def bench_download_segmented_md5(base_url, workdir):
+    from hic_common.client import create_session
+    from hic_common.download import MAX_SEGMENTS, download_segmented
+    session = create_session(pool_size=MAX_SEGMENTS)
+    md5 = blob_md5(BLOB_SIZE)
+    for index in range(DOWNLOAD_FILES):
+        download_segmented(blob_url(base_url, f"file{index}.hic"), os.path.join(workdir, f"file{index}.hic"),
+                           expected_size=BLOB_SIZE, session=session, segments=4, expected_md5=md5)
+    return DOWNLOAD_FILES, DOWNLOAD_FILES * BLOB_SIZE
+
+
+def bench_4dn_downloader(base_url, workdir):
+    module = load_script("4dn_downloader", "4dn/downloader.py")
+    module.DOWNLOAD_DIR = workdir
+    session = module.get_session()
+    with ThreadPoolExecutor(max_workers=module.MAX_THREADS) as executor:
+        results = list(executor.map(
+            lambda index: module.download_file(
+                blob_url(base_url, f"file{index}.hic"), os.path.join(workdir, f"file{index}.hic"),
+                expected_size=BLOB_SIZE, session=session
+            ),
+            range(DOWNLOAD_FILES)
+        ))
+    done = [result for result in results if result]
+    return len(done), len(done) * BLOB_SIZE
+
+
+def bench_cavatica_download_pipelined(base_url, workdir):
+    module = load("cavatica", base_url)
+    files = module.get_file_list("mock")[:50]
+    module.download_pipelined(files, "mock", Path(workdir))
+    return len(files), sum(item["size"] for item in files)
+
+
+def load_script(name, script):
+    from crawl_all import load_source
+    return load_source(name, {"script": script})
+
+
+BENCHMARKS = {
+    "4dn_fetch_experiment_sets": bench_4dn_fetch_experiment_sets,
+    "4dn_fetch_concurrent": bench_4dn_fetch_concurrent,
+    "4dn_fetch_projected": bench_4dn_fetch_projected,
+    "4dn_fetch_projected_streamed": bench_4dn_fetch_projected_streamed,
+    "encode_collect_bulk": bench_encode_collect_bulk,
+    "encode_collect_bulk_streamed": bench_encode_collect_bulk_streamed,
+    "encode_collect_sequential": bench_encode_collect_sequential,
+    "geo_process_geo_datasets": bench_geo_process_geo_datasets,
+    "geo_process_batched": bench_geo_process_batched,
+    "synapse_collect_metadata": bench_synapse_collect_metadata,
+    "cavatica_get_file_list": bench_cavatica_get_file_list,
+    "download_resumable": bench_download_resumable,
+    "download_segmented_md5": bench_download_segmented_md5,
+    "4dn_downloader": bench_4dn_downloader,
+    "cavatica_download_pipelined": bench_cavatica_download_pipelined,
+}
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+
+def run_one(name, base_url, results):
+    """Child process body: run one benchmark quietly and report its numbers."""
+    from hic_common.metrics import METRICS
+    from hic_common.ratelimit import configure_host
+
+    host = base_url.split("//")[1].split(":")[0]
+    configure_host(host, MOCK_REQUESTS_PER_SECOND, max_rate=MOCK_REQUESTS_PER_SECOND)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            records, size = BENCHMARKS[name](base_url, workdir)
+        elapsed = time.perf_counter() - started
+    os.chdir(ROOT)
+
+    summary = METRICS.summary()
+    results.put({
+        "benchmark": name,
+        "seconds": elapsed,
+        "records": records,
+        "records_per_second": records / elapsed if elapsed else None,
+        "bytes": size,
+        "bytes_per_second": size / elapsed if elapsed else None,
+        "requests": sum(entry["requests"] for entry in summary["requests"]),
+        "throttled": sum(entry["throttled"] for entry in summary["requests"]),
+        "peak_rss": peak_rss_bytes(),
+    })
+
+
+def run(names, portals):
+    context = multiprocessing.get_context("spawn")  # A clean interpreter per benchmark for honest peak RSS
+    results = []
+    for name in names:
+        queue = context.Queue()
+        process = context.Process(target=run_one, args=(name, portals.base_url, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0 or queue.empty():
+            print(f"❌ {name} failed (exit code {process.exitcode})")
+            continue
+        result = queue.get()
+        results.append(result)
+        print(format_result(result), flush=True)
+    return results
+
+
+def format_result(result):
+    line = f"{result['benchmark']:<30} {result['seconds']:8.2f}s {result['records_per_second']:10.1f} rec/s"
+    if result["bytes"]:
+        line += f" {result['bytes_per_second'] / 1024 ** 2:9.1f} MiB/s"
+    else:
+        line += " " * 15
+    line += f" {result['requests']:7d} req"
+    if result["peak_rss"]:
+        line += f" {result['peak_rss'] / 1024 ** 2:8.1f} MiB peak RSS"
+    return line
+
+
+def main(names=None):
+    names = names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}. Choose from {', '.join(BENCHMARKS)}")
+        return
+
+    portals = MockPortals(
+        data=build_dataset(scale=SCALE),
+        latency=LATENCY,
+        throttle_rate=THROTTLE_RATE,
+        retry_after=RETRY_AFTER,
+    ).start()
+    print(f"Mock portals at {portals.base_url} (latency {LATENCY * 1000:.0f} ms, {THROTTLE_RATE:.0%} throttled)")
+    try:
+        results = run(names, portals)
+    finally:
+        portals.stop()
+
+    with open(RESULTS_FILE, "w") as f:
+        json.dump({"latency": LATENCY, "throttle_rate": THROTTLE_RATE, "scale": SCALE, "results": results}, f, indent=2)
+    print(f"Results written to {RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
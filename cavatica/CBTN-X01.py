@@ -1,14 +1,43 @@
 import os
+import sys
 import requests
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 
-API_URL = "https://cavatica-api.sbgenomics.com/v2"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from hic_common.catalog import format_from_name, update_catalog
+from hic_common.client import create_session, sbg_token_auth
+from hic_common.download import download_resumable, is_complete, parse_size
+from hic_common.scheduler import DownloadScheduler, order_jobs
+from hic_common.ratelimit import configure_host
+
+API_HOST = "cavatica-api.sbgenomics.com"
+API_URL = f"https://{API_HOST}/v2"
 PARENT_ID = "6762e5fbd2814e34cfa170e7"
 OUTPUT_DIR = "CBTN-X01"
 PAGE_LIMIT = 100
-RATE_LIMIT_SECONDS = 0.5  # Wait between requests
+USE_CACHE = True  # Serve repeat listing pages from the shared on-disk HTTP cache
+UPDATE_CATALOG = True  # Record the listed files in the shared local catalog (hic_common.catalog)
+LIST_FIELDS = "id,name,size"  # Only what main() and the downloads need
+LIST_WORKERS = 4  # Parallel listing pages once the total is known
+REQUESTS_PER_SECOND = 2  # Starting rate for the API; adapts to 429s from there
+MAX_REQUESTS_PER_SECOND = 3.3  # CAVATICA allows 1000 requests per 5 minutes
+PIPELINED = True  # Resolve download URLs ahead of a pool of concurrent downloads
+DOWNLOAD_WORKERS = 4
+PREFETCH = 8  # Resolved URLs allowed to wait for a free download worker
+SCHEDULED = True  # Largest files first under the bandwidth and disk budgets below, still prefetching PREFETCH URLs (takes precedence over PIPELINED)
+MAX_BYTES_PER_SECOND = None  # Cap on all downloads together, e.g. 100 * 1024 ** 2; None for no cap
+OUTPUT_FORMAT = "xlsx"  # "parquet" or "feather" for typed columnar output
+LIST_OUTPUT = f"{OUTPUT_DIR}_files.{OUTPUT_FORMAT}"  # Written by list_files(), which downloads nothing
+
+# Column types for the columnar formats
+OUTPUT_SCHEMA = {
+    "File_ID": "string",
+    "File_Name": "string",
+    "File_Size": "Int64",
+}
 
 def get_auth_token():
     token = os.environ.get("SBG_AUTH_TOKEN")
@@ -18,55 +47,264 @@ def get_auth_token():
         token = input("Please enter your CAVATICA API token: ").strip()
     return token
 
+def is_target_file(item):
+    return ".vcf" in item["name"].lower()
+
+def fetch_file_page(session, offset):
+    """Fetch one projected listing page and return (items, total matching)"""
+    response = session.get(
+        f"{API_URL}/files/{PARENT_ID}/list",
+        params={"fields": LIST_FIELDS, "offset": offset, "limit": PAGE_LIMIT}
+    )
+    response.raise_for_status()
+    total = response.headers.get("X-Total-Matching-Query")
+    return response.json().get("items", []), int(total) if total is not None else None
+
+def get_session(token, pool_size=None):
+    configure_host(API_HOST, REQUESTS_PER_SECOND, max_rate=MAX_REQUESTS_PER_SECOND)
+    return create_session(
+        pool_size=pool_size or LIST_WORKERS,
+        headers={"accept": "application/json"},
+        auth=sbg_token_auth(token),
+        cache=USE_CACHE
+    )
+
+def get_download_session(pool_size=None):
+    """Keep-alive session for the signed storage URLs; carries no CAVATICA token"""
+    return create_session(pool_size=pool_size or DOWNLOAD_WORKERS)
+
 def get_file_list(token):
-    files = []
-    offset = 0
+    """List the parent folder, fetching the remaining pages concurrently.
+
+    The first page tells us the total via X-Total-Matching-Query; every other
+    offset is then requested in parallel under a shared rate limit. The API
+    only filters on exact names, so the .vcf match still happens here, but
+    with fields= projection each page stays small.
+    """
+    session = get_session(token)
 
     print("Fetching file list with pagination...")
 
-    while True:
-        url = f"{API_URL}/files/{PARENT_ID}/list?offset={offset}&limit={PAGE_LIMIT}"
-        headers = {
-            "accept": "application/json",
-            "X-SBG-Auth-Token": token
-        }
+    items, total = fetch_file_page(session, 0)
+    pages = [items]
 
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+    if total is None:
+        # No count header, walk the pages one by one
+        offset = PAGE_LIMIT
+        while items:
+            items, _ = fetch_file_page(session, offset)
+            pages.append(items)
+            offset += PAGE_LIMIT
+    else:
+        offsets = range(PAGE_LIMIT, total, PAGE_LIMIT)
+        with ThreadPoolExecutor(max_workers=LIST_WORKERS) as executor:
+            results = executor.map(lambda offset: fetch_file_page(session, offset), offsets)
+            pages.extend(page_items for page_items, _ in results)
 
-        items = data.get("items", [])
-        if not items:
-            break
-        
-        items = [item for item in items if ".vcf" in item["name"].lower()]
-        
-        files.extend(items)
-        offset += PAGE_LIMIT
-        time.sleep(RATE_LIMIT_SECONDS)
+    files = [item for page_items in pages for item in page_items if is_target_file(item)]
 
     print(f"Total files found: {len(files)}")
     return files
 
-def get_download_url(file_id, token):
+def catalog_record(item):
+    """Map a listing entry onto the cross-source catalog columns"""
+    name = item["name"]
+    return {
+        "source": "cavatica",
+        "accession": item["id"],
+        "record_accession": PARENT_ID,
+        "title": name,
+        "file_format": format_from_name(name),
+        "file_size": item.get("size"),
+    }
+
+def get_download_url(file_id, token, session=None):
     url = f"{API_URL}/files/{file_id}/download_info"
     headers = {
         "accept": "application/json",
-        "X-SBG-Auth-Token": token
+        "X-SBG-Auth-Token": token,
+        # Signed URLs expire, never serve them from the cache
+        "Cache-Control": "no-store"
     }
 
-    response = requests.get(url, headers=headers)
+    http = session or requests
+    response = http.get(url, headers=headers)
     response.raise_for_status()
     data = response.json()
     return data["url"]
 
-def download_file(download_url, filename):
-    with requests.get(download_url, stream=True) as r:
-        r.raise_for_status()
-        with open(filename, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+def download_file(download_url, filename, expected_size=None, session=None):
+    """Stream into a .part file and only keep it once its size matches the listing"""
+    download_resumable(download_url, str(filename), expected_size=expected_size, session=session)
+
+def download_with_refresh(file_info, file_path, download_url, resolve, session=None):
+    """Download one listed file, resolving its signed URL again if it has expired"""
+    expected_size = parse_size(file_info.get("size"))
+    try:
+        download_file(download_url, file_path, expected_size=expected_size, session=session)
+    except requests.exceptions.HTTPError as e:
+        # S3 answers 400/403 once the signature has expired
+        if e.response is None or e.response.status_code not in (400, 403):
+            raise
+        tqdm.write(f"Download URL expired, resolving again: {file_info['name']}")
+        download_file(resolve(file_info["id"]), file_path, expected_size=expected_size, session=session)
+
+def download_pipelined(file_list, token, output_path, workers=None, prefetch=None):
+    """Resolve signed URLs on this thread while a worker pool streams the files.
+
+    URL resolution is rate limited and runs at most `workers + prefetch`
+    files ahead of the downloads. A URL that has expired by the time its
+    download starts (or partway through) is resolved again and the .part
+    file resumed. `workers` and `prefetch` default to DOWNLOAD_WORKERS and
+    PREFETCH at call time.
+    """
+    workers = workers or DOWNLOAD_WORKERS
+    prefetch = PREFETCH if prefetch is None else prefetch
+    session = get_session(token, pool_size=workers)
+    download_session = get_download_session(pool_size=workers)
+    slots = threading.Semaphore(workers + prefetch)
+
+    def resolve(file_id):
+        return get_download_url(file_id, token, session=session)
+
+    def fetch(file_info, download_url):
+        try:
+            download_with_refresh(file_info, output_path / file_info["name"], download_url, resolve, session=download_session)
+        finally:
+            slots.release()
+
+    progress = tqdm(total=len(file_list), desc="⬇️ Downloading files")
+
+    def report(future, file_name):
+        try:
+            future.result()
+        except Exception as e:
+            tqdm.write(f"Failed to download {file_name}: {e}")
+        progress.update(1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for file_info in file_list:
+            file_path = output_path / file_info["name"]
+            if is_complete(file_path, parse_size(file_info.get("size"))):
+                tqdm.write(f"Skipping (already complete): {file_info['name']}")
+                progress.update(1)
+                continue
+
+            slots.acquire()
+            try:
+                download_url = resolve(file_info["id"])
+            except Exception as e:
+                slots.release()
+                tqdm.write(f"Failed to resolve {file_info['name']}: {e}")
+                progress.update(1)
+                continue
+            future = executor.submit(fetch, file_info, download_url)
+            future.add_done_callback(lambda future, name=file_info["name"]: report(future, name))
+
+    progress.close()
+
+def download_scheduled(file_list, token, output_path, workers=None, prefetch=None):
+    """Download through a DownloadScheduler: largest files first, within MAX_BYTES_PER_SECOND and free disk space.
+
+    As in download_pipelined, signed URLs are resolved on a separate thread
+    at most `workers + prefetch` files ahead of the downloads, here in the
+    order the scheduler will start them. A file the scheduler reaches
+    before its URL was prefetched resolves its own, and a URL that has
+    expired is resolved again. `workers` and `prefetch` default to
+    DOWNLOAD_WORKERS and PREFETCH at call time.
+    """
+    workers = workers or DOWNLOAD_WORKERS
+    prefetch = PREFETCH if prefetch is None else prefetch
+    session = get_session(token, pool_size=workers)
+    download_session = get_download_session(pool_size=workers)
+    slots = threading.Semaphore(workers + prefetch)
+    lock = threading.Lock()
+    prefetched = {}  # File id -> Future of its signed URL
+    started = set()
+    stopped = threading.Event()
+
+    def resolve(file_id):
+        return get_download_url(file_id, token, session=session)
+
+    def claim(file_id):
+        """Take the prefetched URL future of a file, if any, and free its slot once used"""
+        with lock:
+            started.add(file_id)
+            return prefetched.pop(file_id, None)
+
+    def fetch(file_info):
+        url_future = claim(file_info["id"])
+        if url_future is None:
+            download_url = resolve(file_info["id"])
+        else:
+            try:
+                download_url = url_future.result()
+            finally:
+                slots.release()
+        download_with_refresh(file_info, output_path / file_info["name"], download_url, resolve, session=download_session)
+
+    def prefetch_urls(ordered):
+        with ThreadPoolExecutor(max_workers=1) as resolver:
+            for job in ordered:
+                slots.acquire()
+                file_id = job["file_info"]["id"]
+                with lock:
+                    if stopped.is_set() or file_id in started:
+                        slots.release()
+                        continue
+                    prefetched[file_id] = resolver.submit(resolve, file_id)
+
+    progress = tqdm(total=len(file_list), desc="⬇️ Downloading files")
+    jobs = []
+    for file_info in file_list:
+        file_path = output_path / file_info["name"]
+        expected_size = parse_size(file_info.get("size"))
+        if is_complete(file_path, expected_size):
+            tqdm.write(f"Skipping (already complete): {file_info['name']}")
+            progress.update(1)
+            continue
+        jobs.append({
+            "path": str(file_path),
+            "size": expected_size,
+            "file_info": file_info,
+            "run": lambda file_info=file_info: fetch(file_info),
+        })
+
+    def report(job, result, error):
+        if error:
+            tqdm.write(f"Failed to download {os.path.basename(job['path'])}: {error}")
+            # A job refused for disk space never runs, so hand its slot back here
+            if claim(job["file_info"]["id"]) is not None:
+                slots.release()
+        progress.update(1)
+
+    scheduler = DownloadScheduler(workers=workers, max_bytes_per_second=MAX_BYTES_PER_SECOND, directory=str(output_path))
+    prefetcher = threading.Thread(target=prefetch_urls, args=(order_jobs(jobs, scheduler.order),), daemon=True)
+    prefetcher.start()
+    try:
+        scheduler.run(jobs, on_done=report)
+    finally:
+        stopped.set()
+        slots.release()  # Wake the prefetcher if it is waiting for a slot
+        prefetcher.join()
+    progress.close()
+
+def list_files():
+    """List the folder without downloading anything and write id/name/size to LIST_OUTPUT"""
+    # Needs pandas, which the download path and requirements.txt leave out
+    from hic_common.columnar import write_table
+
+    token = get_auth_token()
+    file_list = get_file_list(token)
+    if UPDATE_CATALOG:
+        update_catalog(catalog_record(item) for item in file_list)
+    rows = [
+        {"File_ID": item["id"], "File_Name": item["name"], "File_Size": parse_size(item.get("size"))}
+        for item in file_list
+    ]
+    write_table(rows, LIST_OUTPUT, schema=OUTPUT_SCHEMA)
+    print(f"Saved file list to {LIST_OUTPUT}")
+    return LIST_OUTPUT
 
 def main():
     token = get_auth_token()
@@ -74,7 +312,21 @@ def main():
     output_path.mkdir(parents=True, exist_ok=True)
     count = 0
     file_list = get_file_list(token)
+    if UPDATE_CATALOG:
+        update_catalog(catalog_record(item) for item in file_list)
+
+    if SCHEDULED:
+        download_scheduled(file_list, token, output_path)
+        print("🎉 All downloads completed!")
+        return
+
+    if PIPELINED:
+        download_pipelined(file_list, token, output_path)
+        print("🎉 All downloads completed!")
+        return
 
+    session = get_session(token)
+    download_session = get_download_session(pool_size=1)
     for file_info in tqdm(file_list, desc="⬇️ Downloading files"):
         file_id = file_info["id"]
         file_name = file_info["name"]
@@ -82,14 +334,13 @@ def main():
         count += 1
         tqdm.write(f"Downloading {count}/{len(file_list)}: {file_name}")
         
-        if file_path.exists():
-            tqdm.write(f"Skipping (already exists): {file_name}")
+        if is_complete(file_path, parse_size(file_info.get("size"))):
+            tqdm.write(f"Skipping (already complete): {file_name}")
             continue
 
         try:
-            download_url = get_download_url(file_id, token)
-            download_file(download_url, file_path)
-            time.sleep(RATE_LIMIT_SECONDS)
+            download_url = get_download_url(file_id, token, session=session)
+            download_file(download_url, file_path, expected_size=parse_size(file_info.get("size")), session=download_session)
         except Exception as e:
             tqdm.write(f"Failed to download {file_name}: {e}")
 
@@ -0,0 +1,173 @@
+"""Run every source's scraper in one process, side by side.
+
+Usage: python crawl_all.py [source ...]   (default: all sources)
+
+Each source runs its own main() (or the `entry` named in SOURCES) on a
+thread with its own worker counts and per-host rate limits, so the full
+refresh takes as long as the slowest portal rather than the sum of all
+of them. All sessions share one cap on requests in flight and a soft
+memory cap. Outputs land in
+OUTPUT_DIR, and the per-source tables are combined into COMBINED_OUTPUT
+at the end.
+"""
+import importlib.util
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+from hic_common.columnar import read_table, write_table
+from hic_common.ratelimit import HOST_LIMITERS, limit_in_flight
+
+OUTPUT_DIR = os.path.join(ROOT, "crawl_output")  # Every source writes its files here
+OUTPUT_FORMAT = "xlsx"  # "parquet" or "feather" for typed columnar output
+COMBINED_OUTPUT = f"all_sources.{OUTPUT_FORMAT}"
+MAX_IN_FLIGHT = 24  # Requests in flight across all sources
+MAX_RSS_MB = 4096  # Above this, requests go out one at a time until memory drops
+PROGRESS_INTERVAL = 30  # Seconds between combined progress reports
+
+# `settings` override the script's module constants, giving each source its
+# own worker and rate budget. `entry` names the function to run instead of
+# main(), e.g. a listing-only one for scripts whose main() downloads data.
+# Sources with `env` are skipped unless that credential is set, since their
+# scripts would otherwise prompt or exit.
+SOURCES = {
+    "4dn": {
+        "script": "4dn/scraper.py",
+        "hosts": ["data.4dnucleome.org"],
+        "settings": {"MAX_WORKERS": 8, "REQUESTS_PER_SECOND": 4, "MAX_REQUESTS_PER_SECOND": 10},
+    },
+    "encode": {
+        "script": "encode/scraper.py",
+        "hosts": ["www.encodeproject.org"],
+        "settings": {"REQUESTS_PER_SECOND": 2, "MAX_REQUESTS_PER_SECOND": 10},
+    },
+    "geo": {
+        "script": "geo/scraper.py",
+        "hosts": ["eutils.ncbi.nlm.nih.gov"],
+        "settings": {"MAX_WORKERS": 3},
+    },
+    "synapse": {
+        "script": "synapse/scraper.py",
+        "hosts": ["repo-prod.prod.sagebase.org"],
+        "settings": {"MAX_WORKERS": 8, "MAX_REQUESTS_PER_SECOND": 10},
+        "env": "SYNAPSE_TOKEN",
+    },
+    "cavatica": {
+        "script": "cavatica/CBTN-X01.py",
+        "entry": "list_files",
+        "hosts": ["cavatica-api.sbgenomics.com"],
+        "settings": {"LIST_WORKERS": 4},
+        "env": "SBG_AUTH_TOKEN",
+    },
+}
+
+
+def load_source(name, config):
+    """Import a source script by path; the directory names aren't valid module names."""
+    spec = importlib.util.spec_from_file_location(f"{name}_source", os.path.join(ROOT, config["script"]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for key, value in config.get("settings", {}).items():
+        setattr(module, key, value)
+    return module
+
+
+def run_source(name, module, status):
+    status[name].update(state="running", started=time.monotonic())
+    try:
+        output = getattr(module, SOURCES[name].get("entry", "main"))()
+    except SystemExit as e:
+        raise RuntimeError(f"{name} exited with status {e.code}")
+    status[name].update(state="done", finished=time.monotonic(), output=output)
+    return output
+
+
+def report_progress(status):
+    limiters = HOST_LIMITERS.snapshot()
+    lines = []
+    for name, entry in status.items():
+        config = SOURCES[name]
+        line = f"  {name:<9} {entry['state']:<8}"
+        if "started" in entry:
+            line += f" {entry.get('finished', time.monotonic()) - entry['started']:7.0f}s"
+        for host in config["hosts"]:
+            limiter = limiters.get(host)
+            if limiter:
+                line += f"  {limiter.requests} requests, {limiter.throttles} throttled, {limiter.rate:.1f}/s"
+        lines.append(line)
+    print("📊 Progress\n" + "\n".join(lines), flush=True)
+
+
+def combine_outputs(status):
+    """Stack every source's table with a Source column into COMBINED_OUTPUT."""
+    frames = []
+    schema = {"Source": "category"}
+    for name, entry in status.items():
+        output = entry.get("output")
+        if not output or not os.path.exists(output):
+            continue
+        df = read_table(output)
+        df.insert(0, "Source", name)
+        frames.append(df)
+        for column, kind in getattr(entry["module"], "OUTPUT_SCHEMA", {}).items():
+            schema.setdefault(column, kind)
+
+    if not frames:
+        print("⚠️ No source produced a table to combine")
+        return None
+    combined = pd.concat(frames, ignore_index=True)
+    write_table(combined, COMBINED_OUTPUT, schema=schema)
+    print(f"✅ Combined {len(combined)} rows from {len(frames)} sources into {os.path.join(OUTPUT_DIR, COMBINED_OUTPUT)}")
+    return COMBINED_OUTPUT
+
+
+def main(names=None):
+    names = names or list(SOURCES)
+    unknown = [name for name in names if name not in SOURCES]
+    if unknown:
+        print(f"Unknown sources: {', '.join(unknown)}. Choose from {', '.join(SOURCES)}")
+        return
+
+    status = {}
+    modules = {}
+    for name in names:
+        config = SOURCES[name]
+        if config.get("env") and not os.getenv(config["env"]):
+            print(f"⏭️ Skipping {name}: set {config['env']} to include it")
+            status[name] = {"state": "skipped"}
+            continue
+        modules[name] = load_source(name, config)
+        status[name] = {"state": "queued", "module": modules[name]}
+
+    limit_in_flight(MAX_IN_FLIGHT, max_rss_bytes=MAX_RSS_MB * 1024 ** 2)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.chdir(OUTPUT_DIR)  # The scripts write relative to the working directory
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(modules))) as executor:
+        for name, module in modules.items():
+            futures[executor.submit(run_source, name, module, status)] = name
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_INTERVAL)
+            for future in done:
+                name = futures[future]
+                try:
+                    future.result()
+                    print(f"✅ {name} finished")
+                except Exception as e:
+                    status[name].update(state="failed", finished=time.monotonic())
+                    print(f"❌ {name} failed: {e}")
+            report_progress(status)
+
+    return combine_outputs(status)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,31 +1,85 @@
 # encode.py
-import requests
-import time
 import json
+import os
+import sys
 import pandas as pd
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from hic_common.columnar import write_table
+from hic_common.catalog import update_catalog
+from hic_common.client import create_session
+from hic_common.json_stream import stream_graph
+from hic_common.ratelimit import configure_host
+from hic_common.sink import RecordSink
+from hic_common.state import load_state, merge_with_previous, save_state, update_state
 
 FILE_FORMATS = ["hic", "bedpe", "bw", "bedgraph", "cool", "tsv", "csv", "bed", "bigWig"]
+ASSAY_TITLES = [
+    "intact Hi-C",
+    "in situ Hi-C",
+    "dilution Hi-C",
+    "SPRITE"
+]
+PORTAL_URL = "https://www.encodeproject.org"
+SEARCH_URL = f"{PORTAL_URL}/search/"
+REQUESTS_PER_SECOND = 2  # Starting rate for the portal; adapts to 429s from there
+MAX_REQUESTS_PER_SECOND = 10  # ENCODE asks clients to stay under 10 requests/s
+USE_CACHE = True  # Serve repeat requests from the shared on-disk HTTP cache
+INCREMENTAL = False  # Only fetch experiments released since the last run and merge into its output
+STATE_FILE = "encode_state.json"
+OUTPUT_FORMAT = "xlsx"  # "parquet" or "feather" for typed columnar output
+OUTPUT_FILE = f"encode_experiments.{OUTPUT_FORMAT}"
+STREAM_FILE = "encode_rows.jsonl"  # Rows are appended here as each experiment is processed
+EXPORT_EXCEL = True  # Compact the stream into OUTPUT_FILE once the crawl finishes
+UPDATE_CATALOG = True  # Upsert the rows into the shared local catalog (hic_common.catalog)
+
+# Column types for the columnar formats
+OUTPUT_SCHEMA = {
+    "Assay": "category",
+    "Date Released": "datetime",
+    "Lab": "category",
+    "Institute": "category",
+    "Biosample Summary": "category",
+    "File Format": "category",
+    "File Type": "category",
+    "File Size": "Int64",
+    "MD5": "string",
+}
+BULK_MODE = True  # Pull files with one type=File search instead of one GET per experiment
+STREAM_JSON = True  # Parse limit=all searches item by item as they arrive (these then bypass the HTTP cache)
+
+# Fields process_encode_data reads from an experiment and from each of its files
+EXPERIMENT_FIELDS = [
+    "@id",
+    "assay_term_name",
+    "description",
+    "date_released",
+    "lab.title",
+    "lab.institute_name",
+    "biosample_summary",
+]
+FILE_FIELDS = [
+    "@id",
+    "dataset",
+    "href",
+    "file_format",
+    "output_type",
+    "file_size",
+    "md5sum",
+]
 
 # Shared utility functions
 def setup_session():
     """Configure requests session with headers and retry policy"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
+    configure_host("www.encodeproject.org", REQUESTS_PER_SECOND, max_rate=MAX_REQUESTS_PER_SECOND)
+    return create_session(
+        headers={
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+            "Accept": "application/json"
+        },
+        cache=USE_CACHE,
+        incremental=INCREMENTAL
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    session.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Accept": "application/json"
-    })
-    return session
 
 def save_ids(ids, filename):
     """Save IDs to a JSON file"""
@@ -33,34 +87,68 @@ def save_ids(ids, filename):
         json.dump(ids, f)
 
 # ENCODE-specific functions
-def fetch_experiment_list(session):
-    """Fetch initial list of experiments with specific assay titles"""
-    url = "https://www.encodeproject.org/search/"
+def fetch_experiment_list(session, fields=None, released_since=None, stream=False):
+    """Fetch initial list of experiments with specific assay titles
+
+    With stream=True a generator is returned that yields experiments while
+    the response is still arriving, without holding the whole body.
+    """
+    url = SEARCH_URL
     params = {
         "type": "Experiment",
         "control_type!": "*",
         "status": "released",
         "perturbed": "false",
-        "assay_title": [
-            "intact Hi-C",
-            "in situ Hi-C",
-            "dilution Hi-C",
-            "SPRITE"
-        ],
+        "assay_title": ASSAY_TITLES,
         "limit": "all",
         "format": "json"
     }
+    if fields:
+        params["field"] = fields
+    if released_since:
+        params["advancedQuery"] = f"date_released:[{released_since} TO *]"
+    if stream:
+        return stream_graph(session, url, params=params)
     response = session.get(url, params=params)
     response.raise_for_status()
     return response.json()["@graph"]
 
 def fetch_experiment_details(session, experiment_id):
     """Fetch detailed experiment data"""
-    url = f"https://www.encodeproject.org{experiment_id}"
+    url = f"{PORTAL_URL}{experiment_id}"
     response = session.get(url, params={"format": "json"})
     response.raise_for_status()
     return response.json()
 
+def fetch_file_list(session, stream=False):
+    """Fetch every matching file for the assay titles in a single projected search
+
+    Only released files are asked for, as in the experiment search, so
+    archived, revoked and deleted files stay out of the output. Takes the
+    same stream option as fetch_experiment_list.
+    """
+    params = {
+        "type": "File",
+        "status": "released",
+        "assay_title": ASSAY_TITLES,
+        "file_format": FILE_FORMATS,
+        "field": FILE_FIELDS,
+        "limit": "all",
+        "format": "json"
+    }
+    if stream:
+        return stream_graph(session, SEARCH_URL, params=params)
+    response = session.get(SEARCH_URL, params=params)
+    response.raise_for_status()
+    return response.json()["@graph"]
+
+def attach_files(experiments, files):
+    """Join file records back onto their experiments by dataset @id"""
+    files_by_dataset = {}
+    for file in files:
+        files_by_dataset.setdefault(file.get("dataset"), []).append(file)
+    return [{**exp, "files": files_by_dataset.get(exp["@id"], [])} for exp in experiments]
+
 def process_encode_data(experiment):
     """Process experiment data into structured format"""
     base_data = {
@@ -80,42 +168,157 @@ def process_encode_data(experiment):
         
         processed.append({
             **base_data,
-            "File URL": f"https://www.encodeproject.org{file.get('href', '')}",
+            "File URL": f"{PORTAL_URL}{file.get('href', '')}",
             "File Format": file.get("file_format", ""),
             "File Type": file.get("output_type", ""),  # Most relevant type field
-            "File Size": file.get("file_size", "")
+            "File Size": file.get("file_size", ""),
+            "MD5": file.get("md5sum", "")
         })
     return processed
 
-def main():
-    session = setup_session()
-    
-    # Fetch experiment list
-    experiments = fetch_experiment_list(session)
-    print(f"Found {len(experiments)} experiments")
-    
-    # Save experiment IDs
-    experiment_ids = [exp["@id"] for exp in experiments]
-    save_ids(experiment_ids, "encode_ids.json")
-   
+def catalog_record(row):
+    """Map an output row onto the cross-source catalog columns"""
+    file_url = row.get("File URL", "")
+    # File URLs look like <portal>/files/ENCFF.../@@download/ENCFF....hic
+    accession = file_url.split("/files/", 1)[-1].split("/", 1)[0]
+    biosample = row.get("Biosample Summary") or ""
+    organism = " ".join(biosample.split()[:2]) if biosample.startswith(("Homo sapiens", "Mus musculus")) else None
+    return {
+        "source": "encode",
+        "accession": accession,
+        "record_accession": row.get("Experiment ID"),
+        "title": row.get("Description"),
+        "file_url": file_url,
+        "file_format": row.get("File Format"),
+        "file_size": row.get("File Size"),
+        "md5": row.get("MD5"),
+        "biosource": biosample,
+        "organism": organism,
+        "assay": row.get("Assay"),
+        "lab": row.get("Lab"),
+        "date": row.get("Date Released"),
+        "extra": {"File Type": row.get("File Type"), "Institute": row.get("Institute")},
+    }
+
+def collect_bulk(session, experiments, sink=None, stream=False):
+    """Build output rows from one file search joined to the experiment list
+
+    With a sink, each experiment's rows are appended to it and experiments
+    it already holds are skipped; otherwise the rows are returned. With
+    stream=True the file search is parsed as it arrives and only the
+    projected file records are kept.
+    """
+    done = sink.done_keys if sink else set()
+    experiments = [exp for exp in experiments if exp["@id"] not in done]
+    files = list(fetch_file_list(session, stream=stream))
+    print(f"Found {len(files)} files")
+
+    all_data = []
+    for experiment in attach_files(experiments, files):
+        rows = process_encode_data(experiment)
+        if sink:
+            sink.write(experiment["@id"], rows, meta={"date_released": experiment.get("date_released", "")})
+        else:
+            all_data.extend(rows)
+
+    print("Done! Processed", len(experiments), "experiments")
+    return all_data
+
+def collect_sequential(session, experiments, sink=None, on_error=None):
+    """Build output rows by fetching each experiment document in turn
+
+    Takes the same optional sink as collect_bulk. Experiments that fail are
+    skipped and reported to `on_error(key, error)`.
+    """
+    done = sink.done_keys if sink else set()
     counter = 0 
-    # Process all experiments
+    # Process all experiments; a streamed list has no length up front
+    total = f"/{len(experiments)}" if hasattr(experiments, "__len__") else ""
     all_data = []
     for idx, exp in enumerate(experiments):
         counter += 1
+        if exp["@id"] in done:
+            continue
         try:
-            print(f"Processing {idx+1}/{len(experiments)}: {exp['@id']}")
+            print(f"Processing {idx+1}{total}: {exp['@id']}")
             details = fetch_experiment_details(session, exp["@id"])
-            all_data.extend(process_encode_data(details))
-            time.sleep(0.5)  # Rate limiting
+            rows = process_encode_data(details)
+            if sink:
+                sink.write(exp["@id"], rows, meta={"date_released": details.get("date_released", "")})
+            else:
+                all_data.extend(rows)
         except Exception as e:
             print(f"Failed to process {exp['@id']}: {str(e)}")
+            if on_error:
+                on_error(exp["@id"], e)
     
     print("Done! Processed", counter, "experiments")
-    # Create DataFrame and save
-    df = pd.DataFrame(all_data)
-    df.to_excel("encode_experiments.xlsx", index=False)
-    print("Done! Saved to encode_experiments.xlsx")
+    return all_data
+
+def main():
+    session = setup_session()
+    state = load_state(STATE_FILE) if INCREMENTAL else None
+    released_since = state["watermark"] if state else None
+    if released_since:
+        print("Fetching experiments released since", released_since)
+    
+    # Fetch experiment list
+    experiments = fetch_experiment_list(
+        session,
+        fields=EXPERIMENT_FIELDS if BULK_MODE else None,
+        released_since=released_since,
+        stream=STREAM_JSON
+    )
+    experiment_ids = []
+
+    def track(experiments):
+        # Record IDs as a streamed list goes by, so detail fetches start before it ends
+        for exp in experiments:
+            experiment_ids.append(exp["@id"])
+            yield exp
+
+    sink = RecordSink(STREAM_FILE)
+    if sink.done_keys:
+        print(f"Resuming, {len(sink.done_keys)} experiments already in {STREAM_FILE}")
+    failures = {}
+
+    # A delta is only a handful of experiments, so fetch those one by one
+    if BULK_MODE and not INCREMENTAL:
+        collect_bulk(session, track(experiments), sink=sink, stream=STREAM_JSON)
+    else:
+        collect_sequential(session, track(experiments), sink=sink, on_error=failures.__setitem__)
+    print(f"Found {len(experiment_ids)} experiments")
+
+    # Save experiment IDs
+    save_ids(experiment_ids, "encode_ids.json")
+
+    changes = {
+        experiment_id.split("/")[-2]: meta.get("date_released", "")
+        for experiment_id, meta in sink.meta().items()
+    }
+
+    if EXPORT_EXCEL:
+        rows = list(sink.iter_rows())
+        if INCREMENTAL:
+            df = merge_with_previous(state["output"], rows, "Experiment ID", list(changes))
+        else:
+            df = pd.DataFrame(rows)
+        write_table(df, OUTPUT_FILE, schema=OUTPUT_SCHEMA)
+        print(f"Done! Saved to {OUTPUT_FILE}")
+
+    if INCREMENTAL and failures:
+        print(f"⚠️ {len(failures)} experiments failed, leaving the watermark where it was so the next run retries them")
+    elif INCREMENTAL:
+        update_state(state, changes, OUTPUT_FILE if EXPORT_EXCEL else state["output"])
+        save_state(STATE_FILE, state)
+
+    if UPDATE_CATALOG:
+        update_catalog(catalog_record(row) for row in sink.iter_rows())
+    sink.close(complete=not failures)
+    if failures:
+        print(f"❌ {len(failures)} fetches failed, rerun to resume from {STREAM_FILE}")
+        sys.exit(1)
+    return OUTPUT_FILE if EXPORT_EXCEL else None
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
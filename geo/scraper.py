@@ -1,13 +1,54 @@
-import requests
+import os
+import sys
 import pandas as pd
-from time import sleep
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from hic_common.columnar import write_table
+from hic_common.catalog import update_catalog
+from hic_common.client import create_session
+from hic_common.ratelimit import configure_host
+from hic_common.sink import RecordSink
+from hic_common.state import load_state, merge_with_previous, save_state, update_state
 
-def get_session():
+ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+ESUMMARY_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+SEARCH_QUERY = "((hic) OR human[Organism]) OR Tads[Description]"
+
+USE_CACHE = True  # Serve repeat requests from the shared on-disk HTTP cache
+INCREMENTAL = False  # Only fetch datasets updated since the last run and merge into its output
+STATE_FILE = "geo_state.json"
+STREAM_FILE = "geo_rows.jsonl"  # Rows are appended here as each dataset or batch is processed
+EXPORT_EXCEL = True  # Compact the stream into an output file once the crawl finishes
+UPDATE_CATALOG = True  # Upsert the rows into the shared local catalog (hic_common.catalog)
+OUTPUT_FORMAT = "xlsx"  # "parquet" or "feather" for typed columnar output
+
+# Column types for the columnar formats
+OUTPUT_SCHEMA = {
+    "GDS_ID": "string",
+    "Organism": "category",
+    "Dataset_Type": "category",
+    "Num_Samples": "Int64",
+    "Bioproject": "string",
+}
+BATCHED = True  # Use the History server and batched ESummary calls
+SUMMARY_BATCH_SIZE = 500  # Ids per ESummary request
+MAX_WORKERS = 3  # Parallel ESummary batches
+# NCBI allows 3 requests/s without an API key and 10 requests/s with one,
+# so these are ceilings: the limiter only ever backs off from them
+REQUESTS_PER_SECOND = 3
+REQUESTS_PER_SECOND_WITH_KEY = 10
+
+
+def get_api_key():
+    """Return the NCBI API key from the environment, if one is configured."""
+    return os.getenv("NCBI_API_KEY")
+
+
+def get_session(pool_size=10):
     """Configure a requests session with retries."""
     retry_strategy = Retry(
         total=3,  # Retry up to 3 times
@@ -15,25 +56,35 @@ def get_session():
         status_forcelist=[429, 500, 502, 503, 504, 400],  # Retry on these errors
         allowed_methods=["GET"]
     )
-    session = requests.Session()
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
-    return session
+    rate = REQUESTS_PER_SECOND_WITH_KEY if get_api_key() else REQUESTS_PER_SECOND
+    configure_host("eutils.ncbi.nlm.nih.gov", rate, max_rate=rate)
+    return create_session(pool_size=pool_size, retries=retry_strategy, cache=USE_CACHE, incremental=INCREMENTAL)
+
+
+def date_filter(modified_since):
+    """ESearch parameters restricting results to records modified on or after a date."""
+    if not modified_since:
+        return {}
+    # NCBI needs both ends of the range
+    return {"datetype": "mdat", "mindate": modified_since, "maxdate": "3000/12/31"}
 
 
-def fetch_gds_ids(session, search_terms, retstart=0, retmax=1000):
+def fetch_gds_ids(session, search_terms, retstart=0, retmax=1000, modified_since=None, api_key=None):
     """Fetch GEO Dataset IDs using ESearch API."""
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+    base_url = ESEARCH_URL
     # search_query = " OR ".join([f'"{term}"' for term in search_terms])
-    search_query = "((hic) OR human[Organism]) OR Tads[Description]"
+    search_query = SEARCH_QUERY
 
     params = {
         "db": "gds",
         "term": search_query,
         "retstart": retstart,
         "retmax": retmax,
-        "retmode": "json"
+        "retmode": "json",
+        **date_filter(modified_since)
     }
+    if api_key:
+        params["api_key"] = api_key
 
     response = session.get(base_url, params=params)
     response.raise_for_status()
@@ -42,10 +93,12 @@ def fetch_gds_ids(session, search_terms, retstart=0, retmax=1000):
     return data.get("esearchresult", {}).get("idlist", [])
 
 
-def fetch_dataset_details(session, gds_id):
+def fetch_dataset_details(session, gds_id, api_key=None):
     """Fetch dataset metadata using ESummary API and parse structured JSON."""
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+    base_url = ESUMMARY_URL
     params = {"db": "gds", "id": gds_id, "retmode": "json"}
+    if api_key:
+        params["api_key"] = api_key
 
     response = session.get(base_url, params=params)
     response.raise_for_status()
@@ -55,21 +108,7 @@ def fetch_dataset_details(session, gds_id):
     try:
         result = data["result"]
         dataset_info = result.get(gds_id, {})
-
-        dataset = {
-            "GDS_ID": dataset_info.get("uid", ""),
-            "Accession": dataset_info.get("accession", ""),
-            "Title": dataset_info.get("title", ""),
-            "Summary": dataset_info.get("summary", ""),
-            "Organism": dataset_info.get("taxon", ""),
-            "Dataset_Type": dataset_info.get("gdstype", ""),
-            "Num_Samples": dataset_info.get("n_samples", ""),
-            "Bioproject": dataset_info.get("bioproject", ""),
-            "PubMed_IDs": "; ".join(dataset_info.get("pubmedids", [])),
-            "FTP_Link": dataset_info.get("ftplink", ""),
-            "Samples": "; ".join([f"{s['accession']} ({s['title']})" for s in dataset_info.get("samples", [])])
-        }
-        return dataset
+        return parse_dataset_summary(dataset_info)
 
     except Exception as e:
         print(f"Error parsing dataset {gds_id}: {str(e)}")
@@ -77,44 +116,230 @@ def fetch_dataset_details(session, gds_id):
         return None
 
 
-def process_geo_datasets(session, search_terms, max_datasets=100):
-    """Fetch and process GEO datasets based on search terms."""
+def parse_dataset_summary(dataset_info):
+    """Turn one ESummary document into a DataFrame row."""
+    return {
+        "GDS_ID": dataset_info.get("uid", ""),
+        "Accession": dataset_info.get("accession", ""),
+        "Title": dataset_info.get("title", ""),
+        "Summary": dataset_info.get("summary", ""),
+        "Organism": dataset_info.get("taxon", ""),
+        "Dataset_Type": dataset_info.get("gdstype", ""),
+        "Num_Samples": dataset_info.get("n_samples", ""),
+        "Bioproject": dataset_info.get("bioproject", ""),
+        "PubMed_IDs": "; ".join(dataset_info.get("pubmedids", [])),
+        "FTP_Link": dataset_info.get("ftplink", ""),
+        "Samples": "; ".join([f"{s['accession']} ({s['title']})" for s in dataset_info.get("samples", [])])
+    }
+
+
+def catalog_record(row):
+    """Map a dataset row onto the cross-source catalog columns; GEO has no per-file records."""
+    return {
+        "source": "geo",
+        "accession": row.get("Accession") or row.get("GDS_ID"),
+        "record_accession": row.get("GDS_ID"),
+        "title": row.get("Title"),
+        "file_url": row.get("FTP_Link"),
+        "organism": row.get("Organism"),
+        "assay": row.get("Dataset_Type"),
+        "extra": {key: row.get(key) for key in ("Num_Samples", "Bioproject", "PubMed_IDs")},
+    }
+
+
+def search_history(session, api_key=None, modified_since=None):
+    """Run ESearch with usehistory=y and return (count, webenv, query_key)."""
+    params = {
+        "db": "gds",
+        "term": SEARCH_QUERY,
+        "usehistory": "y",
+        "retmax": 0,
+        "retmode": "json",
+        **date_filter(modified_since)
+    }
+    if api_key:
+        params["api_key"] = api_key
+
+    # WebEnv handles expire, so history-bound calls must not come from the cache
+    response = session.get(ESEARCH_URL, params=params, headers={"Cache-Control": "no-store"})
+    response.raise_for_status()
+    result = response.json().get("esearchresult", {})
+    return int(result.get("count", 0)), result["webenv"], result["querykey"]
+
+
+def fetch_summary_batch(session, webenv, query_key, retstart, retmax, api_key=None):
+    """Fetch one batch of ESummary documents from the History server."""
+    params = {
+        "db": "gds",
+        "WebEnv": webenv,
+        "query_key": query_key,
+        "retstart": retstart,
+        "retmax": retmax,
+        "retmode": "json"
+    }
+    if api_key:
+        params["api_key"] = api_key
+
+    response = session.get(ESUMMARY_URL, params=params, headers={"Cache-Control": "no-store"})
+    response.raise_for_status()
+    result = response.json().get("result", {})
+
+    rows = []
+    for uid in result.get("uids", []):
+        try:
+            rows.append(parse_dataset_summary(result.get(uid, {})))
+        except Exception as e:
+            print(f"Error parsing dataset {uid}: {str(e)}")
+            print(traceback.format_exc())
+    print(f"Fetched summaries {retstart + 1}-{retstart + len(rows)}")
+    return rows
+
+
+def process_geo_datasets_batched(session, max_datasets=100, batch_size=SUMMARY_BATCH_SIZE, max_workers=None, modified_since=None, sink=None, on_error=None):
+    """Fetch GEO datasets through the History server in parallel ESummary batches.
+
+    With a sink, each batch is appended to it as it completes and batches
+    written by an interrupted run over the same result count are skipped.
+    A batch that fails is skipped and reported to `on_error(key, error)`.
+    `max_workers` defaults to MAX_WORKERS at call time.
+    """
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    api_key = get_api_key()
+    count, webenv, query_key = search_history(session, api_key=api_key, modified_since=modified_since)
+    total = int(min(count, max_datasets))
+    print(f"Found {count} datasets, fetching {total}")
+
+    done = set()
+    if sink and sink.done_keys:
+        done = {key for key, meta in sink.meta().items() if meta == {"count": count, "batch_size": batch_size}}
+        if done != sink.done_keys:
+            # Offsets only line up if the result set is unchanged
+            print("Search results changed since the interrupted run, starting over")
+            sink.reset()
+            done = set()
+
+    all_data = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (retstart, executor.submit(
+                fetch_summary_batch, session, webenv, query_key,
+                retstart, min(batch_size, total - retstart), api_key
+            ))
+            for retstart in range(0, total, batch_size)
+            if f"batch:{retstart}" not in done
+        ]
+
+        for retstart, future in futures:
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"Error fetching summary batch: {str(e)}")
+                print(traceback.format_exc())
+                if on_error:
+                    on_error(f"batch:{retstart}", e)
+                continue
+            if sink:
+                sink.write(f"batch:{retstart}", rows, meta={"count": count, "batch_size": batch_size})
+            else:
+                all_data.extend(rows)
+
+    return pd.DataFrame(all_data)
+
+
+def process_geo_datasets(session, search_terms, max_datasets=100, modified_since=None, sink=None, on_error=None):
+    """Fetch and process GEO datasets based on search terms.
+
+    With a sink, each dataset is appended to it and datasets it already
+    holds are not fetched again. Datasets that fail are skipped and
+    reported to `on_error(key, error)`.
+    """
+    done = sink.done_keys if sink else set()
+    api_key = get_api_key()  # get_session raises the host rate whenever a key is set
     all_data = []
     retmax = 1000
     retstart = 0
     counter = 0
 
     while counter < max_datasets:
-        gds_ids = fetch_gds_ids(session, search_terms, retstart=retstart, retmax=retmax)
+        gds_ids = fetch_gds_ids(session, search_terms, retstart=retstart, retmax=retmax, modified_since=modified_since, api_key=api_key)
         if not gds_ids:
             break  # No more results
 
         for gds_id in gds_ids:
+            if gds_id in done:
+                counter += 1
+                continue
             try:
                 print(f"Processing {counter + 1}: {gds_id}")
-                dataset = fetch_dataset_details(session, gds_id)
-                if dataset:
+                dataset = fetch_dataset_details(session, gds_id, api_key=api_key)
+                if dataset and sink:
+                    sink.write(gds_id, [dataset])
+                elif dataset:
                     all_data.append(dataset)
                 counter += 1
 
                 if counter >= max_datasets:
                     break  # Stop if we reach the limit
 
-                sleep(0.34)  # Rate limiting
-
             except Exception as e:
                 print(f"Error processing {gds_id}: {str(e)}")
                 print(traceback.format_exc())
+                if on_error:
+                    on_error(gds_id, e)
 
         retstart += retmax  # Move to the next page
 
     return pd.DataFrame(all_data)
 
 
-if __name__ == "__main__":
+def main():
     search_terms = ["intact Hi-C", "in situ Hi-C", "dilution Hi-C", "SPRITE"]
-    session = get_session()
-    
-    df = process_geo_datasets(session, search_terms, max_datasets=float('inf'))
-    df.to_excel(f"geo_datasets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx", index=False)
-    print(f"Saved {len(df)} records to geo_datasets.xlsx")
+    state = load_state(STATE_FILE) if INCREMENTAL else None
+    modified_since = state["watermark"] if state else None
+    # Taken before the crawl so records updated mid-run are picked up next time
+    run_date = datetime.now().strftime("%Y/%m/%d")
+    if modified_since:
+        print(f"Fetching datasets updated since {modified_since}")
+
+    sink = RecordSink(STREAM_FILE)
+    if sink.done_keys:
+        print(f"Resuming from {STREAM_FILE}")
+    failures = {}
+
+    if BATCHED:
+        session = get_session(pool_size=MAX_WORKERS + 1)
+        process_geo_datasets_batched(session, max_datasets=float('inf'), modified_since=modified_since, sink=sink, on_error=failures.__setitem__)
+    else:
+        session = get_session()
+        process_geo_datasets(session, search_terms, max_datasets=float('inf'), modified_since=modified_since, sink=sink, on_error=failures.__setitem__)
+
+    output = state["output"] if state else None
+    if EXPORT_EXCEL:
+        output = f"geo_datasets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{OUTPUT_FORMAT}"
+        rows = list(sink.iter_rows())
+        if INCREMENTAL:
+            df = merge_with_previous(state["output"], rows, "GDS_ID", [row["GDS_ID"] for row in rows])
+        else:
+            df = pd.DataFrame(rows)
+        write_table(df, output, schema=OUTPUT_SCHEMA)
+        print(f"Saved {len(df)} records to {output}")
+
+    if INCREMENTAL and failures:
+        print(f"⚠️ {len(failures)} fetches failed, leaving the watermark where it was so the next run retries them")
+    elif INCREMENTAL:
+        changes = {row["GDS_ID"]: run_date for row in sink.iter_rows()}
+        update_state(state, changes, output, watermark=run_date)
+        save_state(STATE_FILE, state)
+
+    if UPDATE_CATALOG:
+        update_catalog(catalog_record(row) for row in sink.iter_rows())
+    sink.close(complete=not failures)
+    if failures:
+        print(f"❌ {len(failures)} fetches failed, rerun to resume from {STREAM_FILE}")
+        sys.exit(1)
+    return output if EXPORT_EXCEL else None
+
+
+if __name__ == "__main__":
+    main()
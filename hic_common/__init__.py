@@ -0,0 +1 @@
+"""Helpers shared by the per-source scrapers and downloaders."""
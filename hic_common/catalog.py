@@ -0,0 +1,278 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CATALOG_PATH = os.getenv(
+    "HIC_CATALOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "catalog.sqlite")
+)
+
+# One row per file (per dataset for GEO, which has no file records)
+COLUMNS = [
+    "source",
+    "accession",
+    "record_accession",
+    "title",
+    "file_url",
+    "file_format",
+    "file_size",
+    "md5",
+    "biosource",
+    "organism",
+    "assay",
+    "lab",
+    "date",
+]
+
+# Filled in later from the files' own headers (see hic_common.probe); re-scraping keeps them
+HEADER_COLUMNS = [
+    "genome_assembly",
+    "chromosomes",
+    "resolutions",
+    "normalizations",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    source TEXT NOT NULL,
+    accession TEXT NOT NULL,
+    record_accession TEXT,
+    title TEXT,
+    file_url TEXT,
+    file_format TEXT,
+    file_size INTEGER,
+    md5 TEXT,
+    biosource TEXT,
+    organism TEXT,
+    assay TEXT,
+    lab TEXT,
+    date TEXT,
+    extra TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (source, accession)
+);
+CREATE INDEX IF NOT EXISTS files_accession ON files (accession);
+CREATE INDEX IF NOT EXISTS files_format ON files (file_format, source);
+CREATE INDEX IF NOT EXISTS files_biosource ON files (biosource COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_organism ON files (organism COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_size ON files (file_size);
+"""
+
+HEADER_INDEX = "CREATE INDEX IF NOT EXISTS files_assembly ON files (genome_assembly COLLATE NOCASE)"
+
+BATCH_SIZE = 1000  # Rows per transaction when upserting
+COMPRESSION_SUFFIXES = (".gz", ".bgz", ".bz2", ".xz", ".zip")  # Dropped before reading the format off a file name
+# Portals spell formats differently (ENCODE "bigWig", 4DN "bw"); the catalog keeps the file extension
+FORMAT_ALIASES = {
+    "bigwig": "bw",
+    "bigbed": "bb",
+    "bedgraph": "bg",
+    "bdg": "bg",
+}
+
+
+def as_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def as_text(value):
+    if value is None or value == "" or (isinstance(value, float) and value != value):
+        return None
+    return str(value)
+
+
+def format_from_name(name):
+    """File format from a file name's extension, ignoring a compression suffix: sample.strelka2.vcf.gz -> vcf"""
+    name = (name or "").lower()
+    for suffix in COMPRESSION_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    if "." not in name:
+        return None
+    return name.rsplit(".", 1)[-1] or None
+
+
+def normalize_format(value):
+    """Lower-case a portal's file format and map it onto the catalog's name for it: bigWig -> bw"""
+    value = as_text(value)
+    if value is None:
+        return None
+    value = value.strip().lower()
+    return FORMAT_ALIASES.get(value, value) or None
+
+
+def header_value(value):
+    if isinstance(value, list):
+        return ",".join(str(item) for item in value) or None
+    return as_text(value)
+
+
+class Catalog:
+    """Local SQLite index of every file record the scrapers have seen.
+
+    Each scraper maps its rows onto COLUMNS (anything else goes into the
+    JSON `extra` column) and upserts them keyed on (source, accession),
+    so re-running a scraper refreshes its entries in place. File formats
+    are stored and queried through normalize_format, so one name finds
+    the same kind of file from every source.
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+        for column in HEADER_COLUMNS:
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE files ADD COLUMN {column} TEXT")
+        self._conn.execute(HEADER_INDEX)
+        # Rows written before formats were normalized
+        self._conn.create_function("normalize_format", 1, normalize_format, deterministic=True)
+        self._conn.execute(
+            "UPDATE files SET file_format = normalize_format(file_format) "
+            "WHERE file_format IS NOT normalize_format(file_format)"
+        )
+        self._conn.commit()
+
+    def upsert(self, records):
+        """Insert or replace catalog records (dicts keyed by COLUMNS plus `extra`); return the count."""
+        count = 0
+        batch = []
+        for record in records:
+            if not record or not record.get("accession"):
+                continue
+            batch.append(self._values(record))
+            if len(batch) >= BATCH_SIZE:
+                count += self._write(batch)
+                batch = []
+        if batch:
+            count += self._write(batch)
+        return count
+
+    def _values(self, record):
+        values = [as_text(record.get(column)) for column in COLUMNS]
+        values[COLUMNS.index("file_size")] = as_int(record.get("file_size"))
+        values[COLUMNS.index("file_format")] = normalize_format(record.get("file_format"))
+        extra = record.get("extra")
+        values.append(json.dumps(extra, default=str) if extra else None)
+        values.append(time.time())
+        return values
+
+    def _write(self, batch):
+        placeholders = ", ".join("?" * (len(COLUMNS) + 2))
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS[2:] + ["extra", "updated_at"])
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT INTO files ({', '.join(COLUMNS)}, extra, updated_at) VALUES ({placeholders}) "
+                f"ON CONFLICT (source, accession) DO UPDATE SET {updates}",
+                batch
+            )
+            self._conn.commit()
+        return len(batch)
+
+    def set_headers(self, headers):
+        """Store probed header fields; `headers` is a list of (source, accession, fields)."""
+        rows = []
+        for source, accession, fields in headers:
+            rows.append([header_value(fields.get(column)) for column in HEADER_COLUMNS] + [source, accession])
+        with self._lock:
+            self._conn.executemany(
+                f"UPDATE files SET {', '.join(f'{column} = ?' for column in HEADER_COLUMNS)} WHERE source = ? AND accession = ?",
+                rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def query(self, sources=None, file_formats=None, biosource=None, organism=None,
+              min_size=None, max_size=None, accession=None, assembly=None, limit=None):
+        """Return matching rows as dicts.
+
+        `sources` are matched exactly, `file_formats` exactly after
+        normalize_format; `biosource` and `organism` match
+        case-insensitively as substrings, `assembly` exactly but ignoring
+        case (only files whose headers were probed have one).
+        """
+        clauses = []
+        params = []
+        if sources:
+            clauses.append(f"source IN ({', '.join('?' * len(sources))})")
+            params += list(sources)
+        if file_formats:
+            clauses.append(f"file_format IN ({', '.join('?' * len(file_formats))})")
+            params += [normalize_format(file_format) for file_format in file_formats]
+        if biosource:
+            clauses.append("biosource LIKE ?")
+            params.append(f"%{biosource}%")
+        if organism:
+            clauses.append("organism LIKE ?")
+            params.append(f"%{organism}%")
+        if min_size is not None:
+            clauses.append("file_size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append("file_size <= ?")
+            params.append(max_size)
+        if accession:
+            clauses.append("(accession = ? OR record_accession = ?)")
+            params += [accession, accession]
+        if assembly:
+            clauses.append("genome_assembly = ? COLLATE NOCASE")
+            params.append(assembly)
+
+        sql = f"SELECT {', '.join(COLUMNS + HEADER_COLUMNS)} FROM files"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY source, accession"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def counts(self):
+        """Return {source: number of records}."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT source, COUNT(*) FROM files GROUP BY source").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def update_catalog(records, path=DEFAULT_CATALOG_PATH):
+    """Upsert records into the catalog at `path` and report how many were written."""
+    catalog = Catalog(path)
+    try:
+        count = catalog.upsert(records)
+    finally:
+        catalog.close()
+    print(f"Catalog: {count} records upserted into {catalog.path}")
+    return count
+
+
+def to_manifest(rows):
+    """Turn catalog rows into downloader manifest rows (File / File Size / MD5 plus provenance)."""
+    return [
+        {
+            "File": row["file_url"],
+            "File Size": row["file_size"],
+            "MD5": row["md5"],
+            "Source": row["source"],
+            "Accession": row["accession"],
+            "File Format": row["file_format"],
+            "Biosource": row["biosource"],
+            "Genome Assembly": row.get("genome_assembly"),
+        }
+        for row in rows
+        if row["file_url"]
+    ]
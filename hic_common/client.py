@@ -0,0 +1,83 @@
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase, HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+from hic_common.http_cache import install_cache
+from hic_common.ratelimit import install_rate_limit
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip, deflate"}
+# 429/503 are taken out again by install_rate_limit, which backs off on them itself
+DEFAULT_RETRIES = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"]
+)
+
+
+class BearerAuth(AuthBase):
+    """`Authorization: Bearer <token>`, as Synapse expects."""
+
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, request):
+        request.headers["Authorization"] = f"Bearer {self.token}"
+        return request
+
+
+class HeaderTokenAuth(AuthBase):
+    """A token sent in a portal-specific header, e.g. CAVATICA's X-SBG-Auth-Token."""
+
+    def __init__(self, header, token):
+        self.header = header
+        self.token = token
+
+    def __call__(self, request):
+        request.headers[self.header] = self.token
+        return request
+
+
+def basic_auth(key_id, secret):
+    """4DN access keys are plain HTTP basic auth."""
+    return HTTPBasicAuth(key_id, secret)
+
+
+def bearer_auth(token):
+    return BearerAuth(token)
+
+
+def sbg_token_auth(token):
+    return HeaderTokenAuth("X-SBG-Auth-Token", token)
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, headers=None, auth=None, retries=DEFAULT_RETRIES,
+                   rate_limit=True, cache=False, cache_methods=("GET",), incremental=False):
+    """Build the keep-alive session every scraper and downloader talks through.
+
+    The connection pool holds `pool_size` connections per host, so size it
+    to the number of threads sharing the session; that way every worker
+    reuses a warm connection instead of paying a new TCP + TLS handshake.
+    `auth` is attached to the session (see the *_auth helpers), which lets
+    requests drop it when a redirect leaves the portal's host. Requests go
+    through the per-host adaptive limiters unless `rate_limit` is off, and
+    through the shared HTTP cache when `cache` is on. Sessions for an
+    `incremental` crawl never use the cache: the watermark is a whole day,
+    so a delta query can repeat the previous run's URL exactly and would
+    otherwise get that run's answer back.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    session.headers.update(headers or {})
+    session.auth = auth
+
+    if rate_limit:
+        install_rate_limit(session)
+    if cache and not incremental:
+        install_cache(session, methods=cache_methods)
+    return session
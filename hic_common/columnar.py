@@ -0,0 +1,65 @@
+import math
+import os
+
+import pandas as pd
+
+COLUMNAR_EXTENSIONS = (".parquet", ".feather")
+
+
+def as_text(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return str(value)
+
+
+def to_typed_frame(data, schema=None):
+    """Build a DataFrame and cast it to a per-source schema.
+
+    `schema` maps column name -> "category" (dictionary-encoded string),
+    "Int64" (nullable integer), "datetime" or "string". Unlisted object
+    columns become plain strings so mixed values (e.g. "" next to ints, or
+    stray dicts) don't break the Arrow conversion.
+    """
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(list(data))
+    schema = schema or {}
+
+    for column in df.columns:
+        kind = schema.get(column)
+        if kind == "Int64":
+            df[column] = pd.to_numeric(df[column].where(df[column] != ""), errors="coerce").astype("Int64")
+        elif kind == "datetime":
+            df[column] = pd.to_datetime(df[column].where(df[column] != ""), errors="coerce")
+        elif kind == "category":
+            df[column] = df[column].map(as_text).astype("category")
+        elif kind == "string" or df[column].dtype == object:
+            df[column] = df[column].map(as_text).astype("string")
+    return df
+
+
+def write_table(data, path, schema=None):
+    """Write rows or a DataFrame to .parquet, .feather or Excel, picked by extension.
+
+    The schema is only applied to the columnar formats, so Excel output
+    stays as it always was.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in COLUMNAR_EXTENSIONS:
+        df = to_typed_frame(data, schema)
+        if extension == ".parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.to_feather(path)
+    else:
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(list(data))
+        df.to_excel(path, index=False)
+    return df
+
+
+def read_table(path, columns=None):
+    """Read a scraper output back, loading only `columns` when the format allows it."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    if extension == ".feather":
+        return pd.read_feather(path, columns=columns)
+    return pd.read_excel(path, usecols=columns)
@@ -0,0 +1,352 @@
+import errno
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from hic_common.metrics import METRICS
+from hic_common.ratelimit import TokenBucket
+
+CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = ".part"
+SEGMENTS_SUFFIX = ".segments"  # Sidecar recording per-segment progress of a .part file
+
+SEGMENT_THRESHOLD = 256 * 1024 ** 2  # Smaller files use a single stream
+SEGMENT_TARGET_SIZE = 512 * 1024 ** 2  # Roughly one connection per this many bytes
+MAX_SEGMENTS = 8
+PROGRESS_EVERY = 16 * 1024 ** 2  # Bytes per segment between sidecar updates
+CORRUPT_SUFFIX = ".corrupt"  # Downloads failing their checksum are moved aside under this name
+
+BANDWIDTH = None  # Process-wide byte budget shared by every download, set with limit_bandwidth
+
+
+def limit_bandwidth(bytes_per_second):
+    """Cap the combined rate of all downloads in this process; None removes the cap."""
+    global BANDWIDTH
+    BANDWIDTH = TokenBucket(bytes_per_second, capacity=max(bytes_per_second, CHUNK_SIZE)) if bytes_per_second else None
+
+
+def throttle_bandwidth(size):
+    bandwidth = BANDWIDTH
+    if bandwidth:
+        bandwidth.acquire(min(size, bandwidth.capacity))
+
+
+class ChecksumError(IOError):
+    pass
+
+
+class StreamHasher:
+    """MD5 of a file that is being written, possibly out of order.
+
+    `ranges` are the [start, end, bytes done] segments being filled. Bytes
+    written exactly at the hash position are hashed straight from memory;
+    bytes that land ahead of it (later segments, or a .part left over from
+    an earlier attempt) are read back once the position reaches them,
+    which normally comes from the page cache rather than the disk.
+    """
+
+    def __init__(self, path, ranges):
+        self.path = path
+        self.ranges = ranges
+        self.position = 0
+        self._md5 = hashlib.md5()
+        self._lock = threading.Lock()
+        with self._lock:
+            self._catch_up()
+
+    def written(self, segment, data):
+        """Record that `data` was just written at the end of `segment`."""
+        with self._lock:
+            offset = segment[0] + segment[2]
+            segment[2] += len(data)
+            if offset == self.position:
+                self._md5.update(data)
+                self.position += len(data)
+            self._catch_up()
+
+    def _catch_up(self):
+        for start, end, done in self.ranges:
+            if not start <= self.position <= end:
+                continue
+            frontier = start + done
+            if frontier > self.position:
+                with open(self.path, "rb") as f:
+                    f.seek(self.position)
+                    while self.position < frontier:
+                        data = f.read(min(CHUNK_SIZE, frontier - self.position))
+                        if not data:
+                            break
+                        self._md5.update(data)
+                        self.position += len(data)
+            if frontier <= end:
+                return  # This segment is still being filled
+
+    def hexdigest(self):
+        with self._lock:
+            self._catch_up()
+            return self._md5.hexdigest()
+
+
+def record_written(hasher, segment, data):
+    if hasher:
+        hasher.written(segment, data)
+    else:
+        segment[2] += len(data)
+
+
+def verify_checksum(hasher, expected_md5, part_path, path):
+    """Compare the streamed MD5; on mismatch move the data aside and raise."""
+    if hasher is None:
+        return
+    actual = hasher.hexdigest()
+    if actual != expected_md5.lower():
+        corrupt_path = path + CORRUPT_SUFFIX
+        os.replace(part_path, corrupt_path)
+        raise ChecksumError(f"MD5 mismatch for {path}: expected {expected_md5}, got {actual}; moved to {corrupt_path}")
+
+
+def parse_size(value):
+    """Turn a manifest File Size cell into an int, or None if it is missing."""
+    try:
+        size = int(float(value))
+    except (TypeError, ValueError):
+        return None
+    return size if size >= 0 else None
+
+
+def is_complete(path, expected_size):
+    """A finished file exists at its final name and, if known, has the expected size."""
+    if not os.path.exists(path):
+        return False
+    return expected_size is None or os.path.getsize(path) == expected_size
+
+
+def download_resumable(url, path, expected_size=None, session=None, auth=None, chunk_size=CHUNK_SIZE, expected_md5=None):
+    """Stream `url` into `path` via a .part file, resuming with a Range request.
+
+    Bytes land in `path + ".part"`; a leftover .part from an earlier attempt
+    is continued with `Range: bytes=<offset>-` when the server answers 206,
+    and restarted from zero when it ignores the range. The .part file is
+    renamed over `path` only once the transfer ends (and matches
+    `expected_size` when given), so a file at its final name is always whole.
+    With `expected_md5` the data is hashed as it streams (plus one read of
+    any resumed prefix) and a mismatch raises ChecksumError.
+    """
+    http = session or requests
+    part_path = path + PART_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    if expected_size is not None and offset > expected_size:
+        offset = 0  # Stale .part from a different file version
+
+    end = expected_size - 1 if expected_size is not None else sys.maxsize
+
+    def finish():
+        if expected_md5:
+            verify_checksum(StreamHasher(part_path, [[0, end, offset]]), expected_md5, part_path, path)
+        os.replace(part_path, path)
+        return path
+
+    if expected_size is not None and offset == expected_size:
+        return finish()
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    started = time.monotonic()
+    with http.get(url, auth=auth, headers=headers, stream=True) as response:
+        if response.status_code == 416 and offset:
+            # Nothing past our offset: the .part already holds the whole file
+            return finish()
+        response.raise_for_status()
+
+        if offset and response.status_code != 206:
+            offset = 0  # Range not honoured, start over
+        segment = [0, end, offset]
+        try:
+            with open(part_path, "ab" if offset else "wb") as f:
+                hasher = StreamHasher(part_path, [segment]) if expected_md5 else None
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        record_written(hasher, segment, chunk)
+                        throttle_bandwidth(len(chunk))
+        finally:
+            METRICS.record_download(url, path, segment[2] - offset, time.monotonic() - started)
+
+    size = os.path.getsize(part_path)
+    if expected_size is not None and size != expected_size:
+        raise IOError(f"Incomplete download: got {size} of {expected_size} bytes, keeping {part_path}")
+
+    verify_checksum(hasher, expected_md5, part_path, path)
+    os.replace(part_path, path)
+    return path
+
+
+def choose_segment_count(size):
+    """Scale connections with file size: one below the threshold, up to MAX_SEGMENTS."""
+    if size is None or size < SEGMENT_THRESHOLD:
+        return 1
+    return max(2, min(MAX_SEGMENTS, -(-size // SEGMENT_TARGET_SIZE)))
+
+
+def split_ranges(size, count):
+    """Split [0, size) into `count` contiguous inclusive byte ranges."""
+    step = -(-size // count)
+    return [[start, min(start + step, size) - 1] for start in range(0, size, step)]
+
+
+def probe_ranges(url, session=None, auth=None):
+    """Ask for the first byte; return (final URL, total size) if ranges work, else None.
+
+    Following the redirect here means the segments go straight to the
+    object store instead of each paying for it.
+    """
+    http = session or requests
+    with http.get(url, auth=auth, headers={"Range": "bytes=0-0"}, stream=True) as response:
+        if response.status_code != 206:
+            return None
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.rpartition("/")[2]
+        if not total.isdigit():
+            return None
+        return response.url, int(total)
+
+
+def discard_segmented_part(path):
+    """Remove a preallocated .part and its sidecar so a single stream starts from zero.
+
+    Its size is the full file size whatever was actually written, which
+    download_resumable would otherwise take for a finished transfer.
+    """
+    part_path = path + PART_SUFFIX
+    sidecar_path = part_path + SEGMENTS_SUFFIX
+    if os.path.exists(sidecar_path):
+        for leftover in (part_path, sidecar_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def preallocate(fd, size):
+    """Reserve `size` bytes on disk; truncate only makes a sparse file where fallocate is missing."""
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                raise  # ENOSPC and the like should stop the download here
+    os.ftruncate(fd, size)
+
+
+def write_at(fd, data, offset, lock):
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, offset)
+        return
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def download_segmented(url, path, expected_size=None, session=None, auth=None, segments=None, chunk_size=CHUNK_SIZE, expected_md5=None):
+    """Download `url` over several ranged connections written in place into `path`.
+
+    The .part file is preallocated to the full size and every segment
+    writes its bytes at their final offsets. Progress per segment is kept
+    in a sidecar so an interrupted download resumes each segment where it
+    stopped. Falls back to download_resumable when the server does not
+    honour ranges or the file is too small to be worth splitting. With
+    `expected_md5`, a StreamHasher follows the lowest unfinished offset so
+    most bytes are hashed from memory as they arrive.
+    """
+    http = session or requests
+    probe = probe_ranges(url, session=session, auth=auth)
+    if probe is None:
+        discard_segmented_part(path)
+        return download_resumable(url, path, expected_size=expected_size, session=session, auth=auth, expected_md5=expected_md5)
+
+    resolved_url, size = probe
+    if expected_size is not None and size != expected_size:
+        raise IOError(f"Server reports {size} bytes for {url}, expected {expected_size}")
+    count = segments or choose_segment_count(size)
+    if count < 2:
+        discard_segmented_part(path)
+        return download_resumable(url, path, expected_size=expected_size, session=session, auth=auth, expected_md5=expected_md5)
+
+    # Credentials must not follow a redirect to another host
+    if urlparse(resolved_url).netloc != urlparse(url).netloc:
+        auth = None
+
+    part_path = path + PART_SUFFIX
+    sidecar_path = part_path + SEGMENTS_SUFFIX
+    ranges = None
+    if os.path.exists(part_path) and os.path.exists(sidecar_path):
+        with open(sidecar_path) as f:
+            saved = json.load(f)
+        if saved.get("size") == size:
+            ranges = saved["ranges"]
+    if ranges is None:
+        # [start, end, bytes done]
+        ranges = [[start, end, 0] for start, end in split_ranges(size, count)]
+        with open(part_path, "wb") as f:
+            preallocate(f.fileno(), size)
+
+    progress_lock = threading.Lock()
+    write_lock = threading.Lock()
+    hasher = StreamHasher(part_path, ranges) if expected_md5 else None
+
+    def save_progress():
+        with progress_lock:
+            tmp_path = sidecar_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"size": size, "ranges": ranges}, f)
+            os.replace(tmp_path, sidecar_path)
+
+    def fetch(segment):
+        start, end, done = segment
+        if start + done > end:
+            return
+        headers = {"Range": f"bytes={start + done}-{end}"}
+        with http.get(resolved_url, auth=auth, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError(f"Server ignored range request for {url}")
+            unsaved = 0
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                write_at(fd, chunk, start + segment[2], write_lock)
+                record_written(hasher, segment, chunk)
+                throttle_bandwidth(len(chunk))
+                unsaved += len(chunk)
+                if unsaved >= PROGRESS_EVERY:
+                    save_progress()
+                    unsaved = 0
+        save_progress()
+
+    done_before = sum(done for _, _, done in ranges)
+    started = time.monotonic()
+    fd = os.open(part_path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            for future in [executor.submit(fetch, segment) for segment in ranges]:
+                future.result()
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        transferred = sum(done for _, _, done in ranges) - done_before
+        METRICS.record_download(resolved_url, path, transferred, time.monotonic() - started)
+
+    missing = sum(end - start + 1 - done for start, end, done in ranges)
+    if missing:
+        raise IOError(f"Incomplete download: {missing} bytes missing, keeping {part_path}")
+
+    os.remove(sidecar_path)
+    verify_checksum(hasher, expected_md5, part_path, path)
+    os.replace(part_path, path)
+    return path
@@ -0,0 +1,234 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from hic_common.metrics import METRICS
+from hic_common.ratelimit import ThrottledAdapter
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "HIC_HTTP_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".cache", "http_cache.sqlite")
+)
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600  # Entries younger than this are served without a request
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # Least recently used entries are evicted past this size
+MAX_ENTRY_BYTES = 64 * 1024 ** 2  # Larger bodies are never cached
+# Part of the key, so a response fetched with one token's permissions is never served to another
+CREDENTIAL_HEADERS = ("Authorization", "X-SBG-Auth-Token", "Cookie")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+)
+"""
+
+
+class HTTPCache:
+    """SQLite-backed response store keyed on method + URL + request body + credentials."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(method, url, body=None, credentials=None):
+        """Hash the request; `credentials` are the auth header values it was sent with."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        digest = hashlib.sha256()
+        digest.update(method.upper().encode("ascii"))
+        digest.update(b" ")
+        digest.update(url.encode("utf-8"))
+        digest.update(b" ")
+        digest.update(body or b"")
+        for credential in credentials or ():
+            digest.update(b" ")
+            digest.update(credential.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached entry as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, status, headers, body, etag, last_modified, stored_at FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+        url, status, headers, body, etag, last_modified, stored_at = row
+        return {
+            "url": url,
+            "status": status,
+            "headers": decode_headers(headers),
+            "body": body,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": stored_at,
+        }
+
+    def is_fresh(self, entry):
+        return time.time() - entry["stored_at"] < self.ttl
+
+    def set(self, key, url, status, headers, body):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, status, encode_headers(headers), body,
+                 headers.get("ETag"), headers.get("Last-Modified"), now, now, len(body))
+            )
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, key):
+        """Mark an entry as revalidated (after a 304)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+            self._conn.commit()
+
+    def _evict(self):
+        # Entries past their TTL without validators can never be reused
+        self._conn.execute(
+            "DELETE FROM responses WHERE stored_at < ? AND etag IS NULL AND last_modified IS NULL",
+            (time.time() - self.ttl,)
+        )
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+def encode_headers(headers):
+    return "\n".join(f"{name}: {value}" for name, value in headers.items())
+
+
+def decode_headers(text):
+    headers = CaseInsensitiveDict()
+    for line in text.splitlines():
+        name, _, value = line.partition(": ")
+        headers[name] = value
+    return headers
+
+
+class CachingAdapter(ThrottledAdapter):
+    """HTTPAdapter that serves fresh responses from an HTTPCache and revalidates stale ones.
+
+    Only non-streamed requests whose method is in `methods` are cached, so
+    file downloads always go to the network. Requests sent with
+    `Cache-Control: no-store` bypass the cache entirely. Cache hits never
+    touch the rate limiters; everything that goes out is paced like any
+    ThrottledAdapter request.
+    """
+
+    def __init__(self, cache, methods=("GET",), **kwargs):
+        self.cache = cache
+        self.methods = tuple(method.upper() for method in methods)
+        super().__init__(**kwargs)
+
+    def send(self, request, stream=False, **kwargs):
+        if stream or request.method not in self.methods or "no-store" in request.headers.get("Cache-Control", ""):
+            return super().send(request, stream=stream, **kwargs)
+
+        credentials = [request.headers[name] for name in CREDENTIAL_HEADERS if name in request.headers]
+        key = self.cache.make_key(request.method, request.url, request.body, credentials)
+        entry = self.cache.get(key)
+
+        if entry is not None:
+            if self.cache.is_fresh(entry):
+                METRICS.record_cache_hit(request.url)
+                return self.build_cached_response(request, entry)
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = super().send(request, stream=stream, **kwargs)
+
+        if entry is not None and response.status_code == 304:
+            self.cache.touch(key)
+            METRICS.record_cache_hit(request.url)
+            return self.build_cached_response(request, entry)
+
+        if response.status_code == 200 and len(response.content) <= MAX_ENTRY_BYTES:
+            self.cache.set(key, response.url, response.status_code, response.headers, response.content)
+        response.from_cache = False
+        return response
+
+    def build_cached_response(self, request, entry):
+        response = Response()
+        response.status_code = entry["status"]
+        response.reason = "OK"
+        response.headers = entry["headers"]
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry["body"]
+        response.url = entry["url"]
+        response.request = request
+        response.connection = self
+        response.from_cache = True
+        return response
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Return the process-wide cache at DEFAULT_CACHE_PATH, opening it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = HTTPCache()
+        return _default_cache
+
+
+def install_cache(session, cache=None, methods=("GET",)):
+    """Swap the session's HTTPS/HTTP adapters for caching ones with the same retry, pool and rate-limit settings."""
+    cache = cache or get_default_cache()
+    for prefix in ("https://", "http://"):
+        current = session.get_adapter(prefix)
+        adapter = CachingAdapter(
+            cache,
+            methods=methods,
+            limiters=getattr(current, "limiters", None),
+            max_retries=current.max_retries,
+            pool_connections=current._pool_connections,
+            pool_maxsize=current._pool_maxsize,
+        )
+        session.mount(prefix, adapter)
+    return session
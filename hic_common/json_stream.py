@@ -0,0 +1,160 @@
+import codecs
+import json
+import queue
+import threading
+
+READ_SIZE = 64 * 1024  # Bytes pulled off the socket per read
+GRAPH_BACKLOG = 10000  # Parsed items allowed to wait for a slow consumer before reading pauses
+PUT_TIMEOUT = 0.5  # Seconds between checks whether the consumer has stopped while the backlog is full
+WHITESPACE = " \t\n\r"
+DELIMITERS = WHITESPACE + ",]}"  # What may follow a complete number
+
+_decoder = json.JSONDecoder()
+
+
+class JSONStream:
+    """Incremental reader over decoded text chunks that decodes one JSON value at a time.
+
+    Only the unread tail of the text is kept, so memory follows the
+    largest single value rather than the whole document.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = ""
+        self.position = 0
+        self.exhausted = False
+
+    def fill(self):
+        if self.exhausted:
+            return False
+        if self.position > READ_SIZE:
+            self.buffer = self.buffer[self.position:]
+            self.position = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer += chunk
+                return True
+        self.exhausted = True
+        return False
+
+    def peek(self):
+        """Skip whitespace and return the next character, or "" at the end."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ""
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError(f"Expected {character!r} in JSON stream, found {self.peek()!r}")
+        self.position += 1
+
+    def value(self):
+        """Decode the next complete value, reading more text until it is whole."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            if isinstance(value, (int, float)) and not self.exhausted and (
+                end == len(self.buffer) or self.buffer[end] not in DELIMITERS
+            ):
+                # A number is only whole once a delimiter follows it: "1." or "1e" decodes as 1
+                # and the rest of it may still be in the next chunk
+                if self.fill():
+                    continue
+            self.position = end
+            return value
+
+
+def text_chunks(response, chunk_size=READ_SIZE):
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def iter_graph(response, key="@graph"):
+    """Yield the items of a top-level JSON array (the portals' "@graph") as they arrive.
+
+    `response` must come from a request made with stream=True. Other
+    top-level members are decoded and dropped on the way, and reading
+    stops at the end of the array. Processing can start with the first
+    item, while the rest of the body is still on the wire.
+    """
+    stream = JSONStream(text_chunks(response))
+    stream.expect("{")
+    while stream.peek() != "}":
+        name = stream.value()
+        stream.expect(":")
+        if name != key:
+            stream.value()
+        else:
+            stream.expect("[")
+            while stream.peek() != "]":
+                yield stream.value()
+                if stream.peek() == ",":
+                    stream.position += 1
+            return
+        if stream.peek() == ",":
+            stream.position += 1
+    raise KeyError(key)
+
+
+def stream_graph(session, url, backlog=GRAPH_BACKLOG, **kwargs):
+    """GET `url` and yield its "@graph" items while a reader thread keeps draining the socket.
+
+    Reading on a separate thread means the connection is not left idle
+    (and timed out by the server) while the caller spends time on each
+    item, e.g. fetching its details. At most `backlog` parsed items wait
+    in memory. The request error, if any, is raised on the first item.
+    If the caller stops early the reader gives up and closes the response.
+    """
+    items = queue.Queue(maxsize=backlog)
+    stopped = threading.Event()
+    done = object()
+    response = session.get(url, stream=True, **kwargs)
+    response.raise_for_status()
+
+    def put(item):
+        # A bounded put would block forever once the consumer has gone away
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            with response:
+                for item in iter_graph(response):
+                    if not put(item):
+                        return
+        except Exception as e:
+            if not stopped.is_set():
+                put(e)
+        finally:
+            response.close()
+            put(done)
+
+    threading.Thread(target=read, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        response.close()  # Also stops the download if the caller gave up early
@@ -0,0 +1,212 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Seconds
+JSON_PATH = os.getenv("HIC_METRICS_JSON")  # Summary written here when the process exits
+TEXTFILE_PATH = os.getenv("HIC_METRICS_TEXTFILE")  # Prometheus textfile, rewritten while running
+TEXTFILE_INTERVAL = 15  # Seconds between textfile rewrites
+
+# Words like "v1" or "bundle2" are part of the route; anything else with a digit is an id
+ROUTE_SEGMENT = re.compile(r"[A-Za-z_@.-]+\d{0,2}")
+
+
+def endpoint_of(url):
+    """Collapse a URL to host + path template, e.g. /repo/v1/entity/{id}/bundle2."""
+    parsed = urlparse(url)
+    segments = [
+        segment if not segment or ROUTE_SEGMENT.fullmatch(segment) or not any(c.isdigit() for c in segment) else "{id}"
+        for segment in parsed.path.split("/")
+    ]
+    return parsed.hostname or "", "/".join(segments) or "/"
+
+
+def new_request_stats():
+    return {
+        "requests": 0,
+        "errors": 0,
+        "retries": 0,
+        "throttled": 0,
+        "cache_hits": 0,
+        "bytes": 0,
+        "latency_sum": 0.0,
+        "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+        "rate_limit_wait": 0.0,
+    }
+
+
+class Metrics:
+    """Thread-safe request and download counters for one process.
+
+    Requests are keyed by (host, endpoint template); downloads keep one
+    entry per file plus a per-host total for throughput.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = {}
+        self.downloads = {}
+        self.download_hosts = {}
+        self._lock = threading.Lock()
+        self._exporter = None
+
+    def _stats(self, url):
+        key = endpoint_of(url)
+        if key not in self.requests:
+            self.requests[key] = new_request_stats()
+        return self.requests[key]
+
+    def record_request(self, url, status, seconds, size=0, retries=0, throttled=False):
+        with self._lock:
+            stats = self._stats(url)
+            stats["requests"] += 1
+            stats["retries"] += retries
+            stats["bytes"] += size
+            stats["latency_sum"] += seconds
+            if throttled:
+                stats["throttled"] += 1
+            if status is None or status >= 400:
+                stats["errors"] += 1
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                index = len(LATENCY_BUCKETS)
+            stats["latency_buckets"][index] += 1
+        self._start_exporter()
+
+    def record_wait(self, url, seconds):
+        """Time a request spent held back by a rate limiter."""
+        with self._lock:
+            self._stats(url)["rate_limit_wait"] += seconds
+
+    def record_cache_hit(self, url):
+        with self._lock:
+            self._stats(url)["cache_hits"] += 1
+
+    def record_download(self, url, path, size, seconds):
+        """Bytes actually transferred for one file in this attempt and how long it took."""
+        host = urlparse(url).hostname or ""
+        with self._lock:
+            entry = self.downloads.setdefault(path, {"host": host, "bytes": 0, "seconds": 0.0})
+            entry["bytes"] += size
+            entry["seconds"] += seconds
+            total = self.download_hosts.setdefault(host, {"files": 0, "bytes": 0, "seconds": 0.0})
+            total["files"] += 1
+            total["bytes"] += size
+            total["seconds"] += seconds
+        self._start_exporter()
+
+    def summary(self):
+        with self._lock:
+            requests = []
+            for (host, endpoint), stats in sorted(self.requests.items()):
+                entry = {"host": host, "endpoint": endpoint, **stats}
+                entry["latency_buckets"] = dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], stats["latency_buckets"]))
+                entry["mean_latency"] = stats["latency_sum"] / stats["requests"] if stats["requests"] else None
+                requests.append(entry)
+            downloads = {
+                path: {**entry, "bytes_per_second": entry["bytes"] / entry["seconds"] if entry["seconds"] else None}
+                for path, entry in self.downloads.items()
+            }
+            hosts = {
+                host: {**entry, "bytes_per_second": entry["bytes"] / entry["seconds"] if entry["seconds"] else None}
+                for host, entry in self.download_hosts.items()
+            }
+        return {
+            "started": self.started,
+            "elapsed": time.time() - self.started,
+            "requests": requests,
+            "downloads": downloads,
+            "download_hosts": hosts,
+        }
+
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.summary(), indent=2, sort_keys=True))
+
+    def prometheus_text(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP hic_{name} {help_text}")
+            lines.append(f"# TYPE hic_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{escape(val)}"' for key, val in labels.items())
+                lines.append(f"hic_{name}{{{label_text}}} {value}")
+
+        with self._lock:
+            requests = [({"host": host, "endpoint": endpoint}, stats) for (host, endpoint), stats in sorted(self.requests.items())]
+            hosts = sorted(self.download_hosts.items())
+
+        for name, field, help_text in (
+            ("requests_total", "requests", "HTTP requests sent, including 429 attempts"),
+            ("request_errors_total", "errors", "Requests answered with a status of 400 or above"),
+            ("request_retries_total", "retries", "Retries performed by the transport"),
+            ("requests_throttled_total", "throttled", "Responses with status 429 or 503"),
+            ("cache_hits_total", "cache_hits", "Requests answered from the HTTP cache"),
+            ("response_bytes_total", "bytes", "Response body bytes received"),
+            ("rate_limit_wait_seconds_total", "rate_limit_wait", "Time spent waiting for the rate limiter"),
+        ):
+            metric(name, "counter", help_text, [(labels, stats[field]) for labels, stats in requests])
+
+        lines.append("# HELP hic_request_duration_seconds Request latency until the response headers arrived")
+        lines.append("# TYPE hic_request_duration_seconds histogram")
+        for labels, stats in requests:
+            label_text = ",".join(f'{key}="{escape(val)}"' for key, val in labels.items())
+            cumulative = 0
+            for bound, count in zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], stats["latency_buckets"]):
+                cumulative += count
+                lines.append(f'hic_request_duration_seconds_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"hic_request_duration_seconds_sum{{{label_text}}} {stats['latency_sum']}")
+            lines.append(f"hic_request_duration_seconds_count{{{label_text}}} {stats['requests']}")
+
+        metric("download_bytes_total", "counter", "Bytes downloaded per host", [({"host": host}, entry["bytes"]) for host, entry in hosts])
+        metric("download_seconds_total", "counter", "Time spent downloading per host", [({"host": host}, entry["seconds"]) for host, entry in hosts])
+        metric("download_files_total", "counter", "Download attempts finished per host", [({"host": host}, entry["files"]) for host, entry in hosts])
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        write_atomic(path, self.prometheus_text())
+
+    def _start_exporter(self):
+        if not TEXTFILE_PATH or self._exporter is not None:
+            return
+        with self._lock:
+            if self._exporter is not None:
+                return
+            self._exporter = threading.Thread(target=self._export_loop, daemon=True)
+        self._exporter.start()
+
+    def _export_loop(self):
+        while True:
+            self.write_textfile(TEXTFILE_PATH)
+            time.sleep(TEXTFILE_INTERVAL)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_atomic(path, text):
+    # The textfile collector may read at any moment, so never expose a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
+
+
+def write_on_exit():
+    if JSON_PATH:
+        METRICS.write_json(JSON_PATH)
+    if TEXTFILE_PATH:
+        METRICS.write_textfile(TEXTFILE_PATH)
+
+
+atexit.register(write_on_exit)
@@ -0,0 +1,460 @@
+import io
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from hic_common.client import create_session
+
+DEFAULT_PROBE_CACHE_PATH = os.getenv(
+    "HIC_PROBE_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".cache", "header_probes.sqlite")
+)
+BLOCK_SIZE = 64 * 1024  # Bytes per Range request; neighbouring header fields share a block
+MAX_PROBE_BYTES = 16 * 1024 ** 2  # Give up on a file rather than read more than this
+PROBE_WORKERS = 8
+
+PROBE_EXTENSIONS = {".hic": "hic", ".mcool": "mcool", ".cool": "mcool", ".bw": "bigwig", ".bigwig": "bigwig"}
+
+# Parsed field -> column added to scraper output tables
+PROBE_COLUMNS = {
+    "genome_assembly": "Genome Assembly",
+    "chromosomes": "Chromosomes",
+    "resolutions": "Resolutions",
+    "normalizations": "Normalizations",
+    "version": "Format Version",
+}
+
+HIC_MAGIC = b"HIC\0"
+HDF5_MAGIC = b"\x89HDF\r\n\x1a\n"
+BIGWIG_MAGIC = 0x888FFC26
+BPT_MAGIC = 0x78CA8C91  # Chromosome B+ tree inside bigWig files
+
+# chr1 length -> assembly, for formats that only carry chromosome sizes
+ASSEMBLY_CHR1_LENGTHS = {
+    248956422: "hg38",
+    249250621: "hg19",
+    195154279: "mm39",
+    195471971: "mm10",
+    197195432: "mm9",
+}
+
+
+class ProbeError(Exception):
+    pass
+
+
+def probe_format(url, file_format=None):
+    """The header format to probe for, from the catalog format or the URL extension, or None."""
+    if file_format and file_format.lower() in ("hic", "mcool", "cool", "bigwig", "bw"):
+        return PROBE_EXTENSIONS["." + file_format.lower()]
+    path = urlparse(url or "").path.lower()
+    return PROBE_EXTENSIONS.get(os.path.splitext(path)[1])
+
+
+class RangeReader(io.RawIOBase):
+    """Read-only, seekable view of a remote file that fetches blocks with Range requests.
+
+    Blocks are cached, so walking a header field by field costs one
+    request per BLOCK_SIZE touched. The redirect of the first request is
+    followed once and reused, and a server that ignores ranges is refused
+    instead of letting it stream the whole file.
+    """
+
+    def __init__(self, url, session, size=None, block_size=BLOCK_SIZE, max_bytes=MAX_PROBE_BYTES):
+        super().__init__()
+        self.url = url
+        self.session = session
+        self.size = size
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.requests = 0
+        self.fetched = 0
+        self._blocks = {}
+        self._position = 0
+
+    def _fetch(self, first, last):
+        start = first * self.block_size
+        end = (last + 1) * self.block_size - 1
+        if self.size is not None:
+            end = min(end, self.size - 1)
+        if self.fetched + end - start + 1 > self.max_bytes:
+            raise ProbeError(f"Reading {self.url} would take more than {self.max_bytes} bytes")
+        with self.session.get(self.url, headers={"Range": f"bytes={start}-{end}"}, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise ProbeError(f"{self.url} does not support range requests")
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit():
+                self.size = int(total)
+            self.url = response.url
+            data = response.content
+        self.requests += 1
+        self.fetched += len(data)
+        for index in range(first, last + 1):
+            offset = (index - first) * self.block_size
+            self._blocks[index] = data[offset:offset + self.block_size]
+
+    def read_at(self, offset, length):
+        if length <= 0:
+            return b""
+        first = offset // self.block_size
+        last = (offset + length - 1) // self.block_size
+        if self.size is not None:
+            last = min(last, max(0, (self.size - 1) // self.block_size))
+        missing = [index for index in range(first, last + 1) if index not in self._blocks]
+        while missing:
+            run_end = missing[0]
+            while run_end + 1 in missing:
+                run_end += 1
+            self._fetch(missing[0], run_end)
+            missing = [index for index in missing if index > run_end]
+        data = b"".join(self._blocks.get(index, b"") for index in range(first, last + 1))
+        skip = offset - first * self.block_size
+        return data[skip:skip + length]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            if self.size is None:
+                self.read_at(0, 1)  # The first response carries the total size
+            offset += self.size
+        elif whence == io.SEEK_CUR:
+            offset += self._position
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        data = self.read_at(self._position, len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class Cursor:
+    """Sequential struct reads from a RangeReader, little-endian unless told otherwise."""
+
+    def __init__(self, reader, offset=0, byte_order="<"):
+        self.reader = reader
+        self.offset = offset
+        self.byte_order = byte_order
+
+    def unpack(self, fmt):
+        fmt = self.byte_order + fmt
+        size = struct.calcsize(fmt)
+        data = self.reader.read_at(self.offset, size)
+        if len(data) < size:
+            raise ProbeError("Header ends unexpectedly")
+        self.offset += size
+        values = struct.unpack(fmt, data)
+        return values[0] if len(values) == 1 else values
+
+    def string(self):
+        """A null-terminated string."""
+        chunks = []
+        while True:
+            data = self.reader.read_at(self.offset, 256)
+            if not data:
+                raise ProbeError("Unterminated string in header")
+            end = data.find(b"\0")
+            if end >= 0:
+                chunks.append(data[:end])
+                self.offset += end + 1
+                return b"".join(chunks).decode("utf-8", "replace")
+            chunks.append(data)
+            self.offset += len(data)
+
+    def skip(self, size):
+        self.offset += size
+
+
+def guess_assembly(chromosomes):
+    """Name the assembly from chromosome sizes ({name: length}), or None."""
+    for name in ("chr1", "1"):
+        if name in chromosomes:
+            return ASSEMBLY_CHR1_LENGTHS.get(chromosomes[name])
+    return None
+
+
+def parse_hic(reader):
+    """Genome, chromosomes, resolutions and normalizations from a Juicer .hic header and footer."""
+    cursor = Cursor(reader, len(HIC_MAGIC))
+    version = cursor.unpack("i")
+    footer_position = cursor.unpack("q")
+    genome = cursor.string()
+    norm_index_position = None
+    if version >= 9:
+        norm_index_position, _ = cursor.unpack("qq")
+    for _ in range(cursor.unpack("i")):  # Attributes
+        cursor.string()
+        cursor.string()
+    chromosomes = {}
+    for _ in range(cursor.unpack("i")):
+        name = cursor.string()
+        chromosomes[name] = cursor.unpack("q" if version >= 9 else "i")
+    chromosomes.pop("All", None)
+    resolutions = [cursor.unpack("i") for _ in range(cursor.unpack("i"))]
+
+    if norm_index_position:
+        entries = read_hic_norm_index(Cursor(reader, norm_index_position), version)
+        normalizations = list(dict.fromkeys(norm_type for norm_type, _, _ in entries))
+    else:
+        cursor = Cursor(reader, footer_position)
+        read_hic_master_index(cursor, version)
+        normalizations = read_hic_expected_values(cursor, version)
+
+    if "/" in genome or genome.endswith(".chrom.sizes"):
+        genome = os.path.basename(genome).split(".")[0]
+    return {
+        "format": "hic",
+        "version": version,
+        "genome_assembly": genome or guess_assembly(chromosomes),
+        "chromosomes": list(chromosomes),
+        "resolutions": sorted(resolutions),
+        "normalizations": normalizations,
+    }
+
+
+def read_hic_master_index(cursor, version):
+    """The footer's byte count and its (key, position, size) block index entries."""
+    footer_bytes = cursor.unpack("q" if version >= 9 else "i")
+    entries = []
+    for _ in range(cursor.unpack("i")):
+        key = cursor.string()
+        entries.append((key, *cursor.unpack("qi")))
+    return footer_bytes, entries
+
+
+def read_hic_norm_index(cursor, version):
+    """Normalization vector index entries as (type, position, byte count)."""
+    entries = []
+    for _ in range(cursor.unpack("i")):
+        norm_type = cursor.string()
+        cursor.skip(4)  # Chromosome index
+        cursor.string()  # Unit
+        cursor.skip(4)  # Bin size
+        entries.append((norm_type, *cursor.unpack("qq" if version >= 9 else "qi")))
+    return entries
+
+
+def read_hic_expected_values(cursor, version):
+    """Walk past the expected-value vectors after the master index; return the normalization types.
+
+    Leaves `cursor` at the v8 normalization vector index. Files that were
+    never normalized end right after the raw expected values.
+    """
+    value_size = 4 if version >= 9 else 8
+
+    def skip_expected(cursor):
+        cursor.string()  # Unit
+        cursor.skip(4)  # Bin size
+        cursor.skip(cursor.unpack("q" if version >= 9 else "i") * value_size)
+        cursor.skip(cursor.unpack("i") * (4 + value_size))  # Per-chromosome scale factors
+
+    for _ in range(cursor.unpack("i")):
+        skip_expected(cursor)
+    if cursor.reader.size is not None and cursor.offset >= cursor.reader.size:
+        return []
+    types = []
+    for _ in range(cursor.unpack("i")):
+        norm_type = cursor.string()
+        skip_expected(cursor)
+        if norm_type not in types:
+            types.append(norm_type)
+    return types
+
+
+def parse_mcool(reader):
+    """Resolutions, assembly, chromosomes and balancing weights from a .mcool / .cool file."""
+    try:
+        import h5py
+    except ImportError:
+        raise ProbeError("h5py is required to read .mcool headers (pip install h5py)")
+
+    def text(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    with h5py.File(reader, "r") as f:
+        if "resolutions" in f:
+            resolutions = sorted(int(resolution) for resolution in f["resolutions"])
+            group = f["resolutions"][str(resolutions[-1])]  # The coarsest has the smallest tables
+        else:
+            group = f
+            resolutions = [int(group.attrs["bin-size"])] if "bin-size" in group.attrs else []
+        names = [text(name) for name in group["chroms/name"][:]]
+        lengths = [int(length) for length in group["chroms/length"][:]]
+        chromosomes = dict(zip(names, lengths))
+        return {
+            "format": "mcool",
+            "version": int(group.attrs["format-version"]) if "format-version" in group.attrs else None,
+            "genome_assembly": text(group.attrs.get("genome-assembly")) or guess_assembly(chromosomes),
+            "chromosomes": names,
+            "resolutions": resolutions,
+            "normalizations": sorted(set(group["bins"]) - {"chrom", "start", "end"}),
+        }
+
+
+def parse_bigwig(reader):
+    """Chromosomes and zoom levels from a bigWig header and chromosome B+ tree."""
+    magic = struct.unpack("<I", reader.read_at(0, 4))[0]
+    byte_order = "<" if magic == BIGWIG_MAGIC else ">"
+    cursor = Cursor(reader, 4, byte_order)
+    version, zoom_levels, chrom_tree_offset = cursor.unpack("HHQ")
+    cursor.skip(8 + 8 + 2 + 2 + 8 + 8 + 4 + 8)  # Data and index offsets, fields, summary, buffer, extension
+    resolutions = []
+    for _ in range(zoom_levels):
+        resolutions.append(cursor.unpack("I"))
+        cursor.skip(4 + 8 + 8)
+
+    tree = Cursor(reader, chrom_tree_offset, byte_order)
+    tree_magic, _, key_size, _, _, _ = tree.unpack("IIIIQQ")
+    if tree_magic != BPT_MAGIC:
+        raise ProbeError("Chromosome tree not found in bigWig header")
+    chromosomes = {}
+
+    def walk(offset):
+        node = Cursor(reader, offset, byte_order)
+        is_leaf, _, count = node.unpack("BBH")
+        children = []
+        for _ in range(count):
+            key = reader.read_at(node.offset, key_size).rstrip(b"\0").decode()
+            node.skip(key_size)
+            if is_leaf:
+                _, length = node.unpack("II")
+                chromosomes[key] = length
+            else:
+                children.append(node.unpack("Q"))
+        for child in children:
+            walk(child)
+
+    walk(tree.offset)
+    return {
+        "format": "bigwig",
+        "version": version,
+        "genome_assembly": guess_assembly(chromosomes),
+        "chromosomes": list(chromosomes),
+        "resolutions": sorted(resolutions),
+        "normalizations": [],
+    }
+
+
+def probe_file(url, size=None, session=None):
+    """Parse the header of a remote .hic, .mcool or bigWig file from a few Range requests.
+
+    The format is recognised from the file's magic bytes. Returns a dict
+    with format, version, genome_assembly, chromosomes, resolutions and
+    normalizations; raises ProbeError for anything else.
+    """
+    reader = RangeReader(url, session or create_session(), size=size)
+    magic = reader.read_at(0, 8)
+    if magic.startswith(HIC_MAGIC):
+        fields = parse_hic(reader)
+    elif magic.startswith(HDF5_MAGIC):
+        fields = parse_mcool(reader)
+    elif magic[:4] in (struct.pack("<I", BIGWIG_MAGIC), struct.pack(">I", BIGWIG_MAGIC)):
+        fields = parse_bigwig(reader)
+    else:
+        raise ProbeError(f"{url} is not a .hic, .mcool or bigWig file")
+    fields["probe_requests"] = reader.requests
+    fields["probe_bytes"] = reader.fetched
+    return fields
+
+
+class ProbeCache:
+    """Parsed headers keyed by URL and size, so a file is only probed again when it changes."""
+
+    def __init__(self, path=DEFAULT_PROBE_CACHE_PATH):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS probes (url TEXT NOT NULL, size INTEGER NOT NULL, fields TEXT NOT NULL, "
+            "probed_at REAL NOT NULL, PRIMARY KEY (url, size))"
+        )
+        self._conn.commit()
+
+    def get(self, url, size):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fields FROM probes WHERE url = ? AND size = ?", (url, -1 if size is None else size)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, url, size, fields):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?)",
+                (url, -1 if size is None else size, json.dumps(fields), time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def probe_all(items, session=None, workers=PROBE_WORKERS, cache=None, refresh=False):
+    """Probe many (url, size) pairs concurrently; return {url: fields or None}.
+
+    Results come from `cache` when it already has the URL at that size;
+    new results are stored in it. Failures are printed and give None.
+    """
+    session = session or create_session(pool_size=workers)
+    results = {}
+    pending = []
+    for url, size in dict.fromkeys(items):
+        cached = cache.get(url, size) if cache and not refresh else None
+        if cached is not None:
+            results[url] = cached
+        else:
+            pending.append((url, size))
+    if results:
+        print(f"{len(results)} headers from the cache, probing {len(pending)}")
+
+    def probe(url, size):
+        fields = probe_file(url, size=size, session=session)
+        if cache:
+            cache.put(url, size, fields)
+        return fields
+
+    requests = fetched = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(probe, url, size): url for url, size in pending}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                results[url] = future.result()
+                requests += results[url]["probe_requests"]
+                fetched += results[url]["probe_bytes"]
+            except Exception as e:
+                print(f"Could not probe {url}: {e}")
+                results[url] = None
+    if pending:
+        print(f"Probed {len(pending)} files with {requests} range requests ({fetched / 1024 ** 2:.1f} MiB)")
+    return results
+
+
+def as_cell(value):
+    if isinstance(value, list):
+        return ", ".join(str(item) for item in value)
+    return value
+
+
+def header_columns(fields):
+    """Turn probe fields into output-table columns (lists joined with commas)."""
+    fields = fields or {}
+    return {column: as_cell(fields.get(key)) for key, column in PROBE_COLUMNS.items()}
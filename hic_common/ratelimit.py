@@ -0,0 +1,276 @@
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from hic_common.metrics import METRICS
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every worker talking to one portal."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available, then consume them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """Token bucket whose rate follows the server: AIMD between min_rate and max_rate.
+
+    Every healthy response nudges the rate up so that it grows by about
+    `increase` requests/s per second of traffic; a 429/503 halves it (by
+    `decrease`) and a Retry-After pauses the host entirely until it passes.
+    """
+
+    def __init__(self, rate, min_rate=None, max_rate=None, increase=None, decrease=0.5):
+        super().__init__(rate)
+        self.min_rate = float(min_rate if min_rate is not None else self.rate / 10)
+        self.max_rate = float(max_rate if max_rate is not None else self.rate * 4)
+        self.increase = float(increase if increase is not None else max(0.1, self.rate / 10))
+        self.decrease = decrease
+        self.requests = 0
+        self.throttles = 0
+        self._blocked_until = 0.0
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                wait = self._blocked_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        super().acquire(tokens)
+
+    def record_success(self):
+        with self._lock:
+            self.requests += 1
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def record_throttle(self, retry_after=None):
+        with self._lock:
+            self.requests += 1
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = 0.0
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class InFlightLimit:
+    """Process-wide cap on requests in flight, across every host.
+
+    While the process is above `max_rss_bytes`, requests are additionally
+    let through one at a time instead of being stopped outright, so a
+    crawl keeps moving even if the allocator never hands memory back.
+    For streamed responses the slot is held only until the headers arrive.
+    """
+
+    def __init__(self, max_requests, max_rss_bytes=None):
+        self.max_requests = max_requests
+        self.max_rss_bytes = max_rss_bytes
+        self._slots = threading.BoundedSemaphore(max_requests)
+        self._lean = threading.Lock()
+
+    def over_memory(self):
+        if not self.max_rss_bytes:
+            return False
+        rss = current_rss()
+        return rss is not None and rss > self.max_rss_bytes
+
+    def acquire(self):
+        """Take a slot; return the extra lock to release as well when memory is tight."""
+        lean = self._lean if self.over_memory() else None
+        if lean:
+            lean.acquire()
+        self._slots.acquire()
+        return lean
+
+    def release(self, lean=None):
+        self._slots.release()
+        if lean:
+            lean.release()
+
+
+class HostLimiters:
+    """One AdaptiveRateLimiter per host, created on first use from configured limits.
+
+    `in_flight`, when set, is an InFlightLimit shared by all hosts.
+    """
+
+    def __init__(self, default_rate=5.0, default_max_rate=50.0):
+        self.default = {"rate": default_rate, "max_rate": default_max_rate}
+        self.in_flight = None
+        self._limits = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def configure(self, host, rate, min_rate=None, max_rate=None):
+        """Set the starting rate and bounds for a host; resets its limiter."""
+        with self._lock:
+            self._limits[host] = {"rate": rate, "min_rate": min_rate, "max_rate": max_rate}
+            self._limiters.pop(host, None)
+
+    def get(self, host):
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveRateLimiter(**self._limits.get(host, self.default))
+            return self._limiters[host]
+
+    def snapshot(self):
+        """Return {host: limiter} for every host contacted so far."""
+        with self._lock:
+            return dict(self._limiters)
+
+
+HOST_LIMITERS = HostLimiters()
+
+
+def configure_host(host, rate, min_rate=None, max_rate=None):
+    """Set the process-wide limits for a host, shared by every session that talks to it."""
+    HOST_LIMITERS.configure(host, rate, min_rate=min_rate, max_rate=max_rate)
+
+
+def limit_in_flight(max_requests, max_rss_bytes=None):
+    """Cap concurrent requests (and soft-cap memory) for every session using HOST_LIMITERS."""
+    HOST_LIMITERS.in_flight = InFlightLimit(max_requests, max_rss_bytes=max_rss_bytes)
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """HTTPAdapter that paces requests through per-host adaptive limiters.
+
+    429/503 responses are retried here rather than by urllib3 so each one
+    feeds back into the host's rate, and Retry-After is honoured. Without
+    `limiters` it behaves like a plain HTTPAdapter.
+    """
+
+    def __init__(self, limiters=None, max_attempts=5, **kwargs):
+        self.limiters = limiters
+        self.max_attempts = max_attempts
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.limiters is None:
+            return self.send_timed(request, **kwargs)
+
+        limiter = self.limiters.get(urlparse(request.url).hostname)
+        in_flight = self.limiters.in_flight
+        for attempt in range(self.max_attempts):
+            waited = time.monotonic()
+            limiter.acquire()
+            METRICS.record_wait(request.url, time.monotonic() - waited)
+            lean = in_flight.acquire() if in_flight else None
+            try:
+                response = self.send_timed(request, **kwargs)
+            finally:
+                if in_flight:
+                    in_flight.release(lean)
+            if response.status_code not in THROTTLE_STATUSES:
+                limiter.record_success()
+                return response
+            limiter.record_throttle(parse_retry_after(response.headers.get("Retry-After")))
+            if attempt + 1 < self.max_attempts:
+                response.close()
+        return response
+
+    def send_timed(self, request, **kwargs):
+        """Send once through HTTPAdapter and record latency, size and transport retries."""
+        started = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            METRICS.record_request(request.url, None, time.monotonic() - started)
+            raise
+        seconds = time.monotonic() - started
+        if kwargs.get("stream"):
+            size = int(response.headers.get("Content-Length") or 0)
+        else:
+            size = len(response.content)
+        retries = getattr(getattr(response.raw, "retries", None), "history", None) or ()
+        METRICS.record_request(
+            request.url, response.status_code, seconds, size=size,
+            retries=len(retries), throttled=response.status_code in THROTTLE_STATUSES
+        )
+        return response
+
+
+def without_throttle_retries(retries):
+    """Drop 429/503 from a urllib3 Retry so the adapter sees them itself.
+
+    urllib3 also retries any 429/503 carrying Retry-After on its own, so
+    that is switched off too.
+    """
+    if not isinstance(retries, Retry):
+        return retries
+    return retries.new(
+        status_forcelist=set(retries.status_forcelist or ()) - set(THROTTLE_STATUSES),
+        respect_retry_after_header=False
+    )
+
+
+def install_rate_limit(session, limiters=None):
+    """Route the session's requests through per-host adaptive limiters.
+
+    Keeps the session's retry and pool settings, and composes with
+    hic_common.http_cache.install_cache in either order.
+    """
+    limiters = limiters or HOST_LIMITERS
+    for prefix in ("https://", "http://"):
+        current = session.get_adapter(prefix)
+        if isinstance(current, ThrottledAdapter):
+            current.limiters = limiters
+            current.max_retries = without_throttle_retries(current.max_retries)
+            continue
+        adapter = ThrottledAdapter(
+            limiters=limiters,
+            max_retries=without_throttle_retries(current.max_retries),
+            pool_connections=current._pool_connections,
+            pool_maxsize=current._pool_maxsize,
+        )
+        session.mount(prefix, adapter)
+    return session
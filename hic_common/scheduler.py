@@ -0,0 +1,167 @@
+import os
+import shutil
+import threading
+from urllib.parse import urlparse
+
+from hic_common.download import PART_SUFFIX, SEGMENTS_SUFFIX, is_complete, limit_bandwidth
+
+MIN_FREE_BYTES = 2 * 1024 ** 3  # Always leave this much free on the download filesystem
+DISK_POLL_SECONDS = 5  # How often a worker blocked on disk space looks again
+
+
+class InsufficientDiskSpace(IOError):
+    pass
+
+
+def remaining_bytes(job):
+    """Bytes a job still has to write: its size minus any .part left by an earlier attempt.
+
+    A file already complete at its final name needs nothing.
+    """
+    size = job.get("size")
+    if size is None:
+        return 0
+    path = job.get("path")
+    if path and is_complete(path, size):
+        return 0
+    # Segmented .part files are preallocated, so their size says nothing about progress
+    if path and os.path.exists(path + PART_SUFFIX) and not os.path.exists(path + PART_SUFFIX + SEGMENTS_SUFFIX):
+        return max(0, size - os.path.getsize(path + PART_SUFFIX))
+    return size
+
+
+def order_jobs(jobs, order="largest"):
+    """Sort jobs by known size; files of unknown size go last in their original order."""
+    if order == "manifest":
+        return list(jobs)
+    known = [job for job in jobs if job.get("size") is not None]
+    unknown = [job for job in jobs if job.get("size") is None]
+    return sorted(known, key=lambda job: job["size"], reverse=order == "largest") + unknown
+
+
+class DownloadScheduler:
+    """Runs download jobs on a worker pool, picking the next one by size, host and disk space.
+
+    A job is a dict with `run` (called with no arguments, its return value
+    is the result) and optionally `size`, `path`, `url` / `host` and
+    `connections` (how many connections it opens, e.g. its segment count).
+    Jobs start largest-first by default so one huge file does not end up
+    alone at the tail of a run. A job only starts when its host has fewer
+    than `host_connections` connections open and when the free space on
+    `directory`, minus what running jobs have reserved and `min_free_bytes`,
+    covers what it still has to write. Jobs that cannot fit even with
+    nothing else running fail with InsufficientDiskSpace instead of
+    filling the disk. `max_bytes_per_second` caps all downloads together.
+    """
+
+    def __init__(self, workers=4, host_connections=None, max_bytes_per_second=None,
+                 directory=".", min_free_bytes=MIN_FREE_BYTES, order="largest"):
+        self.workers = workers
+        self.host_connections = host_connections or {}
+        self.max_bytes_per_second = max_bytes_per_second
+        self.directory = directory
+        self.min_free_bytes = min_free_bytes
+        self.order = order
+        self._condition = threading.Condition()
+        self._pending = []
+        self._connections = {}
+        self._reserved = 0
+        self._running = 0
+
+    def host_limit(self, host):
+        if isinstance(self.host_connections, int):
+            return self.host_connections
+        return self.host_connections.get(host)
+
+    def free_bytes(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return shutil.disk_usage(self.directory).free
+
+    def run(self, jobs, on_done=None):
+        """Run every job; return [(job, result, error)] in completion order.
+
+        `on_done(job, result, error)` is called from the worker thread as
+        each job finishes.
+        """
+        if self.max_bytes_per_second:
+            limit_bandwidth(self.max_bytes_per_second)
+        self._pending = order_jobs(jobs, self.order)
+        for job in self._pending:
+            job.setdefault("host", urlparse(job.get("url", "")).hostname)
+            job.setdefault("connections", 1)
+        results = []
+
+        def finished(job, result, error):
+            with self._condition:
+                results.append((job, result, error))
+            if on_done:
+                on_done(job, result, error)
+
+        def work():
+            while True:
+                job = self._next(finished)
+                if job is None:
+                    return
+                result = error = None
+                try:
+                    result = job["run"]()
+                except Exception as e:
+                    error = e
+                finally:
+                    self._release(job)
+                finished(job, result, error)
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(min(self.workers, len(self._pending)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _next(self, finished):
+        """Block until some pending job may start, claim it and return it; None when all are taken."""
+        with self._condition:
+            while self._pending:
+                # Running jobs keep their whole reservation while their bytes also
+                # leave the free space, which errs on the side of waiting
+                free = self.free_bytes() - self.min_free_bytes - self._reserved
+                blocked_on_disk = None
+                for index, job in enumerate(self._pending):
+                    host_open = self._connections.get(job["host"], 0)
+                    limit = self.host_limit(job["host"])
+                    if limit and host_open and host_open + job["connections"] > limit:
+                        continue
+                    need = remaining_bytes(job)
+                    if need > free:
+                        blocked_on_disk = blocked_on_disk or job
+                        continue
+                    del self._pending[index]
+                    job["reserved"] = need
+                    self._reserved += need
+                    self._connections[job["host"]] = host_open + job["connections"]
+                    self._running += 1
+                    return job
+
+                if blocked_on_disk and not self._running:
+                    # Nothing running will free a reservation, so this one can never fit
+                    self._pending.remove(blocked_on_disk)
+                    error = InsufficientDiskSpace(
+                        f"{blocked_on_disk.get('path') or blocked_on_disk.get('url')} needs "
+                        f"{remaining_bytes(blocked_on_disk)} bytes but only {max(0, free)} are free above the "
+                        f"{self.min_free_bytes} byte reserve on {self.directory}"
+                    )
+                    self._condition.release()
+                    try:
+                        finished(blocked_on_disk, None, error)
+                    finally:
+                        self._condition.acquire()
+                    continue
+                self._condition.wait(DISK_POLL_SECONDS if blocked_on_disk else None)
+            return None
+
+    def _release(self, job):
+        with self._condition:
+            self._reserved -= job.pop("reserved", 0)
+            self._connections[job["host"]] -= job["connections"]
+            self._running -= 1
+            self._condition.notify_all()
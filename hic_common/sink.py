@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+
+
+class RecordSink:
+    """Append-only JSONL file of normalized rows, one line per source record.
+
+    Each line holds a record key, the rows produced for it and optional
+    metadata, so a record is either fully on disk or not at all. Opening
+    the file again after a crash drops any torn last line and exposes the
+    keys already written through `done_keys`, letting the caller skip
+    them. A run that reaches `close(complete=True)` is marked finished and
+    the next run starts from an empty file; scrapers only pass it when
+    nothing failed, so a crawl with gaps is resumed and the gaps retried.
+    """
+
+    def __init__(self, path, fsync_every=50):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.done_keys = set()
+        self._meta = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        if self._load():
+            self.done_keys.clear()
+            self._meta.clear()
+            open(path, "w").close()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        """Read what a previous run left behind; return True if that run finished."""
+        if not os.path.exists(self.path):
+            return False
+
+        valid_bytes = 0
+        complete = False
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # Torn write from an interrupted run
+                if not line.endswith(b"\n"):
+                    break
+                valid_bytes += len(line)
+                if entry.get("complete"):
+                    complete = True
+                    continue
+                self.done_keys.add(entry["key"])
+                self._meta[entry["key"]] = entry.get("meta") or {}
+
+        if not complete:
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_bytes)
+        return complete
+
+    def write(self, key, rows, meta=None):
+        """Append all rows of one record and checkpoint every `fsync_every` records."""
+        line = json.dumps({"key": key, "rows": rows, "meta": meta or {}}, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self.done_keys.add(key)
+            self._meta[key] = meta or {}
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                self._sync()
+
+    def _sync(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def checkpoint(self):
+        with self._lock:
+            self._sync()
+
+    def reset(self):
+        """Discard everything written so far, e.g. when a resume no longer lines up."""
+        with self._lock:
+            self._file.seek(0)
+            self._file.truncate()
+            self.done_keys.clear()
+            self._meta.clear()
+            self._sync()
+
+    def meta(self):
+        """Return {key: meta} for every record on disk."""
+        with self._lock:
+            return dict(self._meta)
+
+    def iter_rows(self):
+        """Yield every row on disk in write order."""
+        self.checkpoint()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("complete"):
+                    continue
+                yield from entry["rows"]
+
+    def close(self, complete=False):
+        with self._lock:
+            if complete:
+                self._file.write(json.dumps({"complete": True}) + "\n")
+            self._sync()
+            self._file.close()
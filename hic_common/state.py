@@ -0,0 +1,61 @@
+import json
+import os
+
+import pandas as pd
+
+from hic_common.columnar import read_table
+
+
+def load_state(path):
+    """Load a source's crawl state, or an empty one on the first run.
+
+    The state holds `seen` (accession -> last known modification date),
+    `watermark` (the newest such date, used to query for changes) and
+    `output` (where the previous run wrote its rows).
+    """
+    if not os.path.exists(path):
+        return {"watermark": None, "seen": {}, "output": None}
+    with open(path) as f:
+        state = json.load(f)
+    state.setdefault("watermark", None)
+    state.setdefault("seen", {})
+    state.setdefault("output", None)
+    return state
+
+
+def save_state(path, state):
+    """Write the state atomically so an interrupted run keeps the old watermark."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def update_state(state, changes, output, watermark=None):
+    """Record changed accessions and move the watermark forward.
+
+    `changes` maps accession -> modification date (ISO strings compare in
+    date order). Without an explicit `watermark` the newest date seen wins.
+    """
+    state["seen"].update(changes)
+    dates = [date for date in changes.values() if date]
+    if watermark is None and dates:
+        watermark = max(dates)
+    if watermark and (state["watermark"] is None or watermark > state["watermark"]):
+        state["watermark"] = watermark
+    state["output"] = output
+    return state
+
+
+def merge_with_previous(previous_output, rows, key_column, changed_keys):
+    """Replace rows for changed records in the previous output with the fresh rows."""
+    new_df = pd.DataFrame(rows)
+    if not previous_output or not os.path.exists(previous_output):
+        return new_df
+
+    previous_df = read_table(previous_output)
+    if key_column in previous_df.columns:
+        # Excel round-trips may turn ids into numbers, so compare as strings
+        changed = {str(key) for key in changed_keys}
+        previous_df = previous_df[~previous_df[key_column].astype(str).isin(changed)]
+    return pd.concat([previous_df, new_df], ignore_index=True)
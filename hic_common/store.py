@@ -0,0 +1,173 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from hic_common.download import CHUNK_SIZE, is_complete
+
+DEFAULT_STORE_DIR = os.getenv(
+    "HIC_STORE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".store")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    md5 TEXT PRIMARY KEY,
+    size INTEGER,
+    stored_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS views (
+    path TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    accession TEXT,
+    url TEXT,
+    md5 TEXT NOT NULL,
+    linked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS views_md5 ON views (md5);
+CREATE INDEX IF NOT EXISTS views_accession ON views (source, accession);
+"""
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def group_duplicates(tasks):
+    """Group download tasks that point at the same content.
+
+    Tasks are dicts with at least `url` and `md5`; the same md5 (or, without
+    one, the same URL) means the same file. Returns a list of task groups
+    in first-seen order, so each group needs one transfer.
+    """
+    groups = {}
+    for task in tasks:
+        key = ("md5", task["md5"].lower()) if task.get("md5") else ("url", task["url"])
+        groups.setdefault(key, []).append(task)
+    return list(groups.values())
+
+
+class DownloadStore:
+    """Content-addressed file store shared by every downloader.
+
+    Each file is kept once under objects/<md5[:2]>/<md5>, and every place a
+    source wants it (its "view") is a hard link to that blob. manifest.sqlite
+    records which source accession and URL each view came from. Content
+    is only trusted by MD5, so files without a checksum should not go
+    through the store.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._blob_locks = {}
+        self._conn = sqlite3.connect(os.path.join(self.root, "manifest.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def blob_path(self, md5):
+        md5 = md5.lower()
+        return os.path.join(self.root, "objects", md5[:2], md5)
+
+    def has(self, md5, size=None):
+        return is_complete(self.blob_path(md5), size)
+
+    def _blob_lock(self, md5):
+        with self._lock:
+            return self._blob_locks.setdefault(md5, threading.Lock())
+
+    def fetch(self, url, md5, size, views, download):
+        """Make sure the blob for `md5` exists, then link it into every view.
+
+        `views` is a list of (source, accession, path). `download(url, path)`
+        is only called when neither the store nor any view already holds
+        the content, and must leave a verified file at `path` (e.g.
+        download_resumable with expected_md5). Returns the blob path.
+        """
+        md5 = md5.lower()
+        blob = self.blob_path(md5)
+        with self._blob_lock(md5):
+            if not self.has(md5, size) and not self._adopt(md5, size, [path for _, _, path in views]):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                download(url, blob)
+            self._record_blob(md5, size)
+            for source, accession, path in views:
+                self.link(md5, source, accession, url, path)
+        return blob
+
+    def _adopt(self, md5, size, paths):
+        """Move a view downloaded before the store existed into it, if its MD5 checks out.
+
+        The view is hard-linked into the store, or copied when the store is
+        on another filesystem; link() then turns the view into a link to it.
+        """
+        for path in paths:
+            if not is_complete(path, size) or os.path.islink(path):
+                continue
+            if file_md5(path) != md5:
+                continue
+            blob = self.blob_path(md5)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            if os.path.exists(blob):
+                os.remove(blob)  # Leftover of the wrong size
+            try:
+                os.link(path, blob)
+            except OSError:
+                # Across filesystems: copy under a temporary name so the blob appears whole or not at all
+                tmp_path = blob + ".tmp"
+                shutil.copy2(path, tmp_path)
+                os.replace(tmp_path, blob)
+            return True
+        return False
+
+    def link(self, md5, source, accession, url, path):
+        """Hard-link the blob at `path` (symlink across filesystems) and record the view."""
+        blob = self.blob_path(md5)
+        path = os.path.abspath(path)
+        if os.path.exists(path) and not os.path.samefile(path, blob):
+            with self._lock:
+                known = self._conn.execute("SELECT md5 FROM views WHERE path = ?", (path,)).fetchone()
+            if (known and known[0] == md5) or (
+                known is None and os.path.getsize(path) == os.path.getsize(blob) and file_md5(path) == md5
+            ):
+                os.remove(path)  # A separate copy of the same content, replace it with a link
+            else:
+                # A different file already owns this name; keep both
+                stem, extension = os.path.splitext(path)
+                path = f"{stem}.{md5[:8]}{extension}"
+                print(f"{os.path.basename(stem + extension)} already holds other content, linking as {os.path.basename(path)}")
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            try:
+                os.link(blob, path)
+            except OSError:
+                os.symlink(blob, path)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO views VALUES (?, ?, ?, ?, ?, ?)",
+                (path, source, accession, url, md5, time.time())
+            )
+            self._conn.commit()
+        return path
+
+    def _record_blob(self, md5, size):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)", (md5, size, time.time()))
+            self._conn.commit()
+
+    def views_of(self, md5):
+        """Return [(source, accession, path)] for everything linked to a blob."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT source, accession, path FROM views WHERE md5 = ? ORDER BY path", (md5.lower(),)
+            ).fetchall()
@@ -0,0 +1,255 @@
+import mmap
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from hic_common.download import CORRUPT_SUFFIX, PART_SUFFIX
+from hic_common.probe import (
+    BIGWIG_MAGIC, BPT_MAGIC, HDF5_MAGIC, HIC_MAGIC, Cursor, ProbeError,
+    read_hic_expected_values, read_hic_master_index, read_hic_norm_index
+)
+
+VERIFY_WORKERS = os.cpu_count() or 4
+RTREE_MAGIC = 0x2468ACE0  # Data index inside bigWig files
+HDF5_SIGNATURE_OFFSETS = (0, 512, 1024, 2048, 4096)  # After an optional user block
+# The empty block every BGZF file (.vcf.gz, .bam) ends with
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+GZIP_MAGIC = b"\x1f\x8b\x08"
+GZIP_READ_SIZE = 1024 ** 2  # Compressed bytes fed to zlib at a time when checking plain gzip
+
+# File name ending -> format the file must turn out to be
+EXPECTED_FORMATS = {
+    ".hic": "hic",
+    ".mcool": "hdf5",
+    ".cool": "hdf5",
+    ".bw": "bigwig",
+    ".bigwig": "bigwig",
+    ".vcf.gz": "gzip",  # bgzip or plain gzip
+    ".bam": "bgzf",
+}
+# Formats that also satisfy a broader expected one
+FORMAT_FAMILIES = {"bgzf": "gzip"}
+
+
+class MappedFile:
+    """A read-only memory map with the read_at interface of probe.RangeReader.
+
+    Only the pages a check touches are read from disk, so checking a
+    multi-gigabyte file costs a few page faults rather than a full read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+
+    def read_at(self, offset, length):
+        if offset < 0 or offset >= self.size:
+            return b""
+        return self._map[offset:offset + length]
+
+    def close(self):
+        if self.size:
+            self._map.close()
+        self._file.close()
+
+
+def within(mapped, offset, length=0):
+    return 0 <= offset and offset + length <= mapped.size
+
+
+def check_hic(mapped):
+    cursor = Cursor(mapped, len(HIC_MAGIC))
+    version = cursor.unpack("i")
+    if not 1 <= version <= 20:
+        return f"implausible .hic version {version}"
+    footer_position = cursor.unpack("q")
+    if not within(mapped, footer_position, 4):
+        return f"footer offset {footer_position} is past the end of the file ({mapped.size} bytes), likely truncated"
+    cursor.string()  # Genome
+    if version >= 9:
+        norm_position, norm_length = cursor.unpack("qq")
+        if norm_position and not within(mapped, norm_position, norm_length):
+            return f"normalization index {norm_position}+{norm_length} is past the end of the file"
+
+    footer = Cursor(mapped, footer_position)
+    footer_bytes, entries = read_hic_master_index(footer, version)
+    if not within(mapped, footer_position, footer_bytes):
+        return f"footer claims {footer_bytes} bytes but the file ends first"
+    for key, position, size in entries:
+        if not within(mapped, position, size):
+            return f"block index for {key} at {position}+{size} is past the end of the file"
+
+    if version >= 9:
+        norm_entries = read_hic_norm_index(Cursor(mapped, norm_position), version) if norm_position else []
+    else:
+        read_hic_expected_values(footer, version)
+        norm_entries = read_hic_norm_index(footer, version) if footer.offset < mapped.size else []
+    for norm_type, position, size in norm_entries:
+        if not within(mapped, position, size):
+            return f"{norm_type} normalization vector at {position}+{size} is past the end of the file"
+    return None
+
+
+def check_hdf5(mapped):
+    """Find the superblock and compare its end-of-file address with the file size."""
+    for base in HDF5_SIGNATURE_OFFSETS:
+        if mapped.read_at(base, len(HDF5_MAGIC)) == HDF5_MAGIC:
+            break
+    else:
+        return "HDF5 signature not found"
+    cursor = Cursor(mapped, base + len(HDF5_MAGIC))
+    version = cursor.unpack("B")
+    if version in (0, 1):
+        cursor.skip(4)  # Free-space, root group and shared header versions, reserved
+        offset_size = cursor.unpack("B")
+        cursor.skip(1 + 1 + 2 + 2 + 4 + (4 if version == 1 else 0))
+        address_format = {4: "I", 8: "Q"}.get(offset_size)
+        if address_format is None:
+            return f"unsupported HDF5 offset size {offset_size}"
+        _, _, end_address = cursor.unpack(address_format * 3)  # Base, free-space and end-of-file addresses
+    elif version in (2, 3):
+        offset_size = cursor.unpack("B")
+        cursor.skip(1 + 1)  # Length size, flags
+        address_format = {4: "I", 8: "Q"}.get(offset_size)
+        if address_format is None:
+            return f"unsupported HDF5 offset size {offset_size}"
+        _, _, end_address = cursor.unpack(address_format * 3)  # Base, extension and end-of-file addresses
+    else:
+        return f"unknown HDF5 superblock version {version}"
+    if base + end_address > mapped.size:
+        return f"HDF5 superblock expects {base + end_address} bytes but the file has {mapped.size}, likely truncated"
+    return None
+
+
+def check_bigwig(mapped):
+    magic = struct.unpack("<I", mapped.read_at(0, 4))[0]
+    byte_order = "<" if magic == BIGWIG_MAGIC else ">"
+    cursor = Cursor(mapped, 4, byte_order)
+    _, zoom_levels, chrom_tree, full_data, full_index = cursor.unpack("HHQQQ")
+    cursor.skip(2 + 2 + 8)  # Field counts, autoSql offset
+    total_summary = cursor.unpack("Q")
+    for name, offset in (("chromosome tree", chrom_tree), ("data", full_data), ("index", full_index),
+                         ("summary", total_summary)):
+        if offset and not within(mapped, offset, 4):
+            return f"{name} offset {offset} is past the end of the file ({mapped.size} bytes), likely truncated"
+    if Cursor(mapped, chrom_tree, byte_order).unpack("I") != BPT_MAGIC:
+        return "chromosome tree magic missing"
+    if Cursor(mapped, full_index, byte_order).unpack("I") != RTREE_MAGIC:
+        return "data index magic missing"
+    cursor.skip(4 + 8)  # Buffer size, extension offset
+    for level in range(zoom_levels):
+        _, _, data_offset, index_offset = cursor.unpack("IIQQ")
+        if not within(mapped, data_offset, 4) or not within(mapped, index_offset, 4):
+            return f"zoom level {level} points past the end of the file"
+        if Cursor(mapped, index_offset, byte_order).unpack("I") != RTREE_MAGIC:
+            return f"zoom level {level} index magic missing"
+    return None
+
+
+def check_bgzf(mapped):
+    if mapped.read_at(mapped.size - len(BGZF_EOF), len(BGZF_EOF)) != BGZF_EOF:
+        return "BGZF end-of-file block missing, likely truncated"
+    return None
+
+
+def check_gzip(mapped):
+    """Inflate every member so zlib checks its CRC32 and ISIZE trailer.
+
+    Plain gzip has no end marker to look at, so unlike the other checks
+    this one reads the whole file.
+    """
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    fed = False
+    offset = 0
+    while offset < mapped.size:
+        data = mapped.read_at(offset, GZIP_READ_SIZE)
+        offset += len(data)
+        while data:
+            try:
+                decompressor.decompress(data)
+            except zlib.error as e:
+                return f"gzip data corrupt: {e}"
+            fed = True
+            if not decompressor.eof:
+                break
+            # Concatenated members: the rest of the input starts the next one
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            fed = False
+    if fed and not decompressor.eof:
+        return "gzip stream ends before its trailer, likely truncated"
+    return None
+
+
+CHECKS = {"hic": check_hic, "hdf5": check_hdf5, "bigwig": check_bigwig, "bgzf": check_bgzf, "gzip": check_gzip}
+
+
+def sniff_format(mapped):
+    head = mapped.read_at(0, 8)
+    if head.startswith(HIC_MAGIC):
+        return "hic"
+    if any(mapped.read_at(offset, len(HDF5_MAGIC)) == HDF5_MAGIC for offset in HDF5_SIGNATURE_OFFSETS):
+        return "hdf5"
+    if head[:4] in (struct.pack("<I", BIGWIG_MAGIC), struct.pack(">I", BIGWIG_MAGIC)):
+        return "bigwig"
+    if head[:4] == BGZF_EOF[:4] and mapped.read_at(12, 2) == b"BC":
+        return "bgzf"
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    return None
+
+
+def check_file(path):
+    """Return (path, format, problem); problem is None for a sound file.
+
+    The format is taken from the magic bytes, so content-addressed store
+    blobs without an extension are checked too. A file whose extension
+    promises a format it does not have is a problem; other unknown files
+    come back with format None and are not judged.
+    """
+    expected = next((kind for ending, kind in EXPECTED_FORMATS.items() if path.lower().endswith(ending)), None)
+    found = None
+    try:
+        mapped = MappedFile(path)
+    except OSError as e:
+        return path, expected, f"unreadable: {e}"
+    try:
+        if mapped.size == 0:
+            return path, expected, "empty file"
+        found = sniff_format(mapped)
+        if expected and expected not in (found, FORMAT_FAMILIES.get(found)):
+            return path, expected, f"expected {expected} but the file starts with {mapped.read_at(0, 8)!r}"
+        if found is None:
+            return path, None, None
+        return path, found, CHECKS[found](mapped)
+    except ProbeError as e:
+        return path, found, f"header truncated or inconsistent: {e}"
+    except (struct.error, ValueError, OverflowError) as e:
+        return path, found, f"header unreadable: {e}"
+    finally:
+        mapped.close()
+
+
+def find_files(paths):
+    """Every file under `paths`, skipping in-progress and quarantined downloads."""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for directory, _, names in os.walk(path):
+            for name in names:
+                if name.endswith((PART_SUFFIX, CORRUPT_SUFFIX)) or PART_SUFFIX + "." in name or ".sqlite" in name:
+                    continue
+                yield os.path.join(directory, name)
+
+
+def verify_paths(paths, workers=VERIFY_WORKERS):
+    """Check every file under `paths` on a process pool; return [(path, format, problem)]."""
+    files = sorted(set(find_files(paths)))
+    if not files:
+        return []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(check_file, files, chunksize=max(1, len(files) // (workers * 8))))
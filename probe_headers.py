@@ -0,0 +1,120 @@
+"""Read genome assembly, chromosomes, resolutions and normalizations from file headers.
+
+Usage: python probe_headers.py [--source 4dn] [--format mcool] [--workers 8] [--refresh]
+       python probe_headers.py --table 4dn/4dn.xlsx
+
+Only the header and index bytes of each .hic, .mcool and bigWig file are
+read, with small Range requests, never the contact data. By default every
+matching file in the local catalog is probed and the fields are stored on
+its catalog row (query them with `query_catalog.py --assembly hg38`).
+With --table a scraper output file is enriched in place with extra
+columns instead. Parsed headers are cached by URL and size in
+.cache/header_probes.sqlite, so only new or changed files cost requests.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+from hic_common.catalog import DEFAULT_CATALOG_PATH, Catalog
+from hic_common.columnar import read_table, write_table
+from hic_common.download import parse_size
+from hic_common.probe import PROBE_WORKERS, ProbeCache, header_columns, probe_all, probe_format
+
+# Column names the scrapers use for the file URL, size and format, in order of preference
+URL_COLUMNS = ["File", "File URL", "download_url"]
+SIZE_COLUMNS = ["File Size", "size"]
+FORMAT_COLUMNS = ["File Format", "File Description"]
+
+
+def first_column(df, candidates):
+    return next((column for column in candidates if column in df.columns), None)
+
+
+def report(results, started):
+    probed = [fields for fields in results.values() if fields]
+    print(f"{len(probed)} of {len(results)} headers read in {time.perf_counter() - started:.1f}s")
+
+
+def enrich_catalog(args, cache):
+    catalog = Catalog(args.catalog)
+    try:
+        rows = [
+            row for row in catalog.query(sources=args.sources, file_formats=args.file_formats, limit=args.limit)
+            if row["file_url"] and probe_format(row["file_url"], row["file_format"])
+        ]
+        print(f"{len(rows)} catalog files to probe")
+        started = time.perf_counter()
+        results = probe_all([(row["file_url"], row["file_size"]) for row in rows],
+                            workers=args.workers, cache=cache, refresh=args.refresh)
+        catalog.set_headers([
+            (row["source"], row["accession"], results[row["file_url"]])
+            for row in rows if results.get(row["file_url"])
+        ])
+    finally:
+        catalog.close()
+    report(results, started)
+
+
+def enrich_table(args, cache):
+    df = read_table(args.table)
+    url_column = args.url_column or first_column(df, URL_COLUMNS)
+    if url_column is None:
+        print(f"{args.table} has none of the columns {', '.join(URL_COLUMNS)}; pass --url-column")
+        return
+    size_column = first_column(df, SIZE_COLUMNS)
+    format_column = first_column(df, FORMAT_COLUMNS)
+
+    items = []
+    for _, row in df.iterrows():
+        url = row[url_column]
+        file_format = row[format_column] if format_column else None
+        if isinstance(url, str) and probe_format(url, file_format if isinstance(file_format, str) else None):
+            items.append((url, parse_size(row[size_column]) if size_column else None))
+    if args.limit:
+        items = items[:args.limit]
+    print(f"{len(items)} files in {args.table} to probe")
+
+    started = time.perf_counter()
+    results = probe_all(items, workers=args.workers, cache=cache, refresh=args.refresh)
+    columns = [header_columns(results.get(url)) for url in df[url_column]]
+    for column in header_columns(None):
+        df[column] = [values[column] for values in columns]
+    write_table(df, args.table)
+    report(results, started)
+    print(f"Header columns added to {args.table}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Probe .hic, .mcool and bigWig headers with Range requests")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH, help="catalog database (default: %(default)s)")
+    parser.add_argument("--table", help="enrich this scraper output file (.xlsx, .parquet, .feather) instead of the catalog")
+    parser.add_argument("--url-column", help="column holding the file URL in --table (default: guessed)")
+    parser.add_argument("--source", action="append", dest="sources", help="only this catalog source; repeatable")
+    parser.add_argument("--format", action="append", dest="file_formats", help="only this catalog file format; repeatable")
+    parser.add_argument("--workers", type=int, default=PROBE_WORKERS)
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--refresh", action="store_true", help="probe again even when the cache has the file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cache = ProbeCache()
+    try:
+        if args.table:
+            enrich_table(args, cache)
+        elif not os.path.exists(args.catalog):
+            print(f"Catalog {args.catalog} does not exist. Run a scraper first, or pass --table.")
+            return 1
+        else:
+            enrich_catalog(args, cache)
+    finally:
+        cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Select files from the local catalog and write them out as a download manifest.
+
+Usage: python query_catalog.py [--source 4dn --source encode] [--format mcool]
+                               [--biosource GM12878] [--organism "Homo sapiens"] [--assembly hg38]
+                               [--min-size 1G] [--max-size 50G] [--limit N]
+                               [--output manifest.xlsx]
+
+The catalog is filled by every scraper as it runs (see hic_common/catalog.py),
+so queries never go back to the portals. Without --output the matches are
+printed; with it they are written as File / File Size / MD5 rows that
+4dn/downloader.py reads directly (.xlsx, .parquet or .feather).
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+from hic_common.catalog import DEFAULT_CATALOG_PATH, Catalog, to_manifest
+from hic_common.columnar import write_table
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def size_argument(text):
+    """Parse sizes such as 1500000, 500M or 1.5G."""
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ""
+    try:
+        return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Query the local Hi-C file catalog")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH, help="catalog database (default: %(default)s)")
+    parser.add_argument("--source", action="append", dest="sources", help="4dn, encode, geo, synapse or cavatica; repeatable")
+    parser.add_argument("--format", action="append", dest="file_formats", help="file format, e.g. mcool or hic; repeatable")
+    parser.add_argument("--biosource", help="substring of the biosource / biosample")
+    parser.add_argument("--organism", help="substring of the organism")
+    parser.add_argument("--accession", help="file or experiment accession")
+    parser.add_argument("--assembly", help="genome assembly read from the file header (see probe_headers.py)")
+    parser.add_argument("--min-size", type=size_argument)
+    parser.add_argument("--max-size", type=size_argument)
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--output", help="write a download manifest here instead of printing the matches")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.catalog):
+        print(f"Catalog {args.catalog} does not exist. Run a scraper first.")
+        return 1
+
+    catalog = Catalog(args.catalog)
+    try:
+        started = time.perf_counter()
+        rows = catalog.query(
+            sources=args.sources,
+            file_formats=args.file_formats,
+            biosource=args.biosource,
+            organism=args.organism,
+            min_size=args.min_size,
+            max_size=args.max_size,
+            accession=args.accession,
+            assembly=args.assembly,
+            limit=args.limit,
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        catalog.close()
+
+    total = sum(row["file_size"] or 0 for row in rows)
+    print(f"{len(rows)} files, {total / 1024 ** 3:.1f} GiB ({elapsed * 1000:.1f} ms)")
+    if args.output:
+        write_table(to_manifest(rows), args.output)
+        print(f"Manifest written to {args.output}")
+    else:
+        for row in rows:
+            print(f"{row['source']}\t{row['accession']}\t{row['file_format'] or ''}\t{row['file_size'] or ''}\t{row['file_url'] or ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
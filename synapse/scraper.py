@@ -1,17 +1,53 @@
 import os
+import sys
 import requests
-import time
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from hic_common.columnar import write_table
+from hic_common.catalog import format_from_name, update_catalog
+from hic_common.client import bearer_auth, create_session
+from hic_common.ratelimit import configure_host
+from hic_common.sink import RecordSink
+
 # Constants
 SEARCH_URL = 'https://repo-prod.prod.sagebase.org/repo/v1/search'
 BUNDLE_URL_TEMPLATE = 'https://repo-prod.prod.sagebase.org/repo/v1/entity/{id}/bundle2'
 DOWNLOAD_URL_TEMPLATE = 'https://www.synapse.org/Portal/filehandleassociation?associatedObjectId={file_id}&associatedObjectType=FileEntity&fileHandleId={dataFileHandleId}'
 TARGET_FILES = ["hic", "bedpe", "bw", "bedgraph", "cool", "tsv", "csv", "bed"]
-RESULT_EXCEL_FILE = "synapse_files_metadata.xlsx"
+OUTPUT_FORMAT = "xlsx"  # "parquet" or "feather" for typed columnar output
+RESULT_EXCEL_FILE = f"synapse_files_metadata.{OUTPUT_FORMAT}"
+# Annotation columns vary per project, so only the fixed ones are typed
+OUTPUT_SCHEMA = {
+    "id": "string",
+    "name": "string",
+    "download_url": "string",
+}
+STREAM_FILE = "synapse_files_metadata.jsonl"  # Records are appended here as each bundle is processed
+EXPORT_EXCEL = True  # Compact the stream into RESULT_EXCEL_FILE once the crawl finishes
+UPDATE_CATALOG = True  # Upsert the records into the shared local catalog (hic_common.catalog)
 PAGE_SIZE = 50
-RATE_LIMIT_SECONDS = 0.4  # To avoid being throttled
+API_HOST = "repo-prod.prod.sagebase.org"
+
+USE_CACHE = True  # Serve repeat searches and bundles from the shared on-disk HTTP cache
+CONCURRENT = True  # Fetch minimal bundles through a worker pool
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 2.5  # Starting rate for the API; adapts to 429s from there
+MAX_REQUESTS_PER_SECOND = 10
+
+# collect_metadata only reads the entity and its annotations
+MINIMAL_BUNDLE_REQUEST = {
+    "includeEntity": True,
+    "includeAnnotations": True
+}
+
+BUNDLE_HEADERS = {
+    "accept": "application/json; charset=UTF-8",
+    "origin": "https://www.synapse.org",
+    "referer": "https://www.synapse.org/",
+    "content-type": "application/json; charset=UTF-8",
+}
 
 def get_auth_token():
     token = os.getenv("SYNAPSE_TOKEN")
@@ -21,13 +57,19 @@ def get_auth_token():
         exit(1)
     return token
 
-def get_common_headers(token):
-    return {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
+def get_session(token, pool_size=10):
+    """Build one pooled session carrying the bearer token and bundle headers"""
+    configure_host(API_HOST, REQUESTS_PER_SECOND, max_rate=MAX_REQUESTS_PER_SECOND)
+    # Search and bundle POSTs are read-only, so they are safe to cache; entries are kept per token
+    return create_session(
+        pool_size=pool_size,
+        headers=BUNDLE_HEADERS,
+        auth=bearer_auth(token),
+        cache=USE_CACHE,
+        cache_methods=("GET", "POST")
+    )
 
-def search_files(file_type, headers):
+def search_files(file_type, session, on_error=None):
     start = 0
     all_hits = []
 
@@ -45,7 +87,7 @@ def search_files(file_type, headers):
         }
 
         try:
-            response = requests.post(SEARCH_URL, json=query, headers=headers)
+            response = session.post(SEARCH_URL, json=query)
             response.raise_for_status()
             data = response.json()
             hits = data.get("hits", [])
@@ -56,14 +98,15 @@ def search_files(file_type, headers):
                 break  # Done paging
 
             start += PAGE_SIZE
-            time.sleep(RATE_LIMIT_SECONDS)
         except requests.exceptions.RequestException as e:
             print(f"❌ Error during search: {e}")
+            if on_error:
+                on_error(f"search:{file_type}:{start}", e)
             break
 
     return all_hits
 
-def fetch_bundle_info(file_id, headers):
+def fetch_bundle_info(file_id, session, on_error=None):
     url = BUNDLE_URL_TEMPLATE.format(id=file_id)
 
     payload = {
@@ -83,77 +126,156 @@ def fetch_bundle_info(file_id, headers):
         "includeRestrictionInformation": True
     }
 
-    extra_headers = {
-        "accept": "application/json; charset=UTF-8",
-        "origin": "https://www.synapse.org",
-        "referer": "https://www.synapse.org/",
-        "content-type": "application/json; charset=UTF-8",
-    }
+    try:
+        resp = session.post(url, json=payload)
+        if resp.status_code == 403:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Error fetching bundle for {file_id}: {e}")
+        if on_error:
+            on_error(file_id, e)
+        return None
 
-    combined_headers = {**headers, **extra_headers}
+def fetch_minimal_bundle(session, file_id, on_error=None):
+    """Fetch only the entity and annotations of a bundle over the pooled session"""
+    url = BUNDLE_URL_TEMPLATE.format(id=file_id)
 
     try:
-        resp = requests.post(url, json=payload, headers=combined_headers)
+        resp = session.post(url, json=MINIMAL_BUNDLE_REQUEST)
         if resp.status_code == 403:
             return None
         resp.raise_for_status()
         return resp.json()
     except requests.exceptions.RequestException as e:
         print(f"❌ Error fetching bundle for {file_id}: {e}")
+        if on_error:
+            on_error(file_id, e)
         return None
 
-def collect_metadata():
+def build_metadata(hit, bundle):
+    file_id = hit.get("id")
+    name = hit.get("name")
+
+    entity = bundle.get("entity", {})
+    annotations = bundle.get("annotations", {}).get("annotations", {})
+    dataFileHandleId = entity.get("dataFileHandleId")
+
+    download_url = DOWNLOAD_URL_TEMPLATE.format(
+        file_id=file_id, dataFileHandleId=dataFileHandleId
+    ) if dataFileHandleId else None
+
+    metadata = {
+        "id": file_id,
+        "name": name,
+        "download_url": download_url,
+    }
+
+    for key, value in annotations.items():
+        metadata[key] = ", ".join(value.get("value", []))
+
+    return metadata
+
+def collect_metadata(sink=None, on_error=None):
+    """Collect one metadata record per matching file.
+
+    With a sink, records are appended to it as they are built and files it
+    already holds are skipped; otherwise the records are returned. Failed
+    searches and bundle fetches (other than 403s) go to `on_error(key, error)`.
+    """
     token = get_auth_token()
-    headers = get_common_headers(token)
     records = []
 
+    if CONCURRENT:
+        return collect_metadata_concurrent(token, sink=sink, on_error=on_error)
+
+    session = get_session(token)
+    done = sink.done_keys if sink else set()
+
     for filetype in TARGET_FILES:
         print(f"🔍 Searching files with type: {filetype}...")
-        hits = search_files(filetype, headers)
+        hits = search_files(filetype, session, on_error=on_error)
+        hits = [hit for hit in hits if hit.get("id") not in done]
 
         for hit in tqdm(hits, desc=f"Processing {filetype}"):
-            file_id = hit.get("id")
-            name = hit.get("name")
-
-            bundle = fetch_bundle_info(file_id, headers)
-            time.sleep(RATE_LIMIT_SECONDS)
+            bundle = fetch_bundle_info(hit.get("id"), session, on_error=on_error)
 
             if bundle is None:
                 continue
 
-            entity = bundle.get("entity", {})
-            annotations = bundle.get("annotations", {}).get("annotations", {})
-            dataFileHandleId = entity.get("dataFileHandleId")
+            store_record(build_metadata(hit, bundle), records, sink)
 
-            download_url = DOWNLOAD_URL_TEMPLATE.format(
-                file_id=file_id, dataFileHandleId=dataFileHandleId
-            ) if dataFileHandleId else None
+    return records
 
-            metadata = {
-                "id": file_id,
-                "name": name,
-                "download_url": download_url,
-            }
+def collect_metadata_concurrent(token, max_workers=None, sink=None, on_error=None):
+    """Fetch minimal bundles for all hits through a bounded pool sharing one session and rate limit"""
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    session = get_session(token, pool_size=max_workers)
+    done = sink.done_keys if sink else set()
+    records = []
 
-            for key, value in annotations.items():
-                metadata[key] = ", ".join(value.get("value", []))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for filetype in TARGET_FILES:
+            print(f"🔍 Searching files with type: {filetype}...")
+            hits = search_files(filetype, session, on_error=on_error)
+            hits = [hit for hit in hits if hit.get("id") not in done]
 
-            records.append(metadata)
+            bundles = executor.map(lambda hit: fetch_minimal_bundle(session, hit.get("id"), on_error=on_error), hits)
+            for hit, bundle in tqdm(zip(hits, bundles), total=len(hits), desc=f"Processing {filetype}"):
+                if bundle is None:
+                    continue
+                store_record(build_metadata(hit, bundle), records, sink)
 
     return records
 
+def catalog_record(metadata):
+    """Map a metadata record onto the cross-source catalog columns; annotations vary, so the common ones are looked up"""
+    name = metadata.get("name") or ""
+    return {
+        "source": "synapse",
+        "accession": metadata.get("id"),
+        "title": name,
+        "file_url": metadata.get("download_url"),
+        "file_format": format_from_name(name),
+        "biosource": metadata.get("cellType") or metadata.get("tissue") or metadata.get("biosampleType"),
+        "organism": metadata.get("species") or metadata.get("organism"),
+        "assay": metadata.get("assay"),
+        "extra": {key: value for key, value in metadata.items() if key not in ("id", "name", "download_url")},
+    }
+
+def store_record(metadata, records, sink):
+    if sink:
+        sink.write(metadata["id"], [metadata])
+    else:
+        records.append(metadata)
+
 def write_to_excel(records):
     if not records:
         print("⚠️ No data to write.")
         return
 
-    df = pd.DataFrame(records)
-    df.to_excel(RESULT_EXCEL_FILE, index=False)
+    write_table(records, RESULT_EXCEL_FILE, schema=OUTPUT_SCHEMA)
     print(f"✅ Metadata written to {RESULT_EXCEL_FILE}")
 
 def main():
-    records = collect_metadata()
-    write_to_excel(records)
+    sink = RecordSink(STREAM_FILE)
+    if sink.done_keys:
+        print(f"↩️ Resuming, {len(sink.done_keys)} files already in {STREAM_FILE}")
+
+    failures = {}
+    collect_metadata(sink=sink, on_error=failures.__setitem__)
+
+    if EXPORT_EXCEL:
+        write_to_excel(list(sink.iter_rows()))
+    if UPDATE_CATALOG:
+        update_catalog(catalog_record(row) for row in sink.iter_rows())
+    sink.close(complete=not failures)
+    if failures:
+        print(f"❌ {len(failures)} fetches failed, rerun to resume from {STREAM_FILE}")
+        sys.exit(1)
+    return RESULT_EXCEL_FILE if EXPORT_EXCEL else None
 
 if __name__ == "__main__":
     main()
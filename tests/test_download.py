@@ -0,0 +1,93 @@
+import hashlib
+import itertools
+import json
+import os
+import random
+
+import pytest
+
+from hic_common.download import PART_SUFFIX, SEGMENTS_SUFFIX, StreamHasher, discard_segmented_part, split_ranges
+
+DATA = random.Random(0).randbytes(10000)
+PIECE = 333  # Bytes per simulated network chunk
+
+
+def write_segments(path, ranges, order):
+    """Fill the rest of each segment in PIECE-sized writes, visiting them in `order`, and return the hasher."""
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.truncate(len(DATA))
+    hasher = StreamHasher(path, ranges)
+    with open(path, "r+b") as f:
+        for index in order:
+            segment = ranges[index]
+            start, end, _ = segment
+            while start + segment[2] <= end:
+                offset = start + segment[2]
+                data = DATA[offset:min(offset + PIECE, end + 1)]
+                f.seek(offset)
+                f.write(data)
+                f.flush()
+                hasher.written(segment, data)
+    return hasher
+
+
+@pytest.mark.parametrize("order", list(itertools.permutations(range(4))))
+def test_stream_hasher_matches_md5_whatever_order_segments_finish(tmp_path, order):
+    ranges = [[start, end, 0] for start, end in split_ranges(len(DATA), 4)]
+    hasher = write_segments(str(tmp_path / "file"), ranges, order)
+    assert hasher.hexdigest() == hashlib.md5(DATA).hexdigest()
+
+
+def test_stream_hasher_interleaved_segments(tmp_path):
+    path = str(tmp_path / "file")
+    with open(path, "wb") as f:
+        f.truncate(len(DATA))
+    ranges = [[start, end, 0] for start, end in split_ranges(len(DATA), 3)]
+    hasher = StreamHasher(path, ranges)
+    # Round-robin from the last segment backwards, as concurrent connections would
+    with open(path, "r+b") as f:
+        while any(start + done <= end for start, end, done in ranges):
+            for segment in reversed(ranges):
+                start, end, done = segment
+                if start + done > end:
+                    continue
+                offset = start + done
+                data = DATA[offset:min(offset + PIECE, end + 1)]
+                f.seek(offset)
+                f.write(data)
+                f.flush()
+                hasher.written(segment, data)
+    assert hasher.hexdigest() == hashlib.md5(DATA).hexdigest()
+
+
+def test_stream_hasher_reads_back_a_resumed_prefix(tmp_path):
+    path = str(tmp_path / "file")
+    ranges = [[start, end, 0] for start, end in split_ranges(len(DATA), 2)]
+    # An earlier attempt already wrote part of both segments
+    with open(path, "wb") as f:
+        f.truncate(len(DATA))
+        for segment in ranges:
+            segment[2] = 1000
+            f.seek(segment[0])
+            f.write(DATA[segment[0]:segment[0] + 1000])
+    hasher = write_segments(path, ranges, [1, 0])
+    assert hasher.hexdigest() == hashlib.md5(DATA).hexdigest()
+
+
+def test_discard_segmented_part_removes_preallocated_part(tmp_path):
+    path = str(tmp_path / "file.hic")
+    with open(path + PART_SUFFIX, "wb") as f:
+        f.truncate(len(DATA))
+    with open(path + PART_SUFFIX + SEGMENTS_SUFFIX, "w") as f:
+        json.dump({"size": len(DATA), "ranges": [[0, len(DATA) - 1, 10]]}, f)
+    discard_segmented_part(path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_discard_segmented_part_keeps_single_stream_part(tmp_path):
+    path = str(tmp_path / "file.hic")
+    with open(path + PART_SUFFIX, "wb") as f:
+        f.write(DATA[:100])
+    discard_segmented_part(path)
+    assert os.listdir(tmp_path) == ["file.hic" + PART_SUFFIX]
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from hic_common.json_stream import JSONStream, iter_graph
+
+DOCUMENT = json.dumps({
+    "notification": "Success",
+    "facets": [{"field": "type", "terms": [{"key": "File", "doc_count": 12}]}],
+    "total": 3,
+    "@graph": [
+        {
+            "@id": "/files/ENCFF001AAA/",
+            "title": "quote \" backslash \\ slash / newline \n tab \t",
+            "unicode": "é ü → 中文 \U0001f9ec",
+            "file_size": 1234567890123,
+            "ratio": -0.000123,
+            "exponent": 6.02e23,
+            "negative_exponent": -1.5E-10,
+            "flags": [True, False, None],
+            "nested": {"lab": {"title": "Lab, Inc.", "ids": [1, 22, 333]}, "empty": {}},
+        },
+        [],
+        12,
+        -7.25,
+        "a string with }] and {[ inside",
+        {"deep": [[[{"x": [0, 0.5, 1e3]}]]]},
+    ],
+    "trailing": {"ignored": [1, 2, 3]},
+}, ensure_ascii=False)
+
+
+class FakeResponse:
+    """Just enough of requests.Response for iter_graph: raw bytes served in fixed-size pieces."""
+
+    encoding = "utf-8"
+
+    def __init__(self, body, piece_size):
+        self.body = body.encode("utf-8")
+        self.piece_size = piece_size
+
+    def iter_content(self, chunk_size=None):
+        for start in range(0, len(self.body), self.piece_size):
+            yield self.body[start:start + self.piece_size]
+
+
+@pytest.mark.parametrize("piece_size", range(1, len(DOCUMENT.encode("utf-8")) + 1))
+def test_iter_graph_matches_json_loads_at_every_chunk_size(piece_size):
+    # Pieces split numbers, escapes and multi-byte characters at every possible offset
+    items = list(iter_graph(FakeResponse(DOCUMENT, piece_size)))
+    assert items == json.loads(DOCUMENT)["@graph"]
+
+
+def test_number_at_end_of_input_is_complete():
+    stream = JSONStream(iter(["[1", "2", ".", "5", "e", "-", "3"]))
+    stream.expect("[")
+    assert stream.value() == 12.5e-3
+
+
+def test_missing_graph_raises_key_error():
+    with pytest.raises(KeyError):
+        list(iter_graph(FakeResponse(json.dumps({"total": 0}), 7)))
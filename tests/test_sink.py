@@ -0,0 +1,54 @@
+import json
+
+from hic_common.sink import RecordSink
+
+
+def write_records(path, count):
+    sink = RecordSink(path)
+    for index in range(count):
+        sink.write(f"key{index}", [{"id": index, "text": "x" * index}], meta={"index": index})
+    sink.checkpoint()
+    return sink
+
+
+def test_reopening_after_a_torn_last_line_keeps_the_whole_records(tmp_path):
+    path = str(tmp_path / "rows.jsonl")
+    write_records(path, 5).close()
+    with open(path, "rb") as f:
+        whole = f.read()
+    # A crash mid-write leaves part of a sixth line behind
+    torn = json.dumps({"key": "key5", "rows": [{"id": 5}], "meta": {}}).encode()[:20]
+    with open(path, "ab") as f:
+        f.write(torn)
+
+    sink = RecordSink(path)
+    assert sink.done_keys == {f"key{index}" for index in range(5)}
+    assert sink.meta()["key3"] == {"index": 3}
+    with open(path, "rb") as f:
+        assert f.read() == whole  # The torn bytes are truncated away
+
+    sink.write("key5", [{"id": 5}])
+    sink.close()
+    assert [row["id"] for row in RecordSink(path).iter_rows()] == [0, 1, 2, 3, 4, 5]
+
+
+def test_a_complete_line_without_its_newline_counts_as_torn(tmp_path):
+    path = str(tmp_path / "rows.jsonl")
+    write_records(path, 2).close()
+    with open(path, "ab") as f:
+        f.write(json.dumps({"key": "key2", "rows": [], "meta": {}}).encode())
+
+    assert RecordSink(path).done_keys == {"key0", "key1"}
+
+
+def test_incomplete_run_resumes_and_complete_run_starts_over(tmp_path):
+    path = str(tmp_path / "rows.jsonl")
+    write_records(path, 3).close(complete=False)
+    sink = RecordSink(path)
+    assert sink.done_keys == {"key0", "key1", "key2"}
+    sink.close(complete=True)
+
+    sink = RecordSink(path)
+    assert sink.done_keys == set()
+    assert list(sink.iter_rows()) == []
+    sink.close()
@@ -0,0 +1,81 @@
+"""Find truncated or corrupt downloads without reading them in full.
+
+Usage: python verify_downloads.py [path ...] [--workers N] [--quarantine] [--json report.json]
+
+Each file is memory-mapped and only its header and index structures are
+checked: the .hic magic plus footer, master index and normalization
+vector offsets within the file, the HDF5 superblock end-of-file address
+for .cool/.mcool, the bigWig magic and data/zoom index offsets, and the
+BGZF end-of-file block for .bam and bgzipped .vcf.gz. Plain gzip files
+(such as non-bgzipped .vcf.gz) have no end marker, so they are inflated
+in full to check each member's CRC32/size trailer. Files are recognised by
+their magic bytes, so store blobs without an extension are covered too.
+Without paths the default download folders and the shared store are
+checked. --quarantine renames bad files to <name>.corrupt so the
+downloaders fetch them again. Exits with status 1 if anything is bad.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+from hic_common.download import CORRUPT_SUFFIX
+from hic_common.store import DEFAULT_STORE_DIR
+from hic_common.verify import VERIFY_WORKERS, verify_paths
+
+DEFAULT_PATHS = [
+    os.path.join(ROOT, "4dn", "downloads"),
+    os.path.join(ROOT, "cavatica", "CBTN-X01"),
+    os.path.join(DEFAULT_STORE_DIR, "objects"),
+]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Check downloaded Hi-C, cooler, bigWig and BGZF files for truncation")
+    parser.add_argument("paths", nargs="*", help="files or folders (default: the download folders and the store)")
+    parser.add_argument("--workers", type=int, default=VERIFY_WORKERS)
+    parser.add_argument("--quarantine", action="store_true", help=f"rename bad files to <name>{CORRUPT_SUFFIX}")
+    parser.add_argument("--json", help="also write the results here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = args.paths or [path for path in DEFAULT_PATHS if os.path.exists(path)]
+    if not paths:
+        print("Nothing to check: no download folders found. Pass the paths to check.")
+        return 0
+
+    started = time.perf_counter()
+    results = verify_paths(paths, workers=args.workers)
+    elapsed = time.perf_counter() - started
+
+    checked = [(path, kind) for path, kind, problem in results if kind and not problem]
+    bad = [(path, kind, problem) for path, kind, problem in results if problem]
+    skipped = len(results) - len(checked) - len(bad)
+    size = sum(os.path.getsize(path) for path, _, _ in results if os.path.exists(path))
+    counts = {}
+    for _, kind in checked:
+        counts[kind] = counts.get(kind, 0) + 1
+
+    for path, kind, problem in bad:
+        print(f"❌ {path}: {problem}")
+        if args.quarantine:
+            os.replace(path, path + CORRUPT_SUFFIX)
+    print(f"Checked {len(results)} files ({size / 1024 ** 3:.1f} GiB) in {elapsed:.1f}s: "
+          f"{len(checked)} ok ({', '.join(f'{count} {kind}' for kind, count in sorted(counts.items())) or 'none'}), "
+          f"{len(bad)} bad, {skipped} of unknown format skipped")
+    if bad and args.quarantine:
+        print(f"Bad files renamed to *{CORRUPT_SUFFIX}; rerun the downloader to fetch them again")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([{"path": path, "format": kind, "problem": problem} for path, kind, problem in results], f, indent=2)
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())